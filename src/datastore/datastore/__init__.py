@@ -42,6 +42,131 @@ class DuplicateKeyException(DatastoreException):
     pass
 
 
+class BulkWriteException(DatastoreException):
+    def __init__(self, message, errors=None, ids=None):
+        super(BulkWriteException, self).__init__(message)
+        self.errors = errors or []
+        self.ids = ids or []
+
+
+class DatastoreBase(object):
+    """
+    Bulk operations shared by all drivers. The defaults fall back to the
+    single-row calls, drivers override them to save round-trips.
+
+    update_fields() changes only the given top-level fields of a single
+    object and leaves the rest of the stored document untouched.
+
+    reserve_pkeys() atomically allocates a block of serial primary keys,
+    so that callers can assign ids before writing. Drivers that keep their
+    own counters implement it.
+
+    notify_change() tells other processes that objects of a collection were
+    modified behind the datastore's back, e.g. to drop their caches.
+    register_change_callback() subscribes to those notifications and returns
+    False when the driver cannot deliver them. Drivers that deliver them also
+    announce bulk writes to and drops of configstore collections themselves.
+    receiving_changes() tells whether notifications are currently coming in;
+    caches built on them must not be used otherwise.
+
+    watch_collections() starts following changes made by other processes and
+    collection_cache_stats() reports the collection descriptor cache; both do
+    nothing for drivers that do not cache descriptors.
+
+    Primary keys come from the ``id`` field of each object or from a
+    parallel ``pkeys`` list. Ordered writes stop at the first failing row,
+    unordered ones carry on; failures are reported together in a
+    BulkWriteException.
+    """
+
+    def _bulk(self, fn, objs, pkeys, ordered):
+        ids = []
+        errors = []
+        for idx, obj in enumerate(objs):
+            pkey = pkeys[idx] if pkeys else get_pkey(obj)
+            try:
+                ids.append(fn(obj, pkey))
+            except DatastoreException as err:
+                errors.append({'index': idx, 'id': pkey, 'message': str(err)})
+                if ordered:
+                    break
+
+        if errors:
+            raise BulkWriteException('{0} rows failed'.format(len(errors)), errors, ids)
+
+        return ids
+
+    def insert_many(self, collection, objs, pkeys=None, ordered=True, timestamp=True, config=False):
+        return self._bulk(
+            lambda o, p: self.insert(collection, o, pkey=p, timestamp=timestamp, config=config),
+            objs, pkeys, ordered
+        )
+
+    def update_many(self, collection, objs, pkeys=None, ordered=True, timestamp=True, config=False):
+        def update(obj, pkey):
+            self.update(collection, pkey, obj, timestamp=timestamp, config=config)
+            return pkey
+
+        return self._bulk(update, objs, pkeys, ordered)
+
+    def upsert_many(self, collection, objs, pkeys=None, ordered=True, timestamp=True, config=False):
+        def upsert(obj, pkey):
+            self.update(collection, pkey, obj, upsert=True, timestamp=timestamp, config=config)
+            return pkey
+
+        return self._bulk(upsert, objs, pkeys, ordered)
+
+    def update_fields(self, collection, pkey, fields, timestamp=True):
+        obj = self.get_by_id(collection, pkey)
+        if obj is None:
+            raise DatastoreException('Object {0} not found in {1}'.format(pkey, collection))
+
+        obj.update(fields)
+        self.update(collection, pkey, obj, timestamp=timestamp)
+
+    def reserve_pkeys(self, collection, count=1):
+        raise DatastoreException('Primary key reservation is not supported by this driver')
+
+    def notify_change(self, collection, ids=None):
+        pass
+
+    def register_change_callback(self, callback):
+        return False
+
+    def receiving_changes(self):
+        return False
+
+    def watch_collections(self):
+        pass
+
+    def collection_cache_stats(self):
+        return {}
+
+    def delete_many(self, collection, *args, **kwargs):
+        ids = kwargs.pop('ids', None)
+        if ids is None and not args:
+            raise DatastoreException('delete_many() needs either a list of ids or a predicate')
+
+        if args:
+            if ids is not None:
+                args = (('id', 'in', list(ids)),) + args
+
+            ids = [i['id'] for i in self.query(collection, *args)]
+
+        for i in ids:
+            self.delete(collection, i)
+
+        return len(ids)
+
+
+def get_pkey(obj):
+    if hasattr(obj, '__getstate__'):
+        obj = obj.__getstate__()
+
+    if isinstance(obj, dict):
+        return obj.get('id')
+
+
 def parse_config(path):
     try:
         f = open(path, 'r')
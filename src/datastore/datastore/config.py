@@ -26,6 +26,8 @@
 #####################################################################
 
 import re
+import copy
+import threading
 from datastore import DatastoreException
 
 
@@ -90,33 +92,106 @@ class ConfigNode(object):
 
 
 class ConfigStore(object):
+    """
+    Read-through cache over the 'config' collection.
+
+    Values and children listings are cached in-process. Local writes drop
+    the affected entries and are announced through the datastore so that
+    every other process holding a ConfigStore drops them too. The cache is
+    only used while the datastore driver is receiving these notifications.
+    """
+
     def __init__(self, datastore):
         self.__datastore = datastore
         if not self.__datastore.collection_exists('config'):
             raise DatastoreException("'config' collection doesn't exist")
 
+        self.__lock = threading.RLock()
+        self.__values = {}
+        self.__children = {}
+        self.__generation = 0
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self.cached = self.__datastore.register_change_callback(self.__on_change)
+
     @staticmethod
     def create(datastore):
         datastore.collection_create('config', 'ltree', 'config')
 
+    def __on_change(self, collection, ids):
+        if collection in (None, 'config'):
+            self.invalidate(ids)
+
+    def __lookup(self, cache, key, fetch):
+        if not self.cached or not self.__datastore.receiving_changes():
+            return fetch()
+
+        with self.__lock:
+            if key in cache:
+                self.stats['hits'] += 1
+                return copy.deepcopy(cache[key])
+
+            self.stats['misses'] += 1
+            generation = self.__generation
+
+        value = fetch()
+        with self.__lock:
+            # Don't store a value that might have been changed while we were reading it
+            if generation == self.__generation:
+                cache[key] = value
+
+        return copy.deepcopy(value)
+
+    def __fetch(self, key):
+        return self.__datastore.get_one('config', ('id', '=', key))
+
+    def __changed(self, key):
+        self.invalidate([key])
+        self.__datastore.notify_change('config', [key])
+
+    def invalidate(self, keys=None):
+        with self.__lock:
+            self.__generation += 1
+            self.stats['invalidations'] += 1
+            self.__children.clear()
+            if keys is None:
+                self.__values.clear()
+                return
+
+            for i in keys:
+                self.__values.pop(i, None)
+
     def exists(self, key):
-        return self.__datastore.exists('config', ('id', '=', key))
+        return self.__lookup(self.__values, key, lambda: self.__fetch(key)) is not None
 
     def get(self, key, default=None):
-        ret = self.__datastore.get_one('config', ('id', '=', key))
+        ret = self.__lookup(self.__values, key, lambda: self.__fetch(key))
         return ret['value'] if ret is not None else default
 
     def set(self, key, value):
         self.__datastore.upsert('config', key, value, config=True)
+        self.__changed(key)
+
+    def delete(self, key):
+        self.__datastore.delete('config', key)
+        self.__changed(key)
 
     def list_children(self, key=None):
         if key is None:
-            return self.__datastore.query('config', wrap=False)
-        return self.__datastore.query('config', ('id', '~', '^' + key + '\..*'), wrap=False)
+            return self.__lookup(self.__children, None, lambda: self.__datastore.query('config', wrap=False))
+
+        return self.__lookup(
+            self.__children, key,
+            lambda: self.__datastore.query('config', ('id', '~', '^' + key + '\..*'), wrap=False)
+        )
 
     def children_dict(self, root):
         result = {}
-        for item in self.__datastore.query('config', ('id', '~', '^' + re.escape(root) + '\.[a-zA-Z0-9_]+\.')):
+        items = self.__lookup(
+            self.__children, ('dict', root),
+            lambda: self.__datastore.query('config', ('id', '~', '^' + re.escape(root) + '\.[a-zA-Z0-9_]+\.'))
+        )
+
+        for item in items:
             matched = item['id'][len(root) + 1:]
             key, _, value = matched.partition('.')
 
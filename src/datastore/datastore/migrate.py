@@ -30,21 +30,71 @@ import json
 import glob
 import imp
 import copy
+import time
+import random
+import threading
 import traceback
 import jsonpatch
-from datastore import DatastoreException
+from concurrent.futures import ThreadPoolExecutor
+from datastore import DatastoreException, BulkWriteException
+
+
+DEFAULT_BATCH_SIZE = 500
+PROGRESS_INTERVAL = 5
 
 
 logfile = None
+log_lock = threading.Lock()
 
 
 class MigrationException(DatastoreException):
     pass
 
 
+class MigrationProgress(object):
+    """
+    Counts objects processed by a migration and periodically logs
+    throughput and estimated time left.
+    """
+    def __init__(self, logger, total, interval=PROGRESS_INTERVAL):
+        self.logger = logger
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started_at = time.time()
+        self.reported_at = self.started_at
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started_at
+        return self.done / elapsed if elapsed else 0
+
+    def advance(self, count):
+        self.done += count
+        now = time.time()
+        if now - self.reported_at >= self.interval:
+            self.reported_at = now
+            self.report()
+
+    def report(self):
+        rate = self.rate
+        if self.total and rate:
+            eta = ', ETA {0:.0f}s'.format(max(self.total - self.done, 0) / rate)
+        else:
+            eta = ''
+
+        self.logger('{0}/{1} objects, {2:.0f} objects/s{3}'.format(self.done, self.total or '?', rate, eta))
+
+    def finish(self):
+        elapsed = time.time() - self.started_at
+        self.logger('{0} objects processed in {1:.1f}s ({2:.0f} objects/s)'.format(self.done, elapsed, self.rate))
+
+
 def log(s):
-    print(s)
-    print(s, file=logfile)
+    with log_lock:
+        print(s)
+        if logfile:
+            print(s, file=logfile)
 
 
 def log_indented(f, s):
@@ -52,8 +102,49 @@ def log_indented(f, s):
         f(' ' * 2 + line)
 
 
-def apply_migrations(ds, collection, directory, force=False):
+def count_objects(ds, collection):
+    try:
+        return ds.query(collection, count=True)
+    except (DatastoreException, TypeError):
+        return None
+
+
+def flush_batch(ds, collection, updates, deletes, mig_log):
+    failed = 0
+    if updates:
+        pkeys, objs = zip(*updates)
+        try:
+            ds.update_many(collection, list(objs), pkeys=list(pkeys), ordered=False)
+        except BulkWriteException as err:
+            for e in err.errors:
+                mig_log('failed to update migrated object <id:{0}>: {1}'.format(e['id'], e['message']))
+
+            failed += len(err.errors)
+
+    if deletes:
+        ds.delete_many(collection, ids=deletes)
+
+    updates.clear()
+    deletes.clear()
+    return failed
+
+
+def apply_migrations(ds, collection, directory, force=False, batch_size=DEFAULT_BATCH_SIZE, diff_sample=0):
+    """
+    Runs migration modules from directory against every object in the
+    collection. Objects are streamed in id order and written back in
+    batches of batch_size. JSON deltas are logged for a diff_sample
+    fraction of migrated objects (0 disables them, 1 logs all of them).
+
+    Because of the batching, a migration module whose probe() or apply()
+    reads other objects of the same collection sees them as they were before
+    the pending batch was written. Modules that depend on earlier results
+    set BATCHED = False to have every object written back before the next
+    one is migrated.
+    """
     log("Running migrations for collection {0}".format(collection))
+    query = getattr(ds, 'query_stream', ds.query)
+
     for f in sorted(glob.glob(os.path.join(directory, "*.py"))):
         name, _ = os.path.splitext(os.path.basename(f))
 
@@ -68,7 +159,10 @@ def apply_migrations(ds, collection, directory, force=False):
             log('[{0}, {1}] {2}'.format(collection, name, s))
 
         migrated = 0
+        failed = 0
         total = 0
+        updates = []
+        deletes = []
 
         log("[{0}] Applying migration {1}".format(collection, name))
 
@@ -76,50 +170,65 @@ def apply_migrations(ds, collection, directory, force=False):
             mig_log("Migration already applied")
             continue
 
-        for i in ds.query(collection, sort='id', dir='asc'):
+        progress = MigrationProgress(mig_log, count_objects(ds, collection))
+        mod_batch_size = batch_size if getattr(mod, 'BATCHED', True) else 1
+
+        for i in query(collection, sort='id', dir='asc'):
             total += 1
+            pkey = i['id']
             try:
                 if not mod.probe(i, ds):
-                    mig_log('Object <id:{0}> fails probe() condition, skipping'.format(i['id']))
+                    progress.advance(1)
                     continue
             except:
-                mig_log('probe() failed on object <id:{0}>'.format(i['id']))
+                mig_log('probe() failed on object <id:{0}>'.format(pkey))
                 log_indented(mig_log, traceback.format_exc())
                 raise MigrationException(traceback.format_exc())
 
-            old_obj = copy.deepcopy(i)
+            old_obj = copy.deepcopy(i) if diff_sample and random.random() < diff_sample else None
             try:
                 new_obj = mod.apply(i, ds)
-                diff = jsonpatch.make_patch(old_obj, new_obj)
+                diff = jsonpatch.make_patch(old_obj, new_obj or {}) if old_obj is not None else None
             except:
-                mig_log('apply() failed on object <id:{0}>:'.format(old_obj['id']))
+                mig_log('apply() failed on object <id:{0}>:'.format(pkey))
                 log_indented(mig_log, traceback.format_exc())
                 raise MigrationException(traceback.format_exc())
 
-            mig_log('Sucessfully migrated object <id:{0}>'.format(i['id']))
-            if diff.patch:
-                mig_log('JSON delta:')
-                log_indented(mig_log, json.dumps(diff.patch, indent=4))
-            else:
-                mig_log('Object unchanged after migration')
+            if diff is not None:
+                if diff.patch:
+                    mig_log('JSON delta for object <id:{0}>:'.format(pkey))
+                    log_indented(mig_log, json.dumps(diff.patch, indent=4, default=str))
+                else:
+                    mig_log('Object <id:{0}> unchanged after migration'.format(pkey))
 
             if not new_obj:
-                ds.delete(collection, old_obj['id'])
-                mig_log('Object deleted by migration')
-            else:
+                deletes.append(pkey)
+            elif new_obj.get('id', pkey) != pkey:
+                # Renamed objects go through update(), which re-creates them
+                # under the new key; keep the order of the pending writes
+                failed += flush_batch(ds, collection, updates, deletes, mig_log)
                 try:
-                    ds.update(collection, old_obj['id'], new_obj)
+                    ds.update(collection, pkey, new_obj)
                 except DatastoreException as err:
-                    mig_log('failed to upsert migrated object <id:{0}>: {1}'.format(new_obj['id'], str(err)))
-                    continue
+                    mig_log('failed to update migrated object <id:{0}>: {1}'.format(new_obj['id'], str(err)))
+                    failed += 1
+            else:
+                new_obj.pop('id', None)
+                updates.append((pkey, new_obj))
 
             migrated += 1
+            if len(updates) + len(deletes) >= mod_batch_size:
+                failed += flush_batch(ds, collection, updates, deletes, mig_log)
+
+            progress.advance(1)
 
-        mig_log("{0} out of {1} objects migrated".format(migrated, total))
+        failed += flush_batch(ds, collection, updates, deletes, mig_log)
+        progress.finish()
+        mig_log("{0} out of {1} objects migrated".format(migrated - failed, total))
         ds.collection_record_migration(collection, name)
 
 
-def migrate_collection(ds, dump, directory, force=False):
+def migrate_collection(ds, dump, directory, force=False, batch_size=DEFAULT_BATCH_SIZE, diff_sample=0):
     metadata = dump['metadata']
     data = dump['data']
     name = metadata['name']
@@ -128,7 +237,7 @@ def migrate_collection(ds, dump, directory, force=False):
     configstore = metadata['attributes'].get('configstore', False)
 
     if metadata['migration'] != 'replace' and directory and os.path.isdir(directory) and ds.collection_exists(name):
-        apply_migrations(ds, name, directory, force)
+        apply_migrations(ds, name, directory, force, batch_size, diff_sample)
 
     if metadata['migration'] == 'replace':
         ds.collection_delete(name)
@@ -142,50 +251,72 @@ def migrate_collection(ds, dump, directory, force=False):
     if metadata['migration'] == 'keep':
         return
 
-    for key, row in list(data.items()):
-        pkey = int(key) if integer else key
-        if metadata['migration'] == 'merge-preserve':
-            if not ds.exists(name, ('id', '=', pkey)):
-                ds.insert(name, row, pkey=pkey, config=configstore)
+    pkeys = [int(key) if integer else key for key in data]
+    rows = list(data.values())
 
-            continue
-
-        ds.update(name, pkey, row, upsert=upsert, config=configstore)
+    if metadata['migration'] == 'merge-preserve':
+        existing = set(ds.query(name, ('id', 'in', pkeys), select='id'))
+        missing = [i for i, pkey in enumerate(pkeys) if pkey not in existing]
+        ds.insert_many(name, [rows[i] for i in missing], pkeys=[pkeys[i] for i in missing], config=configstore)
+        return
 
+    if upsert:
+        ds.upsert_many(name, rows, pkeys=pkeys, config=configstore)
+    else:
+        ds.update_many(name, rows, pkeys=pkeys, config=configstore)
 
-def migrate_db(ds, dump, migpath=None, types=None, force=False):
-    global logfile
-
-    # Open logfile
-    filename = '/var/tmp/dsmigrate.{0}.log'.format(os.getpid())
-    logfile = open(filename, 'w')
 
+def filter_dump(dump, types=None):
     for i in dump:
-        metadata = i['metadata']
-        data = i['data']
-        name = metadata['name']
-        attrs = metadata['attributes']
-        integer = metadata['pkey-type'] == 'integer'
-
+        attrs = i['metadata']['attributes']
         if types and 'type' in attrs.keys() and attrs['type'] not in types:
             continue
 
-        if not ds.collection_exists(name):
-            ds.collection_create(name, metadata['pkey-type'], metadata['attributes'])
-            for key, row in list(data.items()):
-                pkey = int(key) if integer else key
-                ds.insert(name, row, pkey=pkey)
+        yield i
 
-            print("Created missing collection {0}".format(name))
 
-    for i in dump:
-        metadata = i['metadata']
-        attrs = metadata['attributes']
-        if types and 'type' in attrs.keys() and attrs['type'] not in types:
-            continue
-
-        directory = os.path.join(migpath, metadata['name']) if migpath else None
-        migrate_collection(ds, i, directory, force)
-        print("Migrated collection {0}".format(metadata['name']), file=logfile)
+def migrate_db(ds, dump, migpath=None, types=None, force=False, batch_size=DEFAULT_BATCH_SIZE,
+               diff_sample=0, jobs=1, logpath=None):
+    """
+    Creates collections missing from the datastore, then migrates each
+    collection of the dump. With jobs > 1 collections are migrated in
+    parallel; only use that with drivers that allow concurrent use of a
+    single connection.
+    """
+    global logfile
 
-    logfile.close()
+    # Open logfile
+    filename = logpath or '/var/tmp/dsmigrate.{0}.log'.format(os.getpid())
+    logfile = open(filename, 'w')
+    dump = list(filter_dump(dump, types))
+
+    try:
+        for i in dump:
+            metadata = i['metadata']
+            data = i['data']
+            name = metadata['name']
+            integer = metadata['pkey-type'] == 'integer'
+
+            if not ds.collection_exists(name):
+                ds.collection_create(name, metadata['pkey-type'], metadata['attributes'])
+                pkeys = [int(key) if integer else key for key in data]
+                ds.insert_many(name, list(data.values()), pkeys=pkeys)
+
+                log("Created missing collection {0}".format(name))
+
+        def migrate(i):
+            name = i['metadata']['name']
+            directory = os.path.join(migpath, name) if migpath else None
+            migrate_collection(ds, i, directory, force, batch_size, diff_sample)
+            log("Migrated collection {0}".format(name))
+
+        if jobs > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                for f in [executor.submit(migrate, i) for i in dump]:
+                    f.result()
+        else:
+            for i in dump:
+                migrate(i)
+    finally:
+        logfile.close()
+        logfile = None
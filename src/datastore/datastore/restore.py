@@ -38,9 +38,8 @@ def restore_collection(ds, dump):
     ds.collection_create(name, metadata['pkey-type'], metadata['attributes'])
     configstore = False
 
-    for key, row in list(data.items()):
-        pkey = int(key) if integer else key
-        ds.insert(name, row, pkey=pkey, config=configstore)
+    pkeys = [int(key) if integer else key for key in data]
+    ds.insert_many(name, list(data.values()), pkeys=pkeys, config=configstore)
 
 
 def restore_db(ds, dump, types=None, progress_callback=None):
@@ -26,9 +26,13 @@
 #####################################################################
 
 
+import re
 import time
 import copy
 import uuid
+import logging
+import weakref
+import threading
 import dateutil.parser
 from datetime import datetime
 from pymongo import MongoClient
@@ -36,10 +40,17 @@ import pymongo
 import pymongo.errors
 import pymongo.cursor
 from six import string_types
-from datastore import DatastoreException, DuplicateKeyException
+from pymongo import InsertOne, ReplaceOne, ReturnDocument
+from datastore import DatastoreBase, DatastoreException, DuplicateKeyException, BulkWriteException
 from freenas.utils.query import get
 
 
+COLLECTION_CHANGES = 'collections_changes'
+COLLECTION_CHANGES_SIZE = 1024 * 1024
+COLLECTION_COUNTERS = 'collections_counters'
+SERIAL_PKEY_TYPES = ('serial', 'integer')
+
+
 def auto_retry(fn):
     def wrapped(*args, **kwargs):
         for i in range(0, 15):
@@ -58,13 +69,22 @@ def auto_retry(fn):
     return wrapped
 
 
-class MongodbDatastore(object):
+class MongodbDatastore(DatastoreBase):
     def __init__(self):
         self.conn_db = None
         self.conn_log = None
         self.db = None
         self.log_db = None
         self.connected = False
+        self.collections_cache = {}
+        self.collections_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self.collections_watcher = None
+        self.changes_ready = False
+        self.logger = logging.getLogger('MongodbDatastore')
+        self.seeded_counters = set()
+        self.change_callbacks = []
+        self.watching = threading.Event()
+        self.instance_id = str(uuid.uuid4())
         self.operators_table = {
             '>': '$gt',
             '<': '$lt',
@@ -140,8 +160,242 @@ class MongodbDatastore(object):
 
         return {'$and': result} if len(result) > 0 else {}
 
+    def _get_collection(self, name):
+        c = self.collections_cache.get(name)
+        if c is not None:
+            self.collections_cache_stats['hits'] += 1
+            return c
+
+        self.collections_cache_stats['misses'] += 1
+        c = self.db['collections'].find_one({"_id": name})
+        if c is not None:
+            self.collections_cache[name] = c
+
+        return c
+
+    def _invalidate_collection(self, name=None, notify=True):
+        self.collections_cache_stats['invalidations'] += 1
+        if name is None:
+            self.collections_cache.clear()
+        else:
+            self.collections_cache.pop(name, None)
+
+        if notify:
+            # Let other processes know that their copy of the descriptor is stale
+            try:
+                self._ensure_changes_collection()
+                self.db[COLLECTION_CHANGES].insert_one({'name': name, 'timestamp': datetime.utcnow()})
+            except pymongo.errors.PyMongoError:
+                pass
+
+    def _ensure_changes_collection(self):
+        # Must run before the first write to the changes collection, MongoDB
+        # would create it implicitly as a regular one otherwise
+        if self.changes_ready:
+            return
+
+        changes = self.db[COLLECTION_CHANGES]
+        options = changes.options()
+        if options and not options.get('capped'):
+            # Created implicitly by an older writer, it cannot be tailed
+            self.logger.warning('Recreating {0} as a capped collection'.format(COLLECTION_CHANGES))
+            changes.drop()
+            options = {}
+
+        if not options:
+            try:
+                self.db.create_collection(COLLECTION_CHANGES, capped=True, size=COLLECTION_CHANGES_SIZE)
+            except pymongo.errors.CollectionInvalid:
+                # Another process was faster
+                pass
+
+        self.changes_ready = True
+
+    def _seed_changes(self):
+        # Tailable cursors on an empty capped collection die right away
+        self._ensure_changes_collection()
+        return self.db[COLLECTION_CHANGES].insert_one({'seed': True, 'timestamp': datetime.utcnow()}).inserted_id
+
+    def _watch_collections(self):
+        changes = self.db[COLLECTION_CHANGES]
+        last = None
+        while self.connected:
+            try:
+                self._ensure_changes_collection()
+                if last is None:
+                    record = changes.find_one(sort=[('$natural', pymongo.DESCENDING)])
+                    last = record['_id'] if record else self._seed_changes()
+
+                # ObjectIds generated by different processes are not ordered,
+                # so resume by skipping up to the last record seen in natural
+                # (insertion) order
+                skipping = True
+                newest = None
+                cur = changes.find(cursor_type=pymongo.cursor.CursorType.TAILABLE_AWAIT)
+                while self.connected and cur.alive:
+                    for i in cur:
+                        if skipping:
+                            skipping = i['_id'] != last
+                            newest = i['_id']
+                            continue
+
+                        last = i['_id']
+                        if i.get('seed'):
+                            continue
+
+                        if not i.get('data'):
+                            self._invalidate_collection(i.get('name'), notify=False)
+                        elif i.get('origin') != self.instance_id:
+                            self._data_changed(i.get('name'), i.get('ids'))
+
+                    # The cursor is up and everything before it was handled
+                    self.watching.set()
+                    if skipping:
+                        # Went through all records without finding the last
+                        # one seen, it was pushed out of the capped collection
+                        # and changes were lost meanwhile
+                        self._invalidate_collection(notify=False)
+                        self._data_changed(None, None)
+                        skipping = False
+                        last = newest
+            except pymongo.errors.PyMongoError as err:
+                self.logger.warning('Cannot watch {0}: {1}'.format(COLLECTION_CHANGES, str(err)))
+                # Verify the collection again on the next pass
+                self.changes_ready = False
+                if self.watching.is_set():
+                    # Caches cannot be trusted until the cursor is back
+                    self.watching.clear()
+                    self._data_changed(None, None)
+
+            time.sleep(1)
+
+    def _data_changed(self, collection, ids):
+        for ref in list(self.change_callbacks):
+            cb = ref()
+            if cb is None:
+                # Owner was garbage collected
+                try:
+                    self.change_callbacks.remove(ref)
+                except ValueError:
+                    pass
+
+                continue
+
+            try:
+                cb(collection, ids)
+            except Exception:
+                pass
+
+    def watch_collections(self):
+        if self.collections_watcher:
+            return
+
+        try:
+            self._ensure_changes_collection()
+            if not self.db[COLLECTION_CHANGES].find_one():
+                self._seed_changes()
+        except pymongo.errors.PyMongoError as err:
+            # The watcher keeps retrying
+            self.logger.warning('Cannot prepare {0}: {1}'.format(COLLECTION_CHANGES, str(err)))
+
+        self.collections_watcher = threading.Thread(target=self._watch_collections, daemon=True)
+        self.collections_watcher.start()
+
+    def notify_change(self, collection, ids=None):
+        try:
+            self._ensure_changes_collection()
+            self.db[COLLECTION_CHANGES].insert_one({
+                'name': collection,
+                'ids': ids,
+                'data': True,
+                'origin': self.instance_id,
+                'timestamp': datetime.utcnow()
+            })
+        except pymongo.errors.PyMongoError:
+            pass
+
+    def _is_config_collection(self, name):
+        c = self._get_collection(name)
+        return name == 'config' or bool(c and c.get('attributes', {}).get('configstore'))
+
+    def _config_changed(self, collection, ids=None, force=False):
+        # Bulk writes bypass ConfigStore, so tell its caches here and in
+        # other processes about them
+        if force or self._is_config_collection(collection):
+            self._data_changed(collection, ids)
+            self.notify_change(collection, ids)
+
+    def register_change_callback(self, callback):
+        # Bound methods are held weakly, so that short-lived owners such as
+        # per-task ConfigStores are not kept alive by the datastore
+        if hasattr(callback, '__self__'):
+            self.change_callbacks.append(weakref.WeakMethod(callback))
+        else:
+            self.change_callbacks.append(lambda: callback)
+
+        self.watch_collections()
+        return True
+
+    def receiving_changes(self):
+        return self.watching.is_set()
+
+    def collection_cache_stats(self):
+        stats = dict(self.collections_cache_stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['size'] = len(self.collections_cache)
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _prepare(self, obj, config, deep=False):
+        if hasattr(obj, '__getstate__'):
+            return obj.__getstate__()
+
+        if type(obj) is not dict or config:
+            return {'value': obj}
+
+        return copy.deepcopy(obj) if deep else copy.copy(obj)
+
+    def _bulk_write(self, collection, requests, pkeys, ordered):
+        if not requests:
+            return []
+
+        try:
+            self._get_db(collection).bulk_write(requests, ordered=ordered)
+        except pymongo.errors.BulkWriteError as err:
+            errors = [
+                {'index': e['index'], 'id': pkeys[e['index']], 'message': e.get('errmsg')}
+                for e in err.details.get('writeErrors', [])
+            ]
+
+            failed = set(e['index'] for e in errors)
+            if ordered:
+                ids = pkeys[:min(failed)] if failed else []
+            else:
+                ids = [p for i, p in enumerate(pkeys) if i not in failed]
+
+            if ids:
+                self._config_changed(collection, ids)
+
+            raise BulkWriteException('{0} rows failed'.format(len(errors)), errors, ids)
+
+        self._config_changed(collection, pkeys)
+        return pkeys
+
+    def _bump_counter(self, collection, value):
+        counters = self.db[COLLECTION_COUNTERS]
+        try:
+            counters.update_one({'_id': collection}, {'$max': {'seq': value}}, upsert=True)
+        except pymongo.errors.DuplicateKeyError:
+            # Lost the upsert race against another process, the counter exists now
+            counters.update_one({'_id': collection}, {'$max': {'seq': value}})
+
+    def _sync_counter(self, collection):
+        ret = self._get_db(collection).find_one(sort=[('_id', pymongo.DESCENDING)], projection={'_id': True})
+        self._bump_counter(collection, ret['_id'] if ret else 0)
+        self.seeded_counters.add(collection)
+
     def _get_db(self, collection):
-        c = self.db['collections'].find_one({"_id": collection})
+        c = self._get_collection(collection)
         if not c:
             raise DatastoreException('Collection {0} not found'.format(collection))
 
@@ -161,8 +415,16 @@ class MongodbDatastore(object):
             self.log_db = self.conn_log[database]
 
         self.connected = True
+        try:
+            self._ensure_changes_collection()
+        except pymongo.errors.PyMongoError as err:
+            # Retried before the first write to it
+            self.logger.warning('Cannot prepare {0}: {1}'.format(COLLECTION_CHANGES, str(err)))
 
     def close(self):
+        self.connected = False
+        self.changes_ready = False
+        self.collections_cache.clear()
         self.conn_db.close()
         if self.conn_log:
             self.conn_log.close()
@@ -180,6 +442,7 @@ class MongodbDatastore(object):
                 'pkey-type': pkey_type,
                 'attributes': attributes
             })
+            self._invalidate_collection(name)
 
         db = self._get_db(name).database
 
@@ -202,31 +465,31 @@ class MongodbDatastore(object):
 
     @auto_retry
     def collection_exists(self, name):
-        return self.db['collections'].find_one({"_id": name}) is not None
+        return self._get_collection(name) is not None
 
     @auto_retry
     def collection_get_attrs(self, name):
-        item = self.db['collections'].find_one({"_id": name})
-        return item['attributes']
+        item = self._get_collection(name)
+        return copy.deepcopy(item['attributes'])
 
     @auto_retry
-    def collection_set_attrs(self, name):
-        item = self.db['collections'].find_one({"_id": name})
-        return item['attributes']
+    def collection_set_attrs(self, name, attributes):
+        self.db['collections'].update_one({'_id': name}, {'$set': {'attributes': attributes}})
+        self._invalidate_collection(name)
 
     @auto_retry
     def collection_get_migration_policy(self, name):
-        item = self.db['collections'].find_one({"_id": name})
+        item = self._get_collection(name)
         return item.get('migration', 'keep')
 
     @auto_retry
     def collection_get_migrations(self, name):
-        item = self.db['collections'].find_one({"_id": name})
-        return item.get('migrations', [])
+        item = self._get_collection(name)
+        return list(item.get('migrations', []))
 
     @auto_retry
     def collection_has_migration(self, name, migration_name):
-        item = self.db['collections'].find_one({"_id": name})
+        item = self._get_collection(name)
         return migration_name in item.get('migrations', [])
 
     @auto_retry
@@ -235,6 +498,7 @@ class MongodbDatastore(object):
         migs = item.setdefault('migrations', [])
         migs.append(migration_name)
         self.db['collections'].update({'_id': name}, item)
+        self._invalidate_collection(name)
 
     @auto_retry
     def collection_list(self):
@@ -245,12 +509,18 @@ class MongodbDatastore(object):
         if not self.db['collections'].find_one({"_id": name}):
             return
 
+        config = self._is_config_collection(name)
         self._get_db(name).drop()
         self.db['collections'].remove({'_id': name})
+        self.db[COLLECTION_COUNTERS].delete_one({'_id': name})
+        self.seeded_counters.discard(name)
+        self._invalidate_collection(name)
+        if config:
+            self._config_changed(name, force=True)
 
     @auto_retry
     def collection_get_pkey_type(self, name):
-        item = self.db['collections'].find_one({"_id": name})
+        item = self._get_collection(name)
         return item['pkey-type']
 
     @auto_retry
@@ -258,17 +528,39 @@ class MongodbDatastore(object):
         item = self.db['collections'].find_one({"_id": name})
         item['pkey-type'] = type
         self.db['collections'].update({'_id': name}, item)
+        self._invalidate_collection(name)
 
     @auto_retry
     def collection_get_next_pkey(self, name, prefix):
-        counter = 0
-        while True:
-            pkey = prefix + str(counter)
-            if not self.exists(name, ('id', '=', pkey)):
-                return pkey
+        cur = self._get_db(name).find(
+            {'_id': {'$regex': '^{0}[0-9]+$'.format(re.escape(prefix))}},
+            projection={'_id': True}
+        )
 
+        taken = {i['_id'] for i in cur}
+        counter = 0
+        while prefix + str(counter) in taken:
             counter += 1
 
+        return prefix + str(counter)
+
+    @auto_retry
+    def reserve_pkeys(self, collection, count=1):
+        if self.collection_get_pkey_type(collection) not in SERIAL_PKEY_TYPES:
+            raise DatastoreException('Collection {0} does not use serial primary keys'.format(collection))
+
+        if collection not in self.seeded_counters:
+            self._sync_counter(collection)
+
+        ret = self.db[COLLECTION_COUNTERS].find_one_and_update(
+            {'_id': collection},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        return list(range(ret['seq'] - count + 1, ret['seq'] + 1))
+
     @auto_retry
     def query(self, collection, *args, **kwargs):
         single = kwargs.get('single', False)
@@ -390,12 +682,7 @@ class MongodbDatastore(object):
 
     @auto_retry
     def insert(self, collection, obj, pkey=None, timestamp=True, config=False):
-        if hasattr(obj, '__getstate__'):
-            obj = obj.__getstate__()
-        elif type(obj) is not dict or config:
-            obj = {'value': obj}
-        else:
-            obj = copy.copy(obj)
+        obj = self._prepare(obj, config)
 
         pkey_type = self.collection_get_pkey_type(collection)
         autopkey = pkey is None and 'id' not in obj
@@ -409,9 +696,8 @@ class MongodbDatastore(object):
 
         while True:
             if autopkey:
-                if pkey_type in ('serial', 'integer'):
-                    ret = self._get_db(collection).find_one(sort=[('_id', pymongo.DESCENDING)])
-                    pkey = ret['_id'] + 1 if ret else 1
+                if pkey_type in SERIAL_PKEY_TYPES:
+                    pkey, = self.reserve_pkeys(collection)
                 elif pkey_type == 'uuid':
                     pkey = str(uuid.uuid4())
 
@@ -426,21 +712,109 @@ class MongodbDatastore(object):
                 db.insert_one(obj)
             except pymongo.errors.DuplicateKeyError:
                 if autopkey and retries > 0:
+                    # Someone wrote ids past the counter without going through it
+                    if pkey_type in SERIAL_PKEY_TYPES:
+                        self._sync_counter(collection)
+
                     retries -= 1
                     continue
 
                 raise DuplicateKeyException('Document with given key already exists')
 
+            if not autopkey and pkey_type in SERIAL_PKEY_TYPES and isinstance(pkey, int):
+                self._bump_counter(collection, pkey)
+
             return pkey
 
+    @auto_retry
+    def insert_many(self, collection, objs, pkeys=None, ordered=True, timestamp=True, config=False):
+        pkey_type = self.collection_get_pkey_type(collection)
+        docs = [self._prepare(o, config) for o in objs]
+        keys = list(pkeys) if pkeys else [d.pop('id', None) for d in docs]
+        reserved = iter(())
+        t = datetime.utcnow()
+        requests = []
+
+        if pkey_type in SERIAL_PKEY_TYPES:
+            explicit = [k for k in keys if isinstance(k, int)]
+            if explicit:
+                self._bump_counter(collection, max(explicit))
+
+            missing = keys.count(None)
+            if missing:
+                reserved = iter(self.reserve_pkeys(collection, missing))
+
+        for idx, obj in enumerate(docs):
+            pkey = keys[idx]
+            obj.pop('id', None)
+
+            if pkey is None:
+                if pkey_type in SERIAL_PKEY_TYPES:
+                    pkey = next(reserved)
+                elif pkey_type == 'uuid':
+                    pkey = str(uuid.uuid4())
+            elif pkey_type == 'uuid':
+                pkey = pkey.lower()
+
+            keys[idx] = pkey
+            obj['_id'] = pkey
+            if timestamp:
+                obj['updated_at'] = t
+                obj['created_at'] = t
+
+            requests.append(InsertOne(obj))
+
+        return self._bulk_write(collection, requests, keys, ordered)
+
+    def _replace_many(self, collection, objs, pkeys, upsert, ordered, timestamp, config):
+        docs = [self._prepare(o, config, deep=True) for o in objs]
+        keys = list(pkeys) if pkeys else [d.get('id') for d in docs]
+        t = datetime.utcnow()
+        requests = []
+        existing = set()
+
+        if timestamp:
+            cur = self._get_db(collection).find({'_id': {'$in': keys}}, {'_id': True})
+            existing = set(i['_id'] for i in cur)
+
+        for pkey, obj in zip(keys, docs):
+            obj.pop('id', None)
+            if timestamp:
+                obj['updated_at'] = t
+                if pkey not in existing:
+                    obj['created_at'] = t
+
+            requests.append(ReplaceOne({'_id': pkey}, obj, upsert=upsert))
+
+        return self._bulk_write(collection, requests, keys, ordered)
+
+    @auto_retry
+    def update_many(self, collection, objs, pkeys=None, ordered=True, timestamp=True, config=False):
+        return self._replace_many(collection, objs, pkeys, False, ordered, timestamp, config)
+
+    @auto_retry
+    def upsert_many(self, collection, objs, pkeys=None, ordered=True, timestamp=True, config=False):
+        return self._replace_many(collection, objs, pkeys, True, ordered, timestamp, config)
+
+    @auto_retry
+    def delete_many(self, collection, *args, **kwargs):
+        ids = kwargs.pop('ids', None)
+        if ids is None and not args:
+            raise DatastoreException('delete_many() needs either a list of ids or a predicate')
+
+        query = self._build_query(args)
+        if ids is not None:
+            query = {'$and': [{'_id': {'$in': list(ids)}}] + query.get('$and', [])}
+
+        count = self._get_db(collection).delete_many(query).deleted_count
+        if count:
+            self._config_changed(collection, list(ids) if ids is not None else None)
+
+        return count
+
     @auto_retry
     def update(self, collection, pkey, obj, upsert=False, timestamp=True, config=False):
-        if hasattr(obj, '__getstate__'):
-            obj = obj.__getstate__()
-        elif type(obj) is not dict or config:
-            obj = {'value': obj}
-        else:
-            obj = copy.deepcopy(obj)
+        obj = self._prepare(obj, config, deep=True)
 
         if 'id' in obj and pkey != obj['id']:
             # We gonna remove the document and reinsert it to change the id...
@@ -463,6 +837,20 @@ class MongodbDatastore(object):
         db = self._get_db(collection)
         db.replace_one({'_id': pkey}, obj, upsert=upsert)
 
+    def update_fields(self, collection, pkey, fields, timestamp=True):
+        fields = copy.copy(fields)
+        fields.pop('id', None)
+        if timestamp:
+            fields['updated_at'] = datetime.utcnow()
+
+        if not fields:
+            return
+
+        db = self._get_db(collection)
+        result = db.update_one({'_id': pkey}, {'$set': fields})
+        if result.matched_count == 0:
+            raise DatastoreException('Object {0} not found in {1}'.format(pkey, collection))
+
     def upsert(self, collection, pkey, obj, config=False):
         return self.update(collection, pkey, obj, upsert=True, config=config)
 
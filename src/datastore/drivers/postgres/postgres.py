@@ -29,7 +29,11 @@ import logging
 import json
 import psycopg2
 import psycopg2.extras
-from datastore import DuplicateKeyException
+from datastore import DatastoreBase, DatastoreException, DuplicateKeyException, BulkWriteException
+
+
+BATCH_SIZE = 500
+
 
 class PostgresSelectQuery(object):
     ASC = 'ASC'
@@ -93,7 +97,7 @@ class PostgresSelectQuery(object):
         return ' '.join(result)
 
 
-class PostgresDatastore(object):
+class PostgresDatastore(DatastoreBase):
     def __init__(self):
         self.logger = logging.getLogger('PostgresDatastore')
 
@@ -148,6 +152,19 @@ class PostgresDatastore(object):
 
                 yield i[0]
 
+    def reserve_pkeys(self, collection, count=1):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (collection,))
+            sequence = cur.fetchone()[0]
+            if not sequence:
+                raise DatastoreException('Collection {0} does not use serial primary keys'.format(collection))
+
+            cur.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (sequence, count))
+            result = [i[0] for i in cur.fetchall()]
+
+        self.conn.commit()
+        return result
+
     def query(self, collection, *args, **kwargs):
         wrap = kwargs.pop('wrap', True)
         with self.conn.cursor() as cur:
@@ -244,6 +261,21 @@ class PostgresDatastore(object):
 
             self.conn.commit()
 
+    def update_fields(self, collection, pkey, fields, timestamp=True):
+        fields = {k: v for k, v in fields.items() if k != 'id'}
+        if not fields:
+            return
+
+        with self.conn.cursor() as cur:
+            cur.execute("UPDATE {0} SET data = (data::jsonb || %s::jsonb)::json WHERE id = %s".format(collection), (
+                psycopg2.extras.Json(fields),
+                pkey
+            ))
+
+            self.conn.commit()
+            if cur.rowcount == 0:
+                raise DatastoreException('Object {0} not found in {1}'.format(pkey, collection))
+
     def upsert(self, collection, pkey, obj):
         if self.exists(collection, [('id', '=', pkey)]):
             return self.update(collection, pkey, obj)
@@ -260,3 +292,119 @@ class PostgresDatastore(object):
 
     def exists(self, collection, *args):
         return self.get_one(collection, *args) is not None
+
+    def __write_rows(self, prefix, suffix, rows, pkeys, ordered):
+        # Rows are written in pages of multi-row statements, a page that
+        # fails is replayed one row at a time to find the offending rows
+        ids = []
+        errors = []
+        prefix = prefix.encode('utf-8')
+        suffix = suffix.encode('utf-8')
+
+        with self.conn.cursor() as cur:
+            for start in range(0, len(rows), BATCH_SIZE):
+                page = rows[start:start + BATCH_SIZE]
+                try:
+                    cur.execute(prefix + b','.join(page) + suffix)
+                    ids.extend(i[0] for i in cur.fetchall())
+                    self.conn.commit()
+                    continue
+                except psycopg2.Error:
+                    self.conn.rollback()
+
+                for idx, row in enumerate(page, start=start):
+                    try:
+                        cur.execute(prefix + row + suffix)
+                        ids.extend(i[0] for i in cur.fetchall())
+                        self.conn.commit()
+                    except psycopg2.Error as err:
+                        self.conn.rollback()
+                        errors.append({'index': idx, 'id': pkeys[idx], 'message': str(err)})
+                        if ordered:
+                            break
+
+                if errors and ordered:
+                    break
+
+        if errors:
+            raise BulkWriteException('{0} rows failed'.format(len(errors)), errors, ids)
+
+        return ids
+
+    def __prepare_rows(self, objs, pkeys):
+        result = []
+        keys = []
+        for idx, obj in enumerate(objs):
+            if hasattr(obj, '__getstate__'):
+                obj = obj.__getstate__()
+
+            pkey = pkeys[idx] if pkeys else None
+            if type(obj) is dict and 'id' in obj:
+                obj = dict(obj)
+                obj_pkey = obj.pop('id')
+                if pkey is None:
+                    pkey = obj_pkey
+
+            keys.append(pkey)
+            result.append(obj)
+
+        return result, keys
+
+    def insert_many(self, collection, objs, pkeys=None, ordered=True, **kwargs):
+        objs, pkeys = self.__prepare_rows(objs, pkeys)
+        with self.conn.cursor() as cur:
+            rows = [
+                cur.mogrify('(DEFAULT, %s)', [psycopg2.extras.Json(o)]) if p is None else
+                cur.mogrify('(%s, %s)', [p, psycopg2.extras.Json(o)])
+                for o, p in zip(objs, pkeys)
+            ]
+
+        return self.__write_rows(
+            'INSERT INTO {0} (id, data) VALUES '.format(collection),
+            ' RETURNING id',
+            rows, pkeys, ordered
+        )
+
+    def upsert_many(self, collection, objs, pkeys=None, ordered=True, **kwargs):
+        objs, pkeys = self.__prepare_rows(objs, pkeys)
+        with self.conn.cursor() as cur:
+            rows = [cur.mogrify('(%s, %s)', [p, psycopg2.extras.Json(o)]) for o, p in zip(objs, pkeys)]
+
+        return self.__write_rows(
+            'INSERT INTO {0} (id, data) VALUES '.format(collection),
+            ' ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data RETURNING id',
+            rows, pkeys, ordered
+        )
+
+    def update_many(self, collection, objs, pkeys=None, ordered=True, **kwargs):
+        objs, pkeys = self.__prepare_rows(objs, pkeys)
+        pkey_type = self.collection_get_pkey_type(collection)
+        with self.conn.cursor() as cur:
+            rows = [cur.mogrify('(%s, %s)', [p, psycopg2.extras.Json(o)]) for o, p in zip(objs, pkeys)]
+
+        return self.__write_rows(
+            'UPDATE {0} AS t SET data = v.data::json FROM (VALUES '.format(collection),
+            ') AS v(id, data) WHERE t.id = v.id::{0} RETURNING t.id'.format(pkey_type),
+            rows, pkeys, ordered
+        )
+
+    def delete_many(self, collection, *args, **kwargs):
+        ids = kwargs.pop('ids', None)
+        if ids is None and not args:
+            raise DatastoreException('delete_many() needs either a list of ids or a predicate')
+
+        if args:
+            if ids is not None:
+                args = (('id', 'in', tuple(ids)),) + args
+
+            ids = [i.id for i in self.query(collection, *args, wrap=False)]
+
+        if not ids:
+            return 0
+
+        with self.conn.cursor() as cur:
+            cur.execute("DELETE FROM {0} WHERE id IN %s".format(collection), (tuple(ids),))
+            count = cur.rowcount
+
+        self.conn.commit()
+        return count
@@ -25,6 +25,9 @@
 #
 #####################################################################
 
+# apply() looks up other objects of this collection
+BATCHED = False
+
 
 def probe(obj, ds):
     return obj['id'].lower() != obj['id']
@@ -0,0 +1,98 @@
+#!/usr/local/bin/python3
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import sys
+import time
+import argparse
+import datastore
+
+
+DEFAULT_CONFIGFILE = '/usr/local/etc/middleware.conf'
+COLLECTION = 'bench_bulk'
+
+
+def make_docs(count):
+    return [
+        {
+            'id': 'doc{0}'.format(i),
+            'volume': 'tank',
+            'type': 'FILE',
+            'uid': i % 1000,
+            'gid': i % 100,
+            'size': i * 512,
+            'permissions': {'user': {'read': True, 'write': True, 'execute': False}}
+        }
+        for i in range(count)
+    ]
+
+
+def measure(name, count, fn):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print('{0:<24} {1:>10.2f} s {2:>12.0f} docs/s'.format(name, elapsed, count / elapsed))
+    return elapsed
+
+
+def recreate(ds):
+    ds.collection_delete(COLLECTION)
+    ds.collection_create(COLLECTION, 'native')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare row-by-row and bulk datastore writes')
+    parser.add_argument('-c', metavar='CONFIG', default=DEFAULT_CONFIGFILE, help='Config file name')
+    parser.add_argument('-n', metavar='COUNT', type=int, default=100000, help='Number of documents')
+    parser.add_argument('--unordered', action='store_true', help='Use unordered bulk writes')
+    args = parser.parse_args()
+
+    try:
+        ds = datastore.get_datastore(args.c, log=False)
+    except datastore.DatastoreException as err:
+        print('Cannot initialize datastore: {0}'.format(str(err)), file=sys.stderr)
+        sys.exit(1)
+
+    docs = make_docs(args.n)
+    ids = [d['id'] for d in docs]
+    ordered = not args.unordered
+
+    recreate(ds)
+    measure('insert', args.n, lambda: [ds.insert(COLLECTION, d) for d in docs])
+    measure('upsert', args.n, lambda: [ds.upsert(COLLECTION, d['id'], d) for d in docs])
+    measure('delete', args.n, lambda: [ds.delete(COLLECTION, i) for i in ids])
+
+    recreate(ds)
+    measure('insert_many', args.n, lambda: ds.insert_many(COLLECTION, docs, ordered=ordered))
+    measure('upsert_many', args.n, lambda: ds.upsert_many(COLLECTION, docs, ordered=ordered))
+    measure('delete_many', args.n, lambda: ds.delete_many(COLLECTION, ids=ids))
+
+    ds.collection_delete(COLLECTION)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,7 +29,6 @@ import os
 import re
 import netif
 import time
-import io
 import fnmatch
 import uuid
 import hashlib
@@ -46,6 +45,7 @@ from freenas.dispatcher.rpc import accepts, returns, description
 from freenas.dispatcher.rpc import RpcException, SchemaHelper as h
 from gevent import socket
 from lib.freebsd import get_sysctl
+from lib.framing import FramedReader
 from lib.system import system, SubprocessException
 from freenas.utils import exclude, query as q
 
@@ -369,27 +369,15 @@ class DevdEventSource(EventSource):
         if args['subsystem'] == 'SESSION' and args['type'] == 'UPDATE':
             self.emit_event('iscsi.session.update', **exclude(args, "system", "subsystem", "type"))
 
-    def read_until_nul(self, sock):
-        buf = io.BytesIO()
-        while True:
-            byte = sock.read(1)
-            if byte == b'':
-                return None
-
-            if byte == b'\x00':
-                return buf.getvalue()
-
-            buf.write(byte)
-
     def run(self):
         while True:
             try:
                 self.socket = socket.socket(family=socket.AF_UNIX)
                 self.socket.connect("/var/run/devd.xml.pipe")
-                f = self.socket.makefile("rb", 0)
-                
+                reader = FramedReader(self.socket)
+
                 while True:
-                    line = self.read_until_nul(f)
+                    line = reader.read_frame()
                     if line is None:
                         # Connection closed - we need to reconnect
                         # return
@@ -238,7 +238,10 @@ def _init(dispatcher, plugin):
             },
             'cache_ttl': {'type': 'integer'},
             'cache_enumerations': {'type': 'boolean'},
-            'cache_lookups': {'type': 'boolean'}
+            'cache_lookups': {'type': 'boolean'},
+            'cache_max_entries': {'type': 'integer', 'minimum': 0},
+            'cache_max_bytes': {'type': 'integer', 'minimum': 0},
+            'negative_cache_ttl': {'type': 'integer', 'minimum': 0}
         }
     })
 
@@ -49,7 +49,7 @@ from lib.geom import confxml
 from lib.system import system, SubprocessException
 from task import (
     Provider, Task, ProgressTask, TaskStatus, TaskException, VerifyException,
-    query, TaskDescription
+    query, TaskDescription, shared_result
 )
 from debug import AttachData, AttachCommandOutput
 from freenas.dispatcher.rpc import RpcException, accepts, returns, description, private, SchemaHelper as h, generator
@@ -86,6 +86,7 @@ class SelfTestType(enum.Enum):
 class DiskProvider(Provider):
     @query('Disk')
     @generator
+    @shared_result
     def query(self, filter=None, params=None):
         def extend(disk):
             if disk.get('delete_at'):
@@ -35,6 +35,9 @@ from freenas.dispatcher.rpc import generator, description, accepts, private
 from freenas.utils.permissions import get_type, get_unix_permissions
 
 
+INDEX_BATCH_SIZE = 1000
+
+
 @description("Provides access to the filesystem index")
 class IndexProvider(Provider):
     @generator
@@ -119,8 +122,9 @@ class IndexDatasetIncrementalTask(ProgressTask):
         if not ds:
             raise TaskException(errno.ENOENT, 'Dataset {0} not found'.format(dataset))
 
-        for rec in ds.diff('{0}@org.freenas.indexer:ref'.format(dataset), '{0}@org.freenas.indexer:now'.format(dataset)):
-            collect(self.datastore, rec.path)
+        with IndexBatch(self.datastore) as batch:
+            for rec in ds.diff('{0}@org.freenas.indexer:ref'.format(dataset), '{0}@org.freenas.indexer:now'.format(dataset)):
+                batch.collect(rec.path)
 
         self.run_subtask_sync('volume.snapshot.delete', '{0}@org.freenas.indexer:ref'.format(dataset))
         self.run_subtask_sync('volume.snapshot.update', '{0}@org.freenas.indexer:now'.format(dataset), {
@@ -149,19 +153,20 @@ class IndexDatasetFullTask(ProgressTask):
         total_files = statfs.files - statfs.free_files
         done_files = 0
 
-        for root, dirs, files in os.walk(mountpoint, topdown=True):
-            dirs[:] = [dir for dir in dirs if not os.path.ismount(os.path.join(root, dir))]
+        with IndexBatch(self.datastore) as batch:
+            for root, dirs, files in os.walk(mountpoint, topdown=True):
+                dirs[:] = [dir for dir in dirs if not os.path.ismount(os.path.join(root, dir))]
 
-            for d in dirs:
-                path = os.path.join(root, d)
-                collect(self.datastore, path)
-                done_files += 1
-                self.set_progress(done_files / total_files * 100, 'Processing directory {0}'.format(path))
+                for d in dirs:
+                    path = os.path.join(root, d)
+                    batch.collect(path)
+                    done_files += 1
+                    self.set_progress(done_files / total_files * 100, 'Processing directory {0}'.format(path))
 
-            for f in files:
-                path = os.path.join(root, f)
-                collect(self.datastore, path)
-                done_files += 1
+                for f in files:
+                    path = os.path.join(root, f)
+                    batch.collect(path)
+                    done_files += 1
 
         self.run_subtask_sync('volume.snapshot.create', {
             'dataset': dataset,
@@ -170,16 +175,45 @@ class IndexDatasetFullTask(ProgressTask):
         })
 
 
-def collect(datastore, path):
+class IndexBatch(object):
+    def __init__(self, datastore, size=INDEX_BATCH_SIZE):
+        self.datastore = datastore
+        self.size = size
+        # Latest observation per path, None if it is gone
+        self.pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def collect(self, path):
+        # Can't access the file - its index entry gets deleted
+        self.pending[path] = stat_entry(path)
+        if len(self.pending) >= self.size:
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, {}
+        upserts = [e for e in pending.values() if e]
+        deletes = [p for p, e in pending.items() if not e]
+
+        if upserts:
+            self.datastore.upsert_many('fileindex', upserts, ordered=False)
+
+        if deletes:
+            self.datastore.delete_many('fileindex', ids=deletes)
+
+
+def stat_entry(path):
     try:
         st = os.stat(path, follow_symlinks=False)
-    except OSError as err:
-        # Can't access the file - delete index entry
-        datastore.delete('fileindex', path)
-        return
+    except OSError:
+        return None
 
     volume = path.split('/')[2]
-    datastore.upsert('fileindex', path, {
+    return {
         'id': path,
         'volume': volume,
         'type': get_type(st),
@@ -189,7 +223,7 @@ def collect(datastore, path):
         'uid': st.st_uid,
         'gid': st.st_gid,
         'permissions': get_unix_permissions(st.st_mode)
-    })
+    }
 
 
 def _init(dispatcher, plugin):
@@ -31,6 +31,7 @@ import logging
 import signal
 from task import Task, Provider, TaskException, TaskDescription, ValidationException, query
 from debug import AttachFile, AttachData, AttachCommandOutput
+from query import prefilter
 from resources import Resource
 from freenas.dispatcher.jsonenc import dumps
 from freenas.dispatcher.rpc import RpcException, description, accepts, private, returns, generator
@@ -64,12 +65,8 @@ class ServiceInfoProvider(Provider):
             entry['config'] = self.get_service_config(i['id'])
             return entry
 
-        return q.query(
-            self.datastore.query_stream('service_definitions', callback=extend),
-            *(filter or []),
-            stream=True,
-            **(params or {})
-        )
+        services, rest = prefilter(self.datastore.query_stream('service_definitions', callback=extend), filter)
+        return q.query(services, *rest, stream=True, **(params or {}))
     
     @accepts(str)
     @returns(h.object())
@@ -34,39 +34,29 @@ from freenas.utils import query as q
 
 UNITS = {
     'Ops/s': {
-        'match': lambda x: re.match(r'(.*)(disk_merged|disk_ops)(.*)', x),
-        'normalize': lambda x: x,
-        'raw': lambda x: x
+        'pattern': r'(.*)(disk_merged|disk_ops)(.*)'
     },
     'B/s': {
-        'match': lambda x: re.match(r'(.*)(disk_octets|if_octets)(.*)', x),
-        'normalize': lambda x: x,
-        'raw': lambda x: x
+        'pattern': r'(.*)(disk_octets|if_octets)(.*)'
     },
     'B': {
-        'match': lambda x: re.match(r'(.*)(df-|memory)(.*)', x),
-        'normalize': lambda x: x,
-        'raw': lambda x: x
+        'pattern': r'(.*)(df-|memory)(.*)'
     },
     'C': {
-        'match': lambda x: re.match(r'(.*)(temperature)(.*)', x),
-        'normalize': lambda x: None if (x == -1) or (x is None) else (x - 2732)/10,
-        'raw': lambda x: None if x is None else x * 10 + 2732
+        # Sensors report deci-Kelvin, -1 means no reading
+        'pattern': r'(.*)(temperature)(.*)',
+        'offset': -2732,
+        'divisor': 10,
+        'invalid': [-1]
     },
     'Jiffies': {
-        'match': lambda x: re.match(r'(.*)(cpu-)(.*)', x),
-        'normalize': lambda x: x,
-        'raw': lambda x: x
+        'pattern': r'(.*)(cpu-)(.*)'
     },
     'Packets/s': {
-        'match': lambda x: re.match(r'(.*)(if_packets)(.*)', x),
-        'normalize': lambda x: x,
-        'raw': lambda x: x
+        'pattern': r'(.*)(if_packets)(.*)'
     },
     'Errors/s': {
-        'match': lambda x: re.match(r'(.*)(if_errors)(.*)', x),
-        'normalize': lambda x: x,
-        'raw': lambda x: x
+        'pattern': r'(.*)(if_errors)(.*)'
     }
 }
 
@@ -94,9 +84,20 @@ class StatProvider(Provider):
             'data': list(self.dispatcher.call_sync('statd.output.get_stats', data_source, params))
         }
 
+    @description('Streams statistics as chunks of packed columns')
+    @accepts(h.one_of(str, h.array(str)), h.ref('GetStatsParams'))
+    @generator
+    def stream_stats(self, data_source, params):
+        params = dict(params or {}, format='columnar')
+        return self.dispatcher.call_sync('statd.output.get_stats', data_source, params)
+
     def normalize(self, name, value):
         return normalize(name, value)
 
+    @returns(h.object())
+    def get_units(self):
+        return UNITS
+
 
 @description('Provides information about CPU statistics')
 class CpuStatProvider(Provider):
@@ -238,16 +239,25 @@ def normalize_values(stat):
 
 def normalize(name, value):
     for key, unit in UNITS.items():
-        if unit['match'](name):
-            return key, unit['normalize'](value)
+        if re.match(unit['pattern'], name):
+            if value is None or value in unit.get('invalid', []):
+                return key, None
+
+            if 'divisor' not in unit:
+                return key, value
+
+            return key, (value + unit['offset']) / unit['divisor']
 
     return '', value
 
 
 def raw(name, value):
     for key, unit in UNITS.items():
-        if unit['match'](name):
-            return unit['raw'](value)
+        if re.match(unit['pattern'], name):
+            if value is None or 'divisor' not in unit:
+                return value
+
+            return value * unit['divisor'] - unit['offset']
 
     return value
 
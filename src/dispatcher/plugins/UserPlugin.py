@@ -33,6 +33,7 @@ import shutil
 from datetime import datetime
 from task import Provider, Task, TaskException, TaskDescription, TaskWarning, ValidationException, VerifyException, query
 from debug import AttachFile
+from query import prefilter
 from freenas.dispatcher.rpc import RpcException, description, accepts, returns, SchemaHelper as h, generator
 from datastore import DuplicateKeyException, DatastoreException
 from lib.system import SubprocessException, system
@@ -105,10 +106,8 @@ class UserProvider(Provider):
 
                     raise
 
-        return q.query(
-            self.dispatcher.call_sync('dscached.account.query', filter, params),
-            *(filter or []), stream=True, **(params or {})
-        )
+        users, rest = prefilter(self.dispatcher.call_sync('dscached.account.query', filter, params), filter)
+        return q.query(users, *rest, stream=True, **(params or {}))
 
     def get_profile_picture(self, uid):
         pass
@@ -164,10 +163,8 @@ class GroupProvider(Provider):
 
                     raise
 
-        return q.query(
-            self.dispatcher.call_sync('dscached.group.query', filter, params),
-            *(filter or []), stream=True, **(params or {})
-        )
+        groups, rest = prefilter(self.dispatcher.call_sync('dscached.group.query', filter, params), filter)
+        return q.query(groups, *rest, stream=True, **(params or {}))
 
     @description("Retrieve the next GID available")
     @returns(int)
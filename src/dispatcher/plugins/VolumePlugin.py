@@ -3643,7 +3643,11 @@ def _init(dispatcher, plugin):
         })
 
     global snapshots
-    snapshots = EventCacheStore(dispatcher, 'volume.snapshot')
+    snapshots = EventCacheStore(dispatcher, 'volume.snapshot', indexes={
+        'id': 'hash',
+        'volume': 'hash',
+        'dataset': 'hash'
+    })
     snapshots.populate(dispatcher.call_sync('zfs.snapshot.query'), callback=convert_snapshot)
     snapshots.ready = True
     plugin.register_event_handler(
@@ -3652,7 +3656,11 @@ def _init(dispatcher, plugin):
     )
 
     global datasets
-    datasets = EventCacheStore(dispatcher, 'volume.dataset')
+    datasets = EventCacheStore(dispatcher, 'volume.dataset', indexes={
+        'id': 'hash',
+        'volume': 'hash',
+        'name': 'hash'
+    })
     datasets.populate(dispatcher.call_sync('zfs.dataset.query'), callback=convert_dataset)
     datasets.ready = True
     plugin.register_event_handler(
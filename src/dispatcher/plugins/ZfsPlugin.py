@@ -37,7 +37,7 @@ from cache import EventCacheStore
 from event import sync
 from task import (
     Provider, Task, ProgressTask, TaskWarning, TaskException,
-    VerifyException, TaskAbortException, query, TaskDescription
+    VerifyException, TaskAbortException, query, TaskDescription, shared_result
 )
 from freenas.dispatcher.rpc import RpcException, accepts, returns, description, private, generator
 from freenas.dispatcher.rpc import SchemaHelper as h
@@ -251,6 +251,7 @@ class ZfsDatasetProvider(Provider):
 class ZfsSnapshotProvider(Provider):
     @query('ZfsSnapshot')
     @generator
+    @shared_result
     def query(self, filter=None, params=None):
         return snapshots.query(*(filter or []), stream=True, **(params or {}))
 
@@ -2013,8 +2014,16 @@ def _init(dispatcher, plugin):
             return par, base, snap
 
         pools = EventCacheStore(dispatcher, 'zfs.pool', sort_func)
-        datasets = EventCacheStore(dispatcher, 'zfs.dataset', sort_func)
-        snapshots = EventCacheStore(dispatcher, 'zfs.snapshot', snap_sort_func)
+        datasets = EventCacheStore(dispatcher, 'zfs.dataset', sort_func, indexes={
+            'id': 'hash',
+            'name': 'hash',
+            'pool': 'hash'
+        })
+        snapshots = EventCacheStore(dispatcher, 'zfs.snapshot', snap_sort_func, indexes={
+            'id': 'hash',
+            'pool': 'hash',
+            'dataset': 'hash'
+        })
 
         pools_dict = {}
         for i in dispatcher.threaded(lambda: [p.__getstate__(False) for p in zfs.pools]):
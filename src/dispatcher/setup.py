@@ -38,14 +38,17 @@ files = [
     "src/cache.py",
     "src/debug.py",
     "src/event.py",
+    "src/frozen.py",
     "src/main.py",
     "src/query.py",
     "src/resources.py",
     "src/schemas.py",
     "src/services.py",
     "src/task.py",
+    "src/tasklog.py",
     "src/websocket.py",
     "src/utils.py",
+    "src/lib/framing.py",
     "src/lib/freebsd.py",
     "src/lib/geom.py",
     "src/lib/system.py",
@@ -26,6 +26,10 @@
 #####################################################################
 
 import os
+import time
+import json
+import array
+import socket
 import gevent
 import logging
 import traceback
@@ -33,7 +37,6 @@ import errno
 import copy
 import uuid
 import fnmatch
-import inspect
 import subprocess
 import bsd
 import signal
@@ -48,9 +51,11 @@ from gevent.lock import RLock
 from gevent.event import Event, AsyncResult
 from gevent.subprocess import Popen
 from gevent.fileobject import FileObjectPosix
+from gevent import socket as gsocket
 from freenas.utils import first_or_default
 from resources import Resource
 from auth import FileToken
+from tasklog import TaskOutputLog, purge_output_logs
 from task import (
     TaskException, TaskAbortException, VerifyException, ValidationException,
     TaskStatus, TaskState, TaskDescription
@@ -59,6 +64,14 @@ import collections
 
 
 TASKWORKER_PATH = '/usr/local/libexec/taskworker'
+ZYGOTE_SOCKET = '/var/run/taskworker.zygote.sock'
+DEFAULT_TASK_FLUSH_INTERVAL = 1
+DEFAULT_EXECUTORS_MIN = 2
+DEFAULT_EXECUTORS_MAX = 32
+DEFAULT_EXECUTORS_IDLE_TIMEOUT = 300
+DEFAULT_EXECUTORS_MAX_QUEUE = 1024
+EXECUTORS_REAP_INTERVAL = 10
+TERMINAL_STATES = (TaskState.FINISHED, TaskState.FAILED, TaskState.ABORTED)
 ERROR_TYPES = {
     'RpcException': RpcException,
     'TaskException': TaskException,
@@ -87,6 +100,113 @@ class WorkerState(object):
     STARTING = 'STARTING'
 
 
+class ZygoteProcess(object):
+    """
+    Popen-alike handle of a task executor forked by the zygote. The worker
+    is not our child, so its exit status arrives over the control connection.
+    """
+    def __init__(self, conn, reader, pid, stdout):
+        self.conn = conn
+        # Shared with spawn(), it may have buffered the returncode line already
+        self.reader = reader
+        self.pid = pid
+        self.stdout = stdout
+        self.returncode = None
+
+    def wait(self):
+        if self.returncode is None:
+            line = self.reader.readline()
+            self.reader.close()
+            self.conn.close()
+            try:
+                self.returncode = json.loads(line.decode('utf-8'))['returncode']
+            except (ValueError, KeyError):
+                # Zygote died before reporting the status
+                self.returncode = -signal.SIGKILL
+
+        return self.returncode
+
+    def terminate(self):
+        os.kill(self.pid, signal.SIGTERM)
+
+
+class Zygote(object):
+    """
+    Supervises the taskworker fork server. It imports the common libraries
+    and plugin modules once and forks ready-to-run executors on request,
+    saving the interpreter cold start on every executor spawn.
+    """
+    def __init__(self, balancer, path=ZYGOTE_SOCKET):
+        self.balancer = balancer
+        self.logger = logging.getLogger('Zygote')
+        self.path = path
+        self.proc = None
+        self.exiting = False
+        self.thread = None
+
+    @property
+    def ready(self):
+        return self.proc is not None and self.proc.returncode is None and os.path.exists(self.path)
+
+    def start(self):
+        self.thread = gevent.spawn(self.supervisor)
+
+    def supervisor(self):
+        while not self.exiting:
+            try:
+                self.proc = Popen(
+                    [TASKWORKER_PATH, '--zygote', self.path] + self.balancer.dispatcher.plugin_dirs,
+                    close_fds=True,
+                    preexec_fn=os.setpgrp,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT)
+            except OSError as err:
+                self.logger.error('Cannot start taskworker zygote: {0}'.format(str(err)))
+                return
+
+            self.logger.info('Started taskworker zygote as PID {0}'.format(self.proc.pid))
+            for line in self.proc.stdout:
+                self.logger.debug('Zygote: {0}'.format(line.decode('utf8').strip()))
+
+            self.proc.wait()
+            if not self.exiting:
+                self.logger.warning('Taskworker zygote exited with code {0}, restarting'.format(self.proc.returncode))
+                gevent.sleep(1)
+
+    def spawn(self, key):
+        rfd, wfd = os.pipe()
+        conn = gsocket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        reader = conn.makefile('rb')
+        try:
+            conn.connect(self.path)
+            conn.sendmsg(
+                [json.dumps({'argv': [key]}).encode('utf-8')],
+                [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [wfd]))]
+            )
+            os.close(wfd)
+            wfd = None
+            line = reader.readline()
+            pid = json.loads(line.decode('utf-8'))['pid']
+        except (OSError, ValueError, KeyError) as err:
+            reader.close()
+            conn.close()
+            os.close(rfd)
+            if wfd is not None:
+                os.close(wfd)
+
+            raise OSError(errno.EPIPE, 'Zygote did not fork a worker: {0}'.format(err))
+
+        return ZygoteProcess(conn, reader, pid, FileObjectPosix(rfd, 'rb', close=True))
+
+    def restart(self):
+        if self.proc and self.proc.returncode is None:
+            self.proc.terminate()
+
+    def stop(self):
+        self.exiting = True
+        self.restart()
+
+
 class TaskExecutor(object):
     def __init__(self, balancer, index):
         self.balancer = balancer
@@ -100,6 +220,8 @@ class TaskExecutor(object):
         self.result = AsyncResult()
         self.exiting = False
         self.killed = False
+        self.reserved = False
+        self.idle_since = None
         self.thread = gevent.spawn(self.executor)
         self.cv = Condition()
         self.status_lock = RLock()
@@ -108,8 +230,13 @@ class TaskExecutor(object):
         with self.cv:
             self.balancer.logger.debug('Check-in of worker #{0} (key {1})'.format(self.index, self.key))
             self.conn = conn
-            self.state = WorkerState.IDLE
-            self.cv.notify_all()
+            self.set_idle()
+
+    def set_idle(self):
+        self.state = WorkerState.IDLE
+        self.idle_since = time.monotonic()
+        self.cv.notify_all()
+        self.balancer.executor_released(self)
 
     def put_progress(self, progress):
         st = TaskStatus(None)
@@ -157,13 +284,10 @@ class TaskExecutor(object):
         self.task.add_warning(warning)
 
     def update_env(self, env):
-        self.conn.call_sync('taskproxy.update_env', env)
+        if self.conn:
+            self.conn.call_sync('taskproxy.update_env', env)
 
     def run(self, task):
-        def match_file(module, f):
-            name, ext = os.path.splitext(f)
-            return module == name and ext in ['.py', '.pyc', '.so']
-
         with self.cv:
             self.cv.wait_for(lambda: self.state == WorkerState.ASSIGNED)
             self.result = AsyncResult()
@@ -174,22 +298,10 @@ class TaskExecutor(object):
 
         self.balancer.logger.debug('Actually starting task {0}'.format(task.id))
 
-        filename = None
-        module_name = inspect.getmodule(task.clazz).__name__
-        for dir in self.balancer.dispatcher.plugin_dirs:
-            found = False
-            try:
-                for root, _, files in os.walk(dir):
-                    file = first_or_default(lambda f: match_file(module_name, f), files)
-                    if file:
-                        filename = os.path.join(root, file)
-                        found = True
-                        break
-
-                if found:
-                    break
-            except OSError:
-                continue
+        dispatcher = self.balancer.dispatcher
+        filename = dispatcher.task_modules.get(task.name)
+        if not filename:
+            filename = dispatcher.task_modules[task.name] = dispatcher.resolve_task_module(task.clazz)
 
         try:
             self.conn.call_sync('taskproxy.run', {
@@ -237,8 +349,7 @@ class TaskExecutor(object):
                 self.task.ended.set()
 
                 if self.state == WorkerState.EXECUTING:
-                    self.state = WorkerState.IDLE
-                    self.cv.notify_all()
+                    self.set_idle()
 
             self.balancer.task_exited(self.task)
             return
@@ -248,8 +359,7 @@ class TaskExecutor(object):
             self.task.set_state(TaskState.FINISHED, TaskStatus(100, ''))
             self.task.ended.set()
             if self.state == WorkerState.EXECUTING:
-                self.state = WorkerState.IDLE
-                self.cv.notify_all()
+                self.set_idle()
 
         self.balancer.task_exited(self.task)
 
@@ -280,16 +390,25 @@ class TaskExecutor(object):
         except OSError:
             self.balancer.logger.warning('Executor process with PID {0} already dead'.format(self.proc.pid))
 
+    def spawn(self):
+        zygote = self.balancer.zygote
+        if zygote and zygote.ready:
+            try:
+                return zygote.spawn(self.key)
+            except OSError as err:
+                self.balancer.logger.warning('Falling back to spawning executor #{0}: {1}'.format(self.index, str(err)))
+
+        return Popen(
+            [TASKWORKER_PATH, self.key],
+            close_fds=True,
+            preexec_fn=os.setpgrp,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+
     def executor(self):
         while not self.exiting:
             try:
-                self.proc = Popen(
-                    [TASKWORKER_PATH, self.key],
-                    close_fds=True,
-                    preexec_fn=os.setpgrp,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT)
-
+                self.proc = self.spawn()
                 self.pid = self.proc.pid
                 self.balancer.logger.debug('Started executor #{0} as PID {1}'.format(self.index, self.pid))
             except OSError:
@@ -301,7 +420,7 @@ class TaskExecutor(object):
                 line = line.decode('utf8')
                 self.balancer.logger.debug('Executor #{0}: {1}'.format(self.index, line.strip()))
                 if self.task:
-                    self.task.output += line
+                    self.task.append_output(line)
 
             self.proc.wait()
 
@@ -334,6 +453,12 @@ class TaskExecutor(object):
 
 
 class Task(object):
+    STATE_FIELDS = (
+        'state', 'error', 'started_at', 'finished_at', 'result', 'rusage',
+        'resources', 'description', 'warnings', 'environment', 'output', 'output_size',
+        'validation_time'
+    )
+
     def __init__(self, dispatcher, name=None):
         self.dispatcher = dispatcher
         self.balancer = dispatcher.balancer
@@ -357,13 +482,15 @@ class Task(object):
         self.instance = None
         self.parent = None
         self.result = None
-        self.output = ''
+        self.output = None
         self.rusage = None
         self.slock = RLock()
         self.ended = Event()
         self.debugger = None
         self.executor = None
+        self.scheduled = False
         self.strict_verify = None
+        self.validation_time = None
 
     def __getstate__(self):
         return {
@@ -379,7 +506,9 @@ class Task(object):
             "args": remove_dots(self.args),
             "result": self.result,
             "state": self.state,
-            "output": self.output,
+            "output": self.output.tail() if self.output else '',
+            "output_size": self.output.size if self.output else 0,
+            "validation_time": self.validation_time,
             "rusage": self.rusage,
             "error": self.error,
             "warnings": self.warnings,
@@ -400,15 +529,28 @@ class Task(object):
         })
 
     def start(self):
+        # Stays WAITING until an executor is assigned, schedule_tasks() must
+        # not pick it up again meanwhile
+        self.scheduled = True
+        return gevent.spawn(self.__run)
+
+    def __run(self):
+        # May block until the executor pool has room for us
         try:
             self.balancer.assign_executor(self)
         except OverflowError:
             self.set_state(TaskState.FAILED, error='Out of executors')
             self.ended.set()
             self.balancer.task_exited(self)
+            return
+
+        if self.ended.is_set():
+            # Aborted while waiting for an executor
+            self.balancer.release_executor(self.executor)
+            self.balancer.task_exited(self)
+            return
 
-        # Start actual task
-        return gevent.spawn(self.executor.run, self)
+        self.executor.run(self)
 
     def join(self, timeout=None):
         self.ended.wait(timeout)
@@ -423,31 +565,36 @@ class Task(object):
             if error:
                 self.error = error
 
-            if self.state == TaskState.EXECUTING:
+            if state == TaskState.EXECUTING:
                 self.started_at = datetime.utcnow()
                 event['started_at'] = self.started_at
 
-            if self.state == TaskState.FINISHED:
+            if state == TaskState.FINISHED:
                 self.finished_at = datetime.utcnow()
                 self.progress = TaskStatus(100)
                 event['finished_at'] = self.finished_at
                 event['result'] = self.result
 
-            if self.state in (TaskState.FAILED, TaskState.ABORTED):
+            if state in (TaskState.FAILED, TaskState.ABORTED):
                 self.progress = TaskStatus(0)
 
-            self.dispatcher.dispatch_event('task.created' if self.state == TaskState.CREATED else 'task.updated', event)
-            self.dispatcher.datastore.update('tasks', self.id, self)
-            self.dispatcher.dispatch_event('task.changed', {
-                'operation': 'create' if state == TaskState.CREATED else 'update',
-                'ids': [self.id]
-            })
+            if state or error:
+                self.dispatcher.dispatch_event('task.created' if self.state == TaskState.CREATED else 'task.updated', event)
+                if state == TaskState.CREATED:
+                    # Fields like parent, user or environment may be filled after the initial insert
+                    self.balancer.task_writer.mark(self, *(k for k in self.__getstate__() if k != 'args'), created=True)
+                else:
+                    self.balancer.task_writer.mark(self, *self.STATE_FIELDS)
 
-            if progress and self.state not in (TaskState.FINISHED, TaskState.FAILED, TaskState.ABORTED):
+            if progress and self.state not in TERMINAL_STATES:
                 self.progress = progress
                 self.__emit_progress()
 
-            if self.state in (TaskState.FINISHED, TaskState.FAILED, TaskState.ABORTED):
+            if state in TERMINAL_STATES:
+                self.balancer.task_writer.flush(self)
+                if self.output:
+                    self.output.close()
+
                 try:
                     # Remove all subtasks
                     for i in filter(lambda t: t.parent is self, self.balancer.task_list):
@@ -462,19 +609,18 @@ class Task(object):
 
     def set_env(self, key, value):
         self.environment[key] = value
-        self.dispatcher.datastore.update('tasks', self.id, self)
+        self.balancer.task_writer.mark(self, 'environment')
 
-    def set_output(self, output):
-        self.output = output
-        self.dispatcher.datastore.update('tasks', self.id, self)
+    def append_output(self, output):
+        if not self.output:
+            self.output = TaskOutputLog(self.id)
+
+        self.output.append(output)
+        self.balancer.task_writer.mark(self, 'output', 'output_size')
 
     def add_warning(self, warning):
         self.warnings.append(warning)
-        self.dispatcher.datastore.update('tasks', self.id, self)
-        self.dispatcher.dispatch_event('task.changed', {
-            'operation': 'update',
-            'ids': [self.id]
-        })
+        self.balancer.task_writer.mark(self, 'warnings')
 
     def get_description(self):
         if not self.description:
@@ -489,6 +635,78 @@ class Task(object):
         return TaskDescription(str(self.description))
 
 
+class TaskStateWriter(object):
+    """
+    Coalesces datastore writes of task state. Changed fields are collected
+    per task and written with a single partial update at most once per
+    interval, terminal states are written through by flush(task).
+    task.changed events are sent once the change actually hit the datastore.
+    """
+    def __init__(self, dispatcher, interval=DEFAULT_TASK_FLUSH_INTERVAL):
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.logger = logging.getLogger('TaskStateWriter')
+        self.pending = collections.OrderedDict()
+        self.lock = RLock()
+        self.write_lock = RLock()
+        self.thread = None
+
+    def start(self):
+        self.thread = gevent.spawn(self.flush_thread)
+
+    def mark(self, task, *fields, created=False):
+        if task.id is None:
+            return
+
+        with self.lock:
+            entry = self.pending.get(task.id)
+            if not entry:
+                entry = self.pending[task.id] = {'task': task, 'fields': set(), 'created': False}
+
+            entry['fields'].update(fields)
+            entry['created'] = entry['created'] or created
+
+    def flush(self, task=None):
+        # write_lock keeps an older snapshot from landing after a newer one
+        with self.write_lock:
+            with self.lock:
+                if task:
+                    entry = self.pending.pop(task.id, None)
+                    entries = [entry] if entry else []
+                else:
+                    entries = list(self.pending.values())
+                    self.pending.clear()
+
+            created = []
+            updated = []
+            for entry in entries:
+                task = entry['task']
+                state = task.__getstate__()
+                try:
+                    self.dispatcher.datastore.update_fields('tasks', task.id, {
+                        k: state[k] for k in entry['fields']
+                    })
+                except Exception as err:
+                    self.logger.warning('Cannot save state of task {0}: {1}'.format(task.id, str(err)))
+                    continue
+
+                (created if entry['created'] else updated).append(task.id)
+
+            if created:
+                self.dispatcher.dispatch_event('task.changed', {'operation': 'create', 'ids': created})
+
+            if updated:
+                self.dispatcher.dispatch_event('task.changed', {'operation': 'update', 'ids': updated})
+
+    def flush_thread(self):
+        while True:
+            gevent.sleep(self.interval)
+            try:
+                self.flush()
+            except BaseException as err:
+                self.logger.error('Task state flush failed: {0}'.format(str(err)), exc_info=True)
+
+
 class Balancer(object):
     def __init__(self, dispatcher):
         self.dispatcher = dispatcher
@@ -497,15 +715,45 @@ class Balancer(object):
         self.resource_graph = dispatcher.resource_graph
         self.threads = []
         self.executors = []
+        self.executor_index = 0
+        self.executor_waiters = collections.deque()
+        self.executor_stats = {
+            'spawned': 0,
+            'reaped': 0,
+            'waited': 0,
+            'wait_time': 0.0,
+            'peak_size': 0,
+            'peak_waiting': 0
+        }
+        self.validators = {}
+        self.validation_stats = {
+            'count': 0,
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'total_time': 0.0,
+            'max_time': 0.0
+        }
         self.logger = logging.getLogger('Balancer')
         self.dispatcher.require_collection('tasks', 'serial', type='log')
+        self.task_writer = TaskStateWriter(
+            dispatcher,
+            dispatcher.configstore.get('middleware.task_flush_interval', DEFAULT_TASK_FLUSH_INTERVAL)
+        )
         self.create_initial_queues()
+        self.load_pool_config()
+        self.zygote = None
+        if dispatcher.configstore.get('middleware.executors_fork_server'):
+            self.zygote = Zygote(self)
+            self.zygote.start()
+
         self.start_executors()
         self.schedule_lock = RLock()
         self.distribution_lock = RLock()
         self.debugger = None
         self.debugged_tasks = None
         self.dispatcher.register_event_type('task.changed')
+        purge_output_logs()
 
         # Lets try to get `EXECUTING|WAITING|CREATED` state tasks
         # from the previous dispatcher instance and set their
@@ -533,13 +781,34 @@ class Balancer(object):
     def create_initial_queues(self):
         self.resource_graph.add_resource(Resource('system'))
 
+    def load_pool_config(self):
+        configstore = self.dispatcher.configstore
+        self.executors_min = configstore.get('middleware.executors_min') or DEFAULT_EXECUTORS_MIN
+        self.executors_max = configstore.get('middleware.executors_max') or DEFAULT_EXECUTORS_MAX
+        self.executors_prewarm = configstore.get('middleware.executors_prewarm') or max(get_sysctl("hw.ncpu"), 2)
+        self.executors_idle_timeout = configstore.get('middleware.executors_idle_timeout') or DEFAULT_EXECUTORS_IDLE_TIMEOUT
+        self.executors_max_queue = configstore.get('middleware.executors_max_queue') or DEFAULT_EXECUTORS_MAX_QUEUE
+        self.executors_max = max(self.executors_max, self.executors_min)
+        self.executors_prewarm = min(max(self.executors_prewarm, self.executors_min), self.executors_max)
+
     def start_executors(self):
-        for i in range(0, max(get_sysctl("hw.ncpu"), 2)):
-            self.logger.info('Starting task executor #{0}...'.format(i))
-            self.executors.append(TaskExecutor(self, i))
+        for i in range(0, self.executors_prewarm):
+            self.spawn_executor()
+
+    def spawn_executor(self):
+        index = self.executor_index
+        self.executor_index += 1
+        self.logger.info('Starting task executor #{0}...'.format(index))
+        executor = TaskExecutor(self, index)
+        self.executors.append(executor)
+        self.executor_stats['spawned'] += 1
+        self.executor_stats['peak_size'] = max(self.executor_stats['peak_size'], len(self.executors))
+        return executor
 
     def start(self):
+        self.task_writer.start()
         self.threads.append(gevent.spawn(self.distribution_thread))
+        self.threads.append(gevent.spawn(self.reaper_thread))
         self.logger.info("Started")
 
     def schema_to_list(self, schema):
@@ -550,9 +819,18 @@ class Balancer(object):
             'maxItems': len(schema)
         }
 
-    def verify_schema(self, clazz, args, strict=False):
-        if not hasattr(clazz, 'params_schema'):
-            return []
+    def get_validator(self, clazz, strict=False):
+        """
+        Returns a validator for the task class parameters. Validators are
+        built once per task class and validation mode and then reused, along
+        with the $ref resolutions cached by their resolver, until a schema
+        definition changes.
+        """
+        key = (clazz, strict)
+        val = self.validators.get(key)
+        if val is not None:
+            self.validation_stats['hits'] += 1
+            return val
 
         schema = self.schema_to_list(clazz.params_schema)
         val = validator.create_validator(schema, resolver=self.dispatcher.rpc.get_schema_resolver(schema))
@@ -561,13 +839,46 @@ class Balancer(object):
         else:
             val.remove_read_only = True
 
-        return list(val.iter_errors(args))
+        self.validation_stats['misses'] += 1
+        self.validators[key] = val
+        return val
+
+    def invalidate_validators(self, clazz=None):
+        if clazz:
+            for key in [k for k in self.validators if k[0] is clazz]:
+                del self.validators[key]
+        else:
+            self.validators.clear()
+
+        self.validation_stats['invalidations'] += 1
+
+    def verify_schema(self, clazz, args, strict=False):
+        if not hasattr(clazz, 'params_schema'):
+            return []
+
+        return list(self.get_validator(clazz, strict).iter_errors(args))
+
+    def get_validation_stats(self):
+        stats = self.validation_stats
+        return {
+            'count': stats['count'],
+            'cached': len(self.validators),
+            'hits': stats['hits'],
+            'misses': stats['misses'],
+            'invalidations': stats['invalidations'],
+            'max_time': stats['max_time'],
+            'average_time': stats['total_time'] / stats['count'] if stats['count'] else 0
+        }
 
     def submit(self, name, args, sender, env=None):
         if name not in self.dispatcher.tasks:
             self.logger.warning("Cannot submit task: unknown task type %s", name)
             raise RpcException(errno.EINVAL, "Unknown task type {0}".format(name))
 
+        if len(self.executor_waiters) >= self.executors_max_queue:
+            self.logger.warning("Cannot submit task %s: executor pool saturated", name)
+            raise RpcException(errno.EBUSY, "Too many tasks waiting for an executor, try again later")
+
         task = Task(self.dispatcher, name)
         task.user = sender.user.name
         task.session_id = sender.session_id
@@ -729,8 +1040,11 @@ class Balancer(object):
         """
         with self.schedule_lock:
             started = 0
-            executing_tasks = [t for t in self.task_list if t.state == TaskState.EXECUTING]
-            waiting_tasks = [t for t in self.task_list if t.state == TaskState.WAITING]
+            executing_tasks = [
+                t for t in self.task_list
+                if t.state == TaskState.EXECUTING or (t.state == TaskState.WAITING and t.scheduled)
+            ]
+            waiting_tasks = [t for t in self.task_list if t.state == TaskState.WAITING and not t.scheduled]
 
             for task in waiting_tasks:
                 if not self.resource_graph.can_acquire(*task.resources):
@@ -757,7 +1071,13 @@ class Balancer(object):
             try:
                 self.logger.debug("Picked up task %d: %s with args %s", task.id, task.name, task.args)
 
+                started_at = time.monotonic()
                 errors = self.verify_schema(self.dispatcher.tasks[task.name], task.args, task.strict_verify)
+                task.validation_time = time.monotonic() - started_at
+                self.validation_stats['count'] += 1
+                self.validation_stats['total_time'] += task.validation_time
+                self.validation_stats['max_time'] = max(self.validation_stats['max_time'], task.validation_time)
+
                 if len(errors) > 0:
                     errors = list(validator.serialize_errors(errors))
                     self.logger.warning("Cannot submit task {0}: schema verification failed with errors {1}".format(
@@ -792,27 +1112,124 @@ class Balancer(object):
                 self.logger.debug("Task %d assigned to resources %s", task.id, ','.join(task.resources))
 
     def assign_executor(self, task):
-        for i in self.executors:
-            with i.cv:
-                if i.state == WorkerState.IDLE:
-                    self.logger.info("Task %d assigned to executor #%d", task.id, i.index)
-                    task.executor = i
-                    i.state = WorkerState.ASSIGNED
-                    return
-
-        # Out of executors! Need to spawn new one
-        executor = TaskExecutor(self, len(self.executors))
-        self.executors.append(executor)
+        """
+        Picks an idle executor, spawns a new one while the pool is below
+        executors_max or queues the task until an executor gets released.
+        Subtasks are never queued: their parents hold executors while
+        waiting for them, so a saturated pool would deadlock.
+        """
+        waited_since = None
+        while True:
+            executor = first_or_default(lambda e: e.state == WorkerState.IDLE and not e.reserved, self.executors)
+            if executor:
+                with executor.cv:
+                    executor.state = WorkerState.ASSIGNED
+                    task.executor = executor
+                break
+
+            if task.parent or len(self.executors) < self.executors_max:
+                executor = self.spawn_executor()
+                executor.reserved = True
+                with executor.cv:
+                    executor.cv.wait_for(lambda: executor.state == WorkerState.IDLE)
+                    executor.reserved = False
+                    executor.state = WorkerState.ASSIGNED
+                    task.executor = executor
+                break
+
+            waiter = AsyncResult()
+            if waited_since is None:
+                waited_since = time.monotonic()
+                self.executor_stats['waited'] += 1
+                self.executor_waiters.append(waiter)
+            else:
+                # Woken up but lost the race, keep our place in the queue
+                self.executor_waiters.appendleft(waiter)
+
+            self.executor_stats['peak_waiting'] = max(self.executor_stats['peak_waiting'], len(self.executor_waiters))
+            try:
+                waiter.get()
+            finally:
+                if waiter in self.executor_waiters:
+                    self.executor_waiters.remove(waiter)
+
+        if waited_since is not None:
+            self.executor_stats['wait_time'] += time.monotonic() - waited_since
+
+        self.logger.info("Task %d assigned to executor #%d", task.id, executor.index)
+
+    def release_executor(self, executor):
         with executor.cv:
-            executor.cv.wait_for(lambda: executor.state == WorkerState.IDLE)
-            executor.state = WorkerState.ASSIGNED
-            task.executor = executor
-            self.logger.info("Task %d assigned to executor #%d", task.id, executor.index)
+            if executor.state == WorkerState.ASSIGNED:
+                executor.set_idle()
+
+    def executor_released(self, executor):
+        if self.executor_waiters:
+            self.executor_waiters.popleft().set()
+
+    def reap_executors(self):
+        now = time.monotonic()
+        for executor in list(self.executors):
+            if len(self.executors) <= self.executors_min:
+                break
+
+            if executor.state != WorkerState.IDLE or executor.reserved:
+                continue
+
+            if now - executor.idle_since < self.executors_idle_timeout:
+                continue
+
+            self.logger.info('Reaping task executor #{0} (idle for {1:.0f} seconds)'.format(
+                executor.index,
+                now - executor.idle_since
+            ))
+
+            self.executors.remove(executor)
+            self.executor_stats['reaped'] += 1
+            executor.die()
+
+    def reaper_thread(self):
+        while True:
+            gevent.sleep(EXECUTORS_REAP_INTERVAL)
+            try:
+                self.reap_executors()
+            except BaseException as err:
+                self.logger.error('Failed to reap task executors: {0}'.format(str(err)), exc_info=True)
+
+    def get_pool_status(self):
+        states = collections.Counter(e.state for e in self.executors)
+        busy = states[WorkerState.ASSIGNED] + states[WorkerState.EXECUTING]
+        return {
+            'size': len(self.executors),
+            'min': self.executors_min,
+            'max': self.executors_max,
+            'prewarm': self.executors_prewarm,
+            'idle_timeout': self.executors_idle_timeout,
+            'max_queue': self.executors_max_queue,
+            'idle': states[WorkerState.IDLE],
+            'busy': busy,
+            'starting': states[WorkerState.STARTING],
+            'waiting': len(self.executor_waiters),
+            'utilization': busy / self.executors_max,
+            'spawned': self.executor_stats['spawned'],
+            'reaped': self.executor_stats['reaped'],
+            'peak_size': self.executor_stats['peak_size'],
+            'peak_waiting': self.executor_stats['peak_waiting'],
+            'average_wait': (
+                self.executor_stats['wait_time'] / self.executor_stats['waited']
+                if self.executor_stats['waited'] else 0
+            )
+        }
 
     def dispose_executors(self):
+        if self.zygote:
+            self.zygote.stop()
+
         for i in self.executors:
             i.die()
 
+        self.task_writer.flush()
+
     def get_active_tasks(self):
         return [x for x in self.task_list if x.state in (
             TaskState.CREATED,
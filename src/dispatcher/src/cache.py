@@ -27,8 +27,132 @@
 
 from gevent.event import Event
 from gevent.lock import RLock
-from freenas.utils.query import query, set
-from sortedcontainers import SortedDict
+from freenas.utils.query import query, get, set
+from sortedcontainers import SortedDict, SortedList
+from query import prefilter
+
+
+RANGE_OPERATORS = ('>', '<', '>=', '<=')
+
+
+class HashIndex(object):
+    def __init__(self, field):
+        self.field = field
+        self.values = {}
+        self.keys = {}
+        self.unhashable = {}
+
+    def add(self, key, data):
+        try:
+            value = get(data, self.field)
+            bucket = self.values.setdefault(value, {})
+        except (TypeError, ValueError, AttributeError):
+            self.unhashable[key] = None
+            return
+
+        bucket[key] = None
+        self.keys[key] = value
+        if len(bucket) == 1:
+            self.value_added(value)
+
+    def remove(self, key):
+        if key in self.unhashable:
+            del self.unhashable[key]
+            return
+
+        if key not in self.keys:
+            return
+
+        value = self.keys.pop(key)
+        bucket = self.values[value]
+        del bucket[key]
+        if not bucket:
+            del self.values[value]
+            self.value_removed(value)
+
+    def value_added(self, value):
+        pass
+
+    def value_removed(self, value):
+        pass
+
+    def clear(self):
+        self.values.clear()
+        self.keys.clear()
+        self.unhashable.clear()
+
+    def lookup(self, op, value):
+        if op == '=':
+            values = [value]
+        elif op == 'in' and isinstance(value, (list, tuple)):
+            values = value
+        else:
+            return None
+
+        result = dict(self.unhashable)
+        try:
+            for v in values:
+                result.update(self.values.get(v, ()))
+        except TypeError:
+            return None
+
+        return result
+
+
+class SortedIndex(HashIndex):
+    def __init__(self, field):
+        super(SortedIndex, self).__init__(field)
+        self.ordered = SortedList()
+        self.unordered = {}
+
+    def value_added(self, value):
+        if value is not None:
+            try:
+                self.ordered.add(value)
+                return
+            except TypeError:
+                pass
+
+        self.unordered[value] = None
+
+    def value_removed(self, value):
+        if value in self.unordered:
+            del self.unordered[value]
+            return
+
+        self.ordered.remove(value)
+
+    def clear(self):
+        super(SortedIndex, self).clear()
+        self.ordered.clear()
+        self.unordered.clear()
+
+    def lookup(self, op, value):
+        if op not in RANGE_OPERATORS:
+            return super(SortedIndex, self).lookup(op, value)
+
+        try:
+            if op in ('>', '>='):
+                values = list(self.ordered.irange(minimum=value, inclusive=(op == '>=', True)))
+            else:
+                values = list(self.ordered.irange(maximum=value, inclusive=(True, op == '<=')))
+        except TypeError:
+            return None
+
+        result = dict(self.unhashable)
+        for v in values:
+            result.update(self.values[v])
+
+        for v in self.unordered:
+            result.update(self.values[v])
+
+        return result
+
+
+INDEX_TYPES = {
+    'hash': HashIndex,
+    'sorted': SortedIndex
+}
 
 
 class CacheStore(object):
@@ -37,18 +161,39 @@ class CacheStore(object):
             self.valid = Event()
             self.data = None
 
-    def __init__(self, key=None):
+    def __init__(self, key=None, indexes=None):
         self.lock = RLock()
         self.store = SortedDict(key)
+        self.indexes = {}
+        for field, type in (indexes or {}).items():
+            self.add_index(field, type)
 
     def __getitem__(self, item):
         return self.get(item)
 
+    def add_index(self, field, type='hash'):
+        with self.lock:
+            index = INDEX_TYPES[type](field)
+            for key, value in self.store.items():
+                index.add(key, value.data)
+
+            self.indexes[field] = index
+
+    def __index_add(self, key, data):
+        for index in self.indexes.values():
+            index.remove(key)
+            index.add(key, data)
+
+    def __index_remove(self, key):
+        for index in self.indexes.values():
+            index.remove(key)
+
     def put(self, key, data):
         with self.lock:
             item = self.store[key] if key in self.store else self.CacheItem()
             item.data = data
             item.valid.set()
+            self.__index_add(key, data)
 
             if key not in self.store:
                 self.store[key] = item
@@ -65,6 +210,7 @@ class CacheStore(object):
                 items[k] = self.CacheItem()
                 items[k].data = v
                 items[k].valid.set()
+                self.__index_add(k, v)
                 if k in self.store:
                     updated.append(k)
                 else:
@@ -107,6 +253,7 @@ class CacheStore(object):
         with self.lock:
             if key in self.store:
                 del self.store[key]
+                self.__index_remove(key)
                 return True
 
             return False
@@ -117,6 +264,7 @@ class CacheStore(object):
             for key in keys:
                 if key in self.store:
                     del self.store[key]
+                    self.__index_remove(key)
                     removed.append(key)
 
             return removed
@@ -125,6 +273,9 @@ class CacheStore(object):
         with self.lock:
             items = list(self.store.keys())
             self.store.clear()
+            for index in self.indexes.values():
+                index.clear()
+
             return items
 
     def exists(self, key):
@@ -161,21 +312,53 @@ class CacheStore(object):
                 yield value.data
 
     def remove_predicate(self, predicate):
-        result = []
-        for k, v in self.itervalid():
-            if predicate(v):
-                self.remove(k)
-                result.append(k)
+        with self.lock:
+            result = []
+            for k, v in self.itervalid():
+                if predicate(v):
+                    self.remove(k)
+                    result.append(k)
 
-        return result
+            return result
+
+    def plan(self, filter):
+        # Pick the most selective indexed predicate, if any. The full filter
+        # is still applied to the candidates, so an index only ever narrows
+        # down the set of items to scan.
+        best = None
+        for rule in filter:
+            if not isinstance(rule, (list, tuple)) or len(rule) != 3:
+                continue
+
+            field, op, value = rule
+            index = self.indexes.get(field)
+            if not index:
+                continue
+
+            candidates = index.lookup(op, value)
+            if candidates is not None and (best is None or len(candidates) < len(best)):
+                best = candidates
+
+        return best
 
     def query(self, *filter, **params):
-        return query(list(self.validvalues()), *filter, **params)
+        with self.lock:
+            candidates = self.plan(filter) if self.indexes else None
+            if candidates is None:
+                values, rest = prefilter(self.validvalues(), filter)
+                return query(list(values), *rest, **params)
+
+            keys = sorted(candidates, key=self.store.key) if self.store.key else sorted(candidates)
+            items = (self.store.get(k) for k in keys)
+            values, rest = prefilter((i.data for i in items if i and i.valid.is_set()), filter)
+            values = list(values)
+
+        return query(values, *rest, **params)
 
 
 class EventCacheStore(CacheStore):
-    def __init__(self, dispatcher, name, key=None):
-        super(EventCacheStore, self).__init__(key=key)
+    def __init__(self, dispatcher, name, key=None, indexes=None):
+        super(EventCacheStore, self).__init__(key=key, indexes=indexes)
         self.dispatcher = dispatcher
         self.ready = False
         self.name = name
@@ -26,7 +26,13 @@
 #####################################################################
 
 
+import re
+import fnmatch
 import logging
+from gevent.lock import RLock
+
+
+GLOB_CHARS = re.compile(r'[*?\[]')
 
 
 class EventSource(object):
@@ -48,6 +54,133 @@ class EventSource(object):
         self.dispatcher.dispatch_event(type, kwargs)
 
 
+class TrieNode(object):
+    __slots__ = ('children', 'masks')
+
+    def __init__(self):
+        self.children = {}
+        self.masks = {}
+
+
+class EventSubscriptionIndex(object):
+    """
+    Maps event names to the connections subscribed to them. Plain names
+    live in a hash table, glob masks in a trie keyed by their literal
+    prefix and regex masks are matched one by one. Results are cached per
+    event name until the next subscription change.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.globs = TrieNode()
+        self.regexes = {}
+        self.cache = {}
+        self.lock = RLock()
+
+    def add(self, conn, mask):
+        with self.lock:
+            self.__subscribers(mask, True).add(conn)
+            self.cache.clear()
+
+    def remove(self, conn, mask):
+        with self.lock:
+            subscribers = self.__subscribers(mask, False)
+            if subscribers is None:
+                return
+
+            subscribers.discard(conn)
+            if not subscribers:
+                self.__prune(mask)
+
+            self.cache.clear()
+
+    def match(self, name):
+        with self.lock:
+            result = self.cache.get(name)
+            if result is not None:
+                return result
+
+            result = set(self.exact.get(name, ()))
+
+            node = self.globs
+            for ch in name:
+                self.__match_node(node, name, result)
+                node = node.children.get(ch)
+                if node is None:
+                    break
+            else:
+                self.__match_node(node, name, result)
+
+            for pattern, subscribers in self.regexes.items():
+                if pattern.match(name) is not None:
+                    result.update(subscribers)
+
+            result = frozenset(result)
+            self.cache[name] = result
+            return result
+
+    def is_subscribed(self, conn, name):
+        return conn in self.match(name)
+
+    def __match_node(self, node, name, result):
+        for regex, subscribers in node.masks.values():
+            if regex.match(name) is not None:
+                result.update(subscribers)
+
+    def __subscribers(self, mask, create):
+        if not isinstance(mask, str):
+            if create:
+                return self.regexes.setdefault(mask, set())
+
+            return self.regexes.get(mask)
+
+        m = GLOB_CHARS.search(mask)
+        if not m:
+            if create:
+                return self.exact.setdefault(mask, set())
+
+            return self.exact.get(mask)
+
+        node = self.globs
+        for ch in mask[:m.start()]:
+            if ch not in node.children:
+                if not create:
+                    return None
+
+                node.children[ch] = TrieNode()
+
+            node = node.children[ch]
+
+        if mask not in node.masks:
+            if not create:
+                return None
+
+            node.masks[mask] = (re.compile(fnmatch.translate(mask)), set())
+
+        return node.masks[mask][1]
+
+    def __prune(self, mask):
+        if not isinstance(mask, str):
+            self.regexes.pop(mask, None)
+            return
+
+        m = GLOB_CHARS.search(mask)
+        if not m:
+            self.exact.pop(mask, None)
+            return
+
+        path = [self.globs]
+        for ch in mask[:m.start()]:
+            path.append(path[-1].children[ch])
+
+        del path[-1].masks[mask]
+        for ch, (parent, node) in zip(reversed(mask[:m.start()]), reversed(list(zip(path, path[1:])))):
+            if node.children or node.masks:
+                break
+
+            del parent.children[ch]
+
+
 def sync(fn):
     fn.sync = True
     return fn
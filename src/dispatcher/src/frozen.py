@@ -0,0 +1,102 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+def readonly(*args, **kwargs):
+    raise TypeError('Shared RPC result is read-only, use copy.deepcopy() to get a mutable copy')
+
+
+def freeze(obj):
+    if type(obj) is dict:
+        return FrozenDict(obj)
+
+    if type(obj) is list:
+        return FrozenList(obj)
+
+    return obj
+
+
+class FrozenDict(dict):
+    """
+    Read-only view of a dict shared with an in-process RPC provider.
+    Nested containers are wrapped lazily when they are accessed, so only
+    the parts of the result that the caller actually reads get copied.
+    """
+
+    __setitem__ = __delitem__ = readonly
+    clear = pop = popitem = setdefault = update = readonly
+    __ior__ = readonly
+
+    def __getitem__(self, key):
+        return freeze(dict.__getitem__(self, key))
+
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        return freeze(dict.get(self, key, default))
+
+    def values(self):
+        return [freeze(v) for v in dict.values(self)]
+
+    def items(self):
+        return [(k, freeze(v)) for k, v in dict.items(self)]
+
+    def copy(self):
+        return dict(self.items())
+
+    __copy__ = copy
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(dict.items(self)),)
+
+
+class FrozenList(list):
+    __setitem__ = __delitem__ = readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = readonly
+    __iadd__ = __imul__ = readonly
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return FrozenList(list.__getitem__(self, index))
+
+        return freeze(list.__getitem__(self, index))
+
+    def __iter__(self):
+        for i in list.__iter__(self):
+            yield freeze(i)
+
+    def __add__(self, other):
+        return list(self) + other
+
+    def copy(self):
+        return list(self)
+
+    __copy__ = copy
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(list.__iter__(self)),)
@@ -0,0 +1,86 @@
+#
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+import collections
+
+
+class FramedReader(object):
+    """
+    Reads delimiter-terminated frames from a socket, pulling data in large
+    chunks instead of a byte at a time. Memory use is bounded: frames longer
+    than max_frame_size are dropped (and counted) instead of being buffered.
+    """
+    def __init__(self, sock, delimiter=b'\x00', chunk_size=65536, max_frame_size=1024 * 1024):
+        self.sock = sock
+        self.delimiter = delimiter
+        self.chunk_size = chunk_size
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        self.frames = collections.deque()
+        self.discarding = False
+        self.dropped = 0
+
+    def read_frame(self):
+        """
+        Returns the next complete frame without the delimiter or None once
+        the peer closed the connection. A trailing partial frame is discarded.
+        """
+        while not self.frames:
+            data = self.sock.recv(self.chunk_size)
+            if not data:
+                return None
+
+            self.feed(data)
+
+        return self.frames.popleft()
+
+    def feed(self, data):
+        self.buffer += data
+        if self.delimiter not in data:
+            self.check_overflow()
+            return
+
+        parts = self.buffer.split(self.delimiter)
+        self.buffer = bytearray(parts.pop())
+        for i in parts:
+            if self.discarding:
+                # Remainder of an oversized frame
+                self.discarding = False
+                continue
+
+            self.frames.append(bytes(i))
+
+        self.check_overflow()
+
+    def check_overflow(self):
+        if len(self.buffer) > self.max_frame_size:
+            if not self.discarding:
+                self.dropped += 1
+
+            self.discarding = True
+            self.buffer = bytearray()
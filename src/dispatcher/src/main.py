@@ -33,6 +33,7 @@ import os
 import sys
 import re
 import fnmatch
+import inspect
 import json
 import datetime
 import logging
@@ -75,7 +76,8 @@ from services import (
     ManagementService, DebugService, EventService, TaskService,
     PluginService, ShellService, LockService
 )
-from event import sync
+from event import sync, EventSubscriptionIndex
+from frozen import freeze
 from schemas import register_general_purpose_schemas
 from balancer import Balancer
 from auth import PasswordAuthenticator, TokenStore, Token, User, Service
@@ -332,11 +334,13 @@ class Dispatcher(object):
         self.queues = {}
         self.providers = {}
         self.tasks = {}
+        self.task_modules = {}
         self.task_hooks = {}
         self.resource_graph = ResourceGraph()
         self.logger = logging.getLogger('Main')
         self.token_store = TokenStore(self)
         self.event_delivery_lock = RLock()
+        self.event_index = EventSubscriptionIndex()
         self.rpc = None
         self.balancer = None
         self.datastore = None
@@ -364,6 +368,7 @@ class Dispatcher(object):
         self.start_logdb()
 
         self.datastore = get_datastore(self.configfile)
+        self.datastore.watch_collections()
         self.configstore = ConfigStore(self.datastore)
 
         self.migrate_logdb()
@@ -468,6 +473,10 @@ class Dispatcher(object):
         # And look for new ones
         self.discover_plugins()
 
+        # Preloaded modules in the executor zygote are stale now
+        if self.balancer.zygote:
+            self.balancer.zygote.restart()
+
     def unload_plugins(self):
         # Generate a list of inverse plugin dependency
         required_by = {}
@@ -572,9 +581,8 @@ class Dispatcher(object):
                 # If there's no timestamp, assume event fired right now
                 args['timestamp'] = datetime.datetime.utcnow()
 
-            for srv in self.ws_servers:
-                for conn in srv.connections:
-                    conn.outgoing_events.put((name, args))
+            for conn in self.event_index.match(name):
+                conn.outgoing_events.put((name, args))
 
         if name in self.event_handlers:
             for h in self.event_handlers[name]:
@@ -663,13 +671,40 @@ class Dispatcher(object):
     def register_task_handler(self, name, clazz):
         self.logger.debug("New task handler: {0}".format(name))
         self.tasks[name] = clazz
+        self.task_modules[name] = self.resolve_task_module(clazz)
 
     def register_task_alias(self, name, name2):
         self.logger.debug("New task alias: {0} -> {1}".format(name, name2))
         self.tasks[name] = self.tasks[name2]
+        self.task_modules[name] = self.task_modules.get(name2)
 
     def unregister_task_handler(self, name):
-        del self.tasks[name]
+        clazz = self.tasks.pop(name)
+        self.task_modules.pop(name, None)
+        if clazz not in self.tasks.values():
+            self.balancer.invalidate_validators(clazz)
+
+    def resolve_task_module(self, clazz):
+        """
+        Returns path of the file taskworker has to load to get the task class.
+        Called when tasks get registered, so that executors never have to
+        search plugin directories while starting a task.
+        """
+        module = inspect.getmodule(clazz)
+        filename = getattr(module, '__file__', None)
+        if filename and os.path.isfile(filename):
+            return filename
+
+        # Module was not loaded from a file; look it up by name like before
+        for dir in self.plugin_dirs:
+            for root, _, files in os.walk(dir):
+                for f in files:
+                    name, ext = os.path.splitext(f)
+                    if name == module.__name__ and ext in ('.py', '.pyc', '.so'):
+                        return os.path.join(root, f)
+
+        self.logger.warning('Cannot find module file of task class {0}'.format(clazz.__name__))
+        return None
 
     def register_task_hook(self, hook, name, condition=None):
         task_name, hook_name = hook.split(':')
@@ -698,6 +733,9 @@ class Dispatcher(object):
 
     def register_schema_definition(self, name, definition):
         self.rpc.register_schema_definition(name, definition)
+        if self.balancer:
+            self.balancer.invalidate_validators()
+
         if self.ready:
             def emit_changed_event():
                 self.dispatch_event('server.schema_document_changed', {
@@ -708,6 +746,8 @@ class Dispatcher(object):
 
     def unregister_schema_definition(self, name):
         self.rpc.unregister_schema_definition(name)
+        if self.balancer:
+            self.balancer.invalidate_validators()
 
     def require_collection(self, collection, pkey_type='uuid', **kwargs):
         if not self.datastore.collection_exists(collection):
@@ -880,17 +920,29 @@ class DispatcherRpcContext(RpcContext):
         super(DispatcherRpcContext, self).__init__()
         self.dispatcher = dispatcher
 
+    def get_result_copier(self, name):
+        # Providers marked with @shared_result hand out read-only views
+        # of their data instead of deep copies
+        service, _, method = name.rpartition('.')
+        fn = getattr(self.get_service(service), method, None)
+        if getattr(fn, 'shared_result', False):
+            return freeze
+
+        return copy.deepcopy
+
     def call_sync(self, name, *args):
+        copier = self.get_result_copier(name)
+
         def unpack_chunk(it):
             for chunk in it:
                 for item in chunk:
-                    yield copy.deepcopy(item)
+                    yield copier(item)
 
         result = self.dispatch_call(name, list(args), streaming=True, validation=False)
         if hasattr(result, '__next__'):
             return unpack_chunk(result)
 
-        return copy.deepcopy(result)
+        return copier(result)
 
 
 class DispatcherConnection(ServerConnection):
@@ -959,6 +1011,7 @@ class DispatcherConnection(ServerConnection):
                 if match_event(name, mask):
                     ev.decref()
 
+            self.dispatcher.event_index.remove(self, mask)
             self.event_masks.remove(mask)
 
         self.outgoing_events.put(StopIteration)
@@ -1005,6 +1058,8 @@ class DispatcherConnection(ServerConnection):
                     if match_event(name, mask):
                         ev.incref()
 
+                self.dispatcher.event_index.add(self, mask)
+
             self.event_masks = set.union(self.event_masks, set(event_masks))
 
     def on_events_unsubscribe(self, id, event_masks):
@@ -1028,6 +1083,8 @@ class DispatcherConnection(ServerConnection):
                     if match_event(name, mask):
                         ev.decref()
 
+                self.dispatcher.event_index.remove(self, mask)
+
             self.event_masks = set.difference(self.event_masks, intersecting_unsubscribe_events)
 
     def on_events_event(self, id, data):
@@ -1250,10 +1307,7 @@ class DispatcherConnection(ServerConnection):
                 'following error occured {0}'.format(str(werr)))
 
     def emit_event(self, event, args):
-        for i in list(self.event_masks):
-            if not match_event(event, i):
-                continue
-
+        if self.dispatcher.event_index.is_subscribed(self, event):
             self.send_event(event, args)
 
     def emit_rpc_call(self, id, method, args):
@@ -27,6 +27,16 @@
 
 
 import re
+import copy
+from collections import OrderedDict
+
+
+QUERY_CACHE_SIZE = 256
+COMPILED_OPERATORS = ('=', '!=', 'in', 'nin', '>', '<', '>=', '<=', '~')
+OPERATOR_COST = {'=': 0, '!=': 0, 'in': 1, 'nin': 1, '>': 2, '<': 2, '>=': 2, '<=': 2, '~': 3}
+
+
+compiled_cache = OrderedDict()
 
 
 def resolve_property(obj, path):
@@ -47,37 +57,180 @@ def resolve_property(obj, path):
     return ptr
 
 
+def compile_getter(path):
+    items = tuple((i, int(i) if i.isdigit() else None) for i in path.split('.'))
+
+    if len(items) == 1:
+        key, _ = items[0]
+
+        def getter(obj):
+            try:
+                return obj[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+
+        return getter
+
+    def getter(obj):
+        ptr = obj
+        try:
+            for key, index in items:
+                ptr = ptr[index] if type(ptr) is list else ptr[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+        return ptr
+
+    return getter
+
+
+def compile_rule(left, op, right):
+    get = compile_getter(left)
+
+    if op == '=':
+        return lambda i: get(i) == right
+
+    if op == '!=':
+        return lambda i: get(i) != right
+
+    if op in ('in', 'nin'):
+        values = right
+        if isinstance(right, (list, tuple, set, frozenset)):
+            try:
+                values = frozenset(right)
+            except TypeError:
+                pass
+
+        def member(i):
+            value = get(i)
+            try:
+                return value in values
+            except TypeError:
+                # Unhashable values (lists, dicts) need plain membership
+                return value in right
+
+        if op == 'in':
+            return member
+
+        return lambda i: not member(i)
+
+    if op == '~':
+        regex = re.compile(right)
+
+        def match(i):
+            value = get(i)
+            return isinstance(value, str) and regex.search(value) is not None
+
+        return match
+
+    compare = {
+        '>': lambda x: x > right,
+        '<': lambda x: x < right,
+        '>=': lambda x: x >= right,
+        '<=': lambda x: x <= right,
+    }[op]
+
+    def ordered(i):
+        try:
+            return compare(get(i))
+        except TypeError:
+            return False
+
+    return ordered
+
+
+def is_compilable(rule):
+    return (
+        isinstance(rule, (list, tuple)) and
+        len(rule) == 3 and
+        isinstance(rule[0], str) and
+        rule[1] in COMPILED_OPERATORS
+    )
+
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(i) for i in value)
+
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+
+    hash(value)
+    return type(value).__name__, value
+
+
+def compile_filter(rules):
+    """
+    Turns a list of (field, operator, value) rules into a single predicate.
+
+    Only rules using operators from COMPILED_OPERATORS are accepted. Cheap
+    checks are evaluated first so that a failing row is rejected before any
+    regular expression runs. Compiled predicates are cached by the signature
+    of the rule list, so repeated queries skip compilation entirely.
+    """
+    try:
+        signature = freeze(rules)
+    except TypeError:
+        signature = None
+
+    if signature is not None:
+        predicate = compiled_cache.get(signature)
+        if predicate:
+            compiled_cache.move_to_end(signature)
+            return predicate
+
+    ordered = sorted(rules, key=lambda r: OPERATOR_COST[r[1]])
+    if signature is not None:
+        # Cached predicates must not see later changes to the caller's values
+        ordered = [(left, op, copy.deepcopy(right)) for left, op, right in ordered]
+
+    checks = tuple(compile_rule(*r) for r in ordered)
+
+    if not checks:
+        predicate = lambda i: True
+    elif len(checks) == 1:
+        predicate = checks[0]
+    else:
+        predicate = lambda i: all(c(i) for c in checks)
+
+    if signature is not None:
+        compiled_cache[signature] = predicate
+        while len(compiled_cache) > QUERY_CACHE_SIZE:
+            compiled_cache.popitem(last=False)
+
+    return predicate
+
+
+def split_filter(rules):
+    """
+    Splits rules into a compiled predicate (or None) and the rules that
+    still need to be evaluated by a generic query implementation.
+    """
+    compiled = []
+    rest = []
+    for rule in rules or ():
+        (compiled if is_compilable(rule) else rest).append(rule)
+
+    return (compile_filter(compiled) if compiled else None), rest
+
+
+def prefilter(iterable, rules):
+    predicate, rest = split_filter(rules)
+    if predicate is None:
+        return iterable, rest
+
+    return filter(predicate, iterable), rest
+
+
 def filter_query(iterable, *rules, **params):
     single = params.pop('single', False)
-    result = []
-    operators_table = {
-        '=': lambda x, y: x == y,
-        '!=': lambda x, y: x != y,
-        '>': lambda x, y: x > y,
-        '<': lambda x, y: x < y,
-        '>=': lambda x, y: x >= y,
-        '<=': lambda x, y: x <= y,
-        '~': lambda x, y: re.match(x, y)
-    }
-
-    if len(rules) == 0:
-        return list(iterable)
-
-    for i in iterable:
-        fail = False
-        for left, op, right in rules:
-            value = resolve_property(i, left)
-            operator = operators_table[op]
-
-            if operator(value, right):
-                continue
-
-            fail = True
-
-        if not fail:
-            if single:
+    predicate = compile_filter(rules)
+
+    if single:
+        for i in iterable:
+            if predicate(i):
                 return i
 
-            result.append(i)
+        return None
 
-    return result
+    return [i for i in iterable if predicate(i)]
@@ -49,12 +49,21 @@ class ResourceError(RuntimeError):
 
 
 class ResourceGraph(object):
+    """
+    Dependency graph of resources. Lookups by name go through a dict index
+    and descendant/ancestor sets are cached per node. Structural changes
+    only drop the cache entries of nodes whose closure actually changed.
+    """
     def __init__(self):
         self.logger = logging.getLogger('ResourceGraph')
         self.mutex = RLock()
         self.root = Resource('root')
         self.resources = nx.DiGraph()
         self.resources.add_node(self.root)
+        self.index = {self.root.name: self.root}
+        self.descendants_cache = {}
+        self.ancestors_cache = {}
+        self.busy = set()
 
     def lock(self):
         self.mutex.acquire()
@@ -66,93 +75,148 @@ class ResourceGraph(object):
     def nodes(self):
         return self.resources.nodes()
 
+    def descendants(self, resource):
+        ret = self.descendants_cache.get(resource)
+        if ret is None:
+            ret = self.descendants_cache[resource] = frozenset(nx.descendants(self.resources, resource))
+
+        return ret
+
+    def ancestors(self, resource):
+        ret = self.ancestors_cache.get(resource)
+        if ret is None:
+            ret = self.ancestors_cache[resource] = frozenset(nx.ancestors(self.resources, resource))
+
+        return ret
+
+    def invalidate(self, descendants_of=(), ancestors_of=()):
+        for i in descendants_of:
+            self.descendants_cache.pop(i, None)
+
+        for i in ancestors_of:
+            self.ancestors_cache.pop(i, None)
+
     def add_resource(self, resource, parents=None):
         with self.mutex:
             if not resource:
                 raise ResourceError('Invalid resource')
-    
+
             if self.get_resource(resource.name):
                 raise ResourceError('Resource {0} already exists'.format(resource.name))
-    
-            self.resources.add_node(resource)
+
             if not parents:
                 parents = ['root']
-    
+
+            nodes = []
             for p in parents:
                 node = self.get_resource(p)
                 if not node:
                     raise ResourceError('Invalid parent resource {0}'.format(p))
-    
+
+                nodes.append(node)
+
+            self.resources.add_node(resource)
+            self.index[resource.name] = resource
+            for node in nodes:
                 self.resources.add_edge(node, resource)
 
+            # New leaf: only the descendant sets of its ancestors change
+            for node in nodes:
+                self.invalidate(descendants_of=self.ancestors(node) | {node})
+
     def remove_resource(self, name):
         with self.mutex:
             resource = self.get_resource(name)
-    
+
             if not resource:
                 return
-    
-            for i in nx.descendants(self.resources, resource):
-                self.resources.remove_node(i)
-    
-            self.resources.remove_node(resource)
+
+            self.__remove(resource)
 
     def remove_resources(self, names):
         with self.mutex:
             for name in names:
                 resource = self.get_resource(name)
-    
+
                 if not resource:
-                    return
-    
-                for i in nx.descendants(self.resources, resource):
-                    self.resources.remove_node(i)
-    
-                self.resources.remove_node(resource)
+                    continue
+
+                self.__remove(resource)
+
+    def __remove(self, resource):
+        removed = self.descendants(resource) | {resource}
+        affected = set()
+        for i in removed:
+            affected |= self.ancestors(i)
+
+        for i in removed:
+            self.resources.remove_node(i)
+            if self.index.get(i.name) is i:
+                del self.index[i.name]
+
+            self.busy.discard(i)
+
+        self.invalidate(descendants_of=affected | removed, ancestors_of=removed)
 
     def update_resource(self, name, new_parents):
         with self.mutex:
             resource = self.get_resource(name)
-    
+
             if not resource:
                 return
-    
-            for i in self.resources.predecessors(resource):
-                self.resources.remove_edge(i, resource)
-    
+
+            nodes = []
             for p in new_parents:
                 node = self.get_resource(p)
                 if not node:
                     raise ResourceError('Invalid parent resource {0}'.format(p))
-    
+
+                nodes.append(node)
+
+            subtree = self.descendants(resource) | {resource}
+            affected = set(self.ancestors(resource))
+
+            for i in list(self.resources.predecessors(resource)):
+                self.resources.remove_edge(i, resource)
+
+            for node in nodes:
                 self.resources.add_edge(node, resource)
 
+            self.invalidate(ancestors_of=subtree)
+            affected |= self.ancestors(resource)
+            self.invalidate(descendants_of=affected)
+
     def get_resource(self, name):
-        f = [i for i in self.resources.nodes() if i.name == name]
-        return f[0] if len(f) > 0 else None
+        return self.index.get(name)
 
     def get_resource_dependencies(self, name):
         res = self.get_resource(name)
         for i, _ in self.resources.in_edges([res]):
             yield i.name
 
+    def busy_descendants(self, res):
+        # Few resources are busy at a time, so check those against the
+        # cached closure instead of walking every descendant
+        descendants = self.descendants(res)
+        return any(i in descendants for i in self.busy)
+
     def acquire(self, *names):
         if not names:
             return
 
         with self.mutex:
             self.logger.debug('Acquiring following resources: %s', ','.join(names))
-    
+
             for name in names:
                 res = self.get_resource(name)
                 if not res:
                     raise ResourceError('Resource {0} not found'.format(name))
-    
-                for i in nx.descendants(self.resources, res):
-                    if i.busy:
-                        raise ResourceError('Cannot acquire, some of dependent resources are busy')
-    
+
+                if self.busy_descendants(res):
+                    raise ResourceError('Cannot acquire, some of dependent resources are busy')
+
                 res.busy = True
+                self.busy.add(res)
 
     def can_acquire(self, *names):
         if not names:
@@ -160,19 +224,18 @@ class ResourceGraph(object):
 
         with self.mutex:
             self.logger.log(TRACE, 'Trying to acquire following resources: %s', ','.join(names))
-    
+
             for name in names:
                 res = self.get_resource(name)
                 if not res:
                     return False
-    
+
                 if res.busy:
                     return False
-    
-                for i in nx.descendants(self.resources, res):
-                    if i.busy:
-                        return False
-    
+
+                if self.busy_descendants(res):
+                    return False
+
             return True
 
     def release(self, *names):
@@ -181,7 +244,8 @@ class ResourceGraph(object):
 
         with self.mutex:
             self.logger.debug('Releasing following resources: %s', ','.join(names))
-    
+
             for name in names:
                 res = self.get_resource(name)
                 res.busy = False
+                self.busy.discard(res)
@@ -168,6 +168,13 @@ def register_general_purpose_schemas(dispatcher):
                 'enum': ['CREATED', 'WAITING', 'EXECUTING', 'ROLLBACK', 'FINISHED', 'FAILED', 'ABORTED']
             },
             'output': {'type': 'string'},
+            'output_size': {'type': 'integer'},
+            'validation_time': {
+                'oneOf': [
+                    {'type': 'null'},
+                    {'type': 'number'}
+                ]
+            },
             'warnings': {
                 'type': 'array',
                 'items': {'type': 'string'}
@@ -40,6 +40,7 @@ from gevent.backdoor import BackdoorServer
 from freenas.dispatcher.rpc import RpcService, RpcException, pass_sender, private, generator, unauthenticated
 from auth import ShellToken
 from task import TaskState, query
+from tasklog import stream_output
 from freenas.utils import first_or_default
 from freenas.utils.trace_logger import TRACE
 
@@ -58,6 +59,9 @@ class ManagementService(RpcService):
     def ping(self):
         return 'pong'
 
+    def get_datastore_cache_stats(self):
+        return self.dispatcher.datastore.collection_cache_stats()
+
     def reload_plugins(self):
         self.dispatcher.reload_plugins()
 
@@ -442,6 +446,20 @@ class TaskService(RpcService):
 
         return result
 
+    def get_pool_status(self):
+        return self.__balancer.get_pool_status()
+
+    def get_validation_stats(self):
+        return self.__balancer.get_validation_stats()
+
+    @generator
+    def output(self, id, offset=0, follow=False):
+        task = self.__balancer.get_task(id)
+        try:
+            yield from stream_output(id, task.output if task else None, offset, follow)
+        except OSError as err:
+            raise RpcException(err.errno, err.strerror)
+
     @private
     def register_task_hook(self, hook, task, condition=None):
         self.__dispatcher.register_task_hook(hook, task, condition)
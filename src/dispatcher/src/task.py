@@ -285,6 +285,11 @@ def metadata(**d):
     return wrapped
 
 
+def shared_result(fn):
+    fn.shared_result = True
+    return fn
+
+
 def query(result_type):
     def wrapped(fn):
         fn.params_schema = [
@@ -0,0 +1,211 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+import os
+import time
+import errno
+import codecs
+import collections
+from gevent.event import Event
+
+
+TASK_OUTPUT_DIR = '/var/tmp/dispatcher/tasks'
+TASK_OUTPUT_MAX_SIZE = 64 * 1024 * 1024
+TASK_OUTPUT_RETENTION = 7 * 24 * 60 * 60
+RING_SIZE = 64 * 1024
+TAIL_SIZE = 4096
+CHUNK_SIZE = 16384
+
+
+def output_path(task_id):
+    return os.path.join(TASK_OUTPUT_DIR, '{0}.log'.format(task_id))
+
+
+def purge_output_logs(max_age=TASK_OUTPUT_RETENTION):
+    try:
+        names = os.listdir(TASK_OUTPUT_DIR)
+    except FileNotFoundError:
+        return
+
+    cutoff = time.time() - max_age
+    for i in names:
+        path = os.path.join(TASK_OUTPUT_DIR, i)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+class TaskOutputLog(object):
+    """
+    Executor output of a single task. Everything goes to an append-only
+    file capped at TASK_OUTPUT_MAX_SIZE, the most recent RING_SIZE bytes
+    are also kept in memory to serve tails and followers without disk reads.
+    Offsets are byte offsets into the complete output.
+    """
+    def __init__(self, task_id, max_size=TASK_OUTPUT_MAX_SIZE):
+        self.task_id = task_id
+        self.max_size = max_size
+        self.size = 0
+        self.dropped = 0
+        self.ring = collections.deque()
+        self.ring_size = 0
+        self.closed = False
+        self.changed = Event()
+        self.fd = None
+
+        try:
+            os.makedirs(TASK_OUTPUT_DIR, exist_ok=True)
+            self.fd = os.open(output_path(task_id), os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o600)
+        except OSError:
+            # Keep at least the in-memory part
+            pass
+
+    @property
+    def ring_offset(self):
+        return self.size - self.ring_size
+
+    def append(self, data):
+        if self.closed:
+            return
+
+        data = data.encode('utf-8', 'replace')
+        if self.size + len(data) > self.max_size:
+            self.dropped += len(data)
+            return
+
+        if self.fd is not None:
+            try:
+                os.write(self.fd, data)
+            except OSError:
+                os.close(self.fd)
+                self.fd = None
+
+        self.ring.append(data)
+        self.ring_size += len(data)
+        self.size += len(data)
+        while self.ring_size - len(self.ring[0]) >= RING_SIZE:
+            self.ring_size -= len(self.ring.popleft())
+
+        self.notify()
+
+    def tail(self, length=TAIL_SIZE):
+        data = b''.join(self.ring)[-length:]
+        return data.decode('utf-8', 'replace')
+
+    def read(self, offset, length=CHUNK_SIZE):
+        if offset >= self.size:
+            return b''
+
+        if offset >= self.ring_offset:
+            data = b''.join(self.ring)
+            start = offset - self.ring_offset
+            return data[start:start + length]
+
+        return read_file(self.task_id, offset, min(length, self.ring_offset - offset))
+
+    def wait(self, offset, timeout=None):
+        changed = self.changed
+        if self.size > offset or self.closed:
+            return
+
+        changed.wait(timeout)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+        self.notify()
+
+    def notify(self):
+        # Waiters hold on to the old event, which stays set
+        changed, self.changed = self.changed, Event()
+        changed.set()
+
+    def __getstate__(self):
+        return {
+            'size': self.size,
+            'dropped': self.dropped,
+            'tail': self.tail()
+        }
+
+
+def read_file(task_id, offset, length=CHUNK_SIZE):
+    try:
+        fd = os.open(output_path(task_id), os.O_RDONLY)
+    except FileNotFoundError:
+        return b''
+
+    try:
+        return os.pread(fd, length, offset)
+    finally:
+        os.close(fd)
+
+
+def stream_output(task_id, log=None, offset=0, follow=False):
+    """
+    Yields {'offset': N, 'data': str} chunks starting at byte offset.
+    With a live log and follow=True it keeps waiting for more output until
+    the log is closed. Multi-byte characters split across chunks are decoded
+    correctly; the offsets of chunks always refer to raw bytes.
+    """
+    if log is None and not os.path.exists(output_path(task_id)):
+        raise OSError(errno.ENOENT, 'No output stored for task {0}'.format(task_id))
+
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    while True:
+        data = log.read(offset) if log else read_file(task_id, offset)
+        if data:
+            text = decoder.decode(data)
+            if text:
+                yield {'offset': offset, 'data': text}
+
+            offset += len(data)
+            continue
+
+        if log and offset < log.ring_offset:
+            # Log file could not be written or was purged, continue with
+            # what is still in memory
+            decoder.reset()
+            offset = log.ring_offset
+            continue
+
+        if not log or not follow or log.closed:
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield {'offset': offset, 'data': text}
+
+            return
+
+        log.wait(offset)
@@ -198,12 +198,16 @@ class Context(object):
 
             instance.join_subtasks(instance.run_subtask(hook, *task['args'], **extra_env))
 
-    def main(self):
-        if len(sys.argv) != 2:
-            print("Invalid number of arguments", file=sys.stderr)
-            sys.exit(errno.EINVAL)
+    def load_module(self, filename):
+        module = self.module_cache.get(filename)
+        if not module:
+            name, _ = os.path.splitext(os.path.basename(filename))
+            module = load_module_from_file(name, filename)
+            self.module_cache[filename] = module
 
-        key = sys.argv[1]
+        return module
+
+    def main(self, key):
         configure_logging(None, logging.DEBUG)
 
         self.datastore = get_datastore()
@@ -231,12 +235,7 @@ class Context(object):
                     host, port = task['debugger']
                     pydevd.settrace(host, port=port, stdoutToServer=True, stderrToServer=True)
 
-                name, _ = os.path.splitext(os.path.basename(task['filename']))
-                module = self.module_cache.get(task['filename'])
-                if not module:
-                    module = load_module_from_file(name, task['filename'])
-                    self.module_cache[task['filename']] = module
-
+                module = self.load_module(task['filename'])
                 setproctitle('task executor (tid {0})'.format(task['id']))
                 fds = list(self.collect_fds(task['args']))
 
@@ -288,6 +287,27 @@ class Context(object):
             setproctitle('task executor (idle)')
 
 
-if __name__ == '__main__':
+def run(argv, module_cache=None):
     ctx = Context()
-    ctx.main()
+    ctx.module_cache.update(module_cache or {})
+
+    if argv[0] == '--probe':
+        # Used by benchmarks: stop once the task module is ready to run
+        ctx.load_module(argv[1])
+        return
+
+    ctx.main(argv[0])
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Invalid number of arguments", file=sys.stderr)
+        sys.exit(errno.EINVAL)
+
+    if sys.argv[1] == '--zygote':
+        from zygote import Zygote
+        configure_logging(None, logging.DEBUG)
+        setproctitle('task executor zygote')
+        Zygote(sys.argv[2], sys.argv[3:], run).serve()
+    else:
+        run(sys.argv[1:])
@@ -0,0 +1,195 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import sys
+import json
+import array
+import errno
+import fnmatch
+import signal
+import socket
+import logging
+import selectors
+import traceback
+from freenas.utils import load_module_from_file
+
+
+MAX_FDS = 4
+
+
+def returncode(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+def recv_request(conn):
+    fds = array.array('i')
+    msg, ancdata, flags, addr = conn.recvmsg(4096, socket.CMSG_LEN(MAX_FDS * fds.itemsize))
+    for level, type, data in ancdata:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+
+    return json.loads(msg.decode('utf-8')), list(fds)
+
+
+class Zygote(object):
+    """
+    Fork server for task executors. Common libraries and plugin modules are
+    imported once here; every worker is then a fork() of this process.
+
+    Protocol, one unix socket connection per worker: the client sends a JSON
+    request {"argv": [...]} with the worker's stdout/stderr fd attached as
+    SCM_RIGHTS, zygote answers {"pid": N}, and later {"returncode": N} once
+    the worker exited, then closes the connection.
+    """
+    def __init__(self, path, plugin_dirs, entry):
+        self.path = path
+        self.plugin_dirs = plugin_dirs
+        self.entry = entry
+        self.module_cache = {}
+        self.children = {}
+        self.selector = selectors.DefaultSelector()
+        self.listener = None
+        self.wakeup_r, self.wakeup_w = os.pipe()
+
+    def preload(self):
+        for dir in self.plugin_dirs:
+            for root, _, filenames in os.walk(dir):
+                if os.path.basename(root) == 'disabled':
+                    continue
+
+                for i in fnmatch.filter(filenames, '*.py') + fnmatch.filter(filenames, '*.so'):
+                    path = os.path.join(root, i)
+                    name, _ = os.path.splitext(i)
+                    try:
+                        self.module_cache[path] = load_module_from_file(name, path)
+                    except BaseException as err:
+                        logging.debug('Cannot preload {0}: {1}'.format(path, str(err)))
+
+        logging.info('Preloaded {0} modules'.format(len(self.module_cache)))
+
+    def serve(self):
+        self.preload()
+
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.listener.listen(64)
+
+        os.set_blocking(self.wakeup_w, False)
+        signal.set_wakeup_fd(self.wakeup_w)
+        signal.signal(signal.SIGCHLD, lambda signo, frame: None)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ)
+
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.listener:
+                    conn, _ = self.listener.accept()
+                    self.handle(conn)
+                else:
+                    os.read(self.wakeup_r, 4096)
+                    self.reap()
+
+    def handle(self, conn):
+        fds = []
+        try:
+            request, fds = recv_request(conn)
+            if not fds:
+                raise ValueError('No output descriptor passed')
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                self.child(conn, fds[0], request)
+
+            conn.sendall(json.dumps({'pid': pid}).encode('utf-8') + b'\n')
+            self.children[pid] = conn
+        except (OSError, ValueError) as err:
+            logging.warning('Cannot fork worker: {0}'.format(str(err)))
+            conn.close()
+        finally:
+            for i in fds:
+                os.close(i)
+
+    def child(self, conn, fd, request):
+        code = 0
+        try:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+            self.selector.close()
+            self.listener.close()
+            os.close(self.wakeup_r)
+            os.close(self.wakeup_w)
+            for i in self.children.values():
+                i.close()
+
+            conn.close()
+            os.dup2(fd, sys.stdout.fileno())
+            os.dup2(fd, sys.stderr.fileno())
+            os.close(fd)
+            os.setpgrp()
+            self.entry(request['argv'], self.module_cache)
+        except SystemExit as err:
+            code = err.code if isinstance(err.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+            code = errno.EFAULT
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+
+            if pid == 0:
+                return
+
+            conn = self.children.pop(pid, None)
+            if not conn:
+                continue
+
+            try:
+                conn.sendall(json.dumps({'returncode': returncode(status)}).encode('utf-8') + b'\n')
+            except OSError:
+                pass
+            finally:
+                conn.close()
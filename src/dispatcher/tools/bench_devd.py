@@ -0,0 +1,142 @@
+#!/usr/local/bin/python3
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+from xml.etree import ElementTree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from lib.framing import FramedReader
+
+
+SAMPLE_EVENTS = [
+    '<notify><system>DEVFS</system><subsystem>CDEV</subsystem><type>CREATE</type><cdev>da{0}</cdev></notify>',
+    '<notify><system>DEVFS</system><subsystem>CDEV</subsystem><type>DESTROY</type><cdev>da{0}</cdev></notify>',
+    '<notify><system>IFNET</system><subsystem>igb{0}</subsystem><type>LINK_UP</type></notify>',
+    '<notify><system>IFNET</system><subsystem>igb{0}</subsystem><type>LINK_DOWN</type></notify>',
+    '<notify><system>ZFS</system><subsystem>ZFS</subsystem><type>misc.fs.zfs.config_sync</type>'
+    '<pool_name>tank</pool_name><pool_guid>{0}</pool_guid></notify>',
+]
+
+
+def load_events(path):
+    if path:
+        with open(path, 'rb') as f:
+            return [e for e in f.read().split(b'\x00') if e.strip()]
+
+    return [e.format(i).encode('utf-8') for i in range(16) for e in SAMPLE_EVENTS]
+
+
+def feed(sock, events, count):
+    # Replay the recording in a loop until exactly count events were sent
+    payload = b'\x00'.join(events) + b'\x00'
+    full, rest = divmod(count, len(events))
+    for _ in range(full):
+        sock.sendall(payload)
+
+    if rest:
+        sock.sendall(b'\x00'.join(events[:rest]) + b'\x00')
+
+    sock.shutdown(socket.SHUT_WR)
+
+
+def read_buffered(sock):
+    reader = FramedReader(sock)
+    while True:
+        frame = reader.read_frame()
+        if frame is None:
+            return
+
+        yield frame
+
+
+def read_bytewise(sock):
+    # Former DevdEventSource.read_until_nul() behavior, for comparison
+    f = sock.makefile('rb', 0)
+    buf = bytearray()
+    while True:
+        byte = f.read(1)
+        if byte == b'':
+            return
+
+        if byte == b'\x00':
+            yield bytes(buf)
+            buf = bytearray()
+            continue
+
+        buf += byte
+
+
+def run(name, reader, events, count, parse):
+    rsock, wsock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    writer = threading.Thread(target=feed, args=(wsock, events, count), daemon=True)
+    received = 0
+    start = time.time()
+    writer.start()
+
+    for frame in reader(rsock):
+        if parse:
+            ElementTree.fromstring(frame.decode('utf-8', 'replace'))
+
+        received += 1
+
+    elapsed = time.time() - start
+    writer.join()
+    rsock.close()
+    wsock.close()
+
+    if received != count:
+        print('{0}: expected {1} events, got {2}'.format(name, count, received), file=sys.stderr)
+
+    print('{0:<12} {1:>10.2f} s {2:>12.0f} events/s'.format(name, elapsed, received / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a devd.xml event stream through a socketpair')
+    parser.add_argument('-f', metavar='FILE', help='Recorded devd.xml.pipe stream (NUL separated events)')
+    parser.add_argument('-n', metavar='COUNT', type=int, default=100000, help='Number of events to replay')
+    parser.add_argument('--no-parse', action='store_true', help='Only split frames, skip XML parsing')
+    parser.add_argument('--bytewise', action='store_true', help='Also benchmark the byte-at-a-time reader')
+    args = parser.parse_args()
+
+    events = load_events(args.f)
+    if not events:
+        print('No events found in {0}'.format(args.f), file=sys.stderr)
+        sys.exit(1)
+
+    run('buffered', read_buffered, events, args.n, not args.no_parse)
+    if args.bytewise:
+        run('bytewise', read_bytewise, events, args.n, not args.no_parse)
+
+
+if __name__ == '__main__':
+    main()
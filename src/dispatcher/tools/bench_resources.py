@@ -0,0 +1,112 @@
+#!/usr/local/bin/python3
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import sys
+import time
+import random
+import argparse
+import networkx as nx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from resources import Resource, ResourceGraph
+
+
+class LegacyResourceGraph(ResourceGraph):
+    # Lookup and busy checks as they were before the index and closure cache
+    def get_resource(self, name):
+        f = [i for i in self.resources.nodes() if i.name == name]
+        return f[0] if len(f) > 0 else None
+
+    def busy_descendants(self, res):
+        return any(i.busy for i in nx.descendants(self.resources, res))
+
+
+def build(cls, pools, datasets, fanout):
+    graph = cls()
+    names = []
+    start = time.time()
+    for p in range(pools):
+        pool = 'zpool:pool{0}'.format(p)
+        graph.add_resource(Resource(pool))
+        parents = [pool]
+        for i in range(datasets // pools):
+            # Nest datasets so that every one has up to `fanout` children
+            parent = parents[i // fanout] if i // fanout < len(parents) else pool
+            name = 'zfs:pool{0}/ds{1}'.format(p, i)
+            graph.add_resource(Resource(name), parents=[parent])
+            parents.append(name)
+            names.append(name)
+
+    return graph, names, time.time() - start
+
+
+def schedule(graph, names, passes, waiting, running):
+    # Each pass mimics Balancer.schedule_tasks(): check every waiting task,
+    # start the ones that can run, finish the oldest running ones
+    rnd = random.Random(0)
+    busy = []
+    start = time.time()
+    for _ in range(passes):
+        for name in rnd.sample(names, waiting):
+            if graph.can_acquire(name):
+                graph.acquire(name)
+                busy.append(name)
+
+        while len(busy) > running:
+            graph.release(busy.pop(0))
+
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resource graph scheduling microbenchmark')
+    parser.add_argument('-n', metavar='DATASETS', type=int, default=50000, help='Number of datasets')
+    parser.add_argument('-p', metavar='POOLS', type=int, default=2, help='Number of pools')
+    parser.add_argument('-f', metavar='FANOUT', type=int, default=8, help='Children per dataset')
+    parser.add_argument('--passes', type=int, default=100, help='Scheduling passes')
+    parser.add_argument('--waiting', type=int, default=20, help='Waiting tasks per pass')
+    parser.add_argument('--running', type=int, default=8, help='Concurrently running tasks')
+    parser.add_argument('--legacy', action='store_true', help='Also run the unindexed implementation')
+    args = parser.parse_args()
+
+    impls = [('indexed', ResourceGraph)]
+    if args.legacy:
+        impls.append(('legacy', LegacyResourceGraph))
+
+    for name, cls in impls:
+        graph, names, build_time = build(cls, args.p, args.n, args.f)
+        sched_time = schedule(graph, names, args.passes, args.waiting, args.running)
+        checks = args.passes * args.waiting
+        print('{0:<8} build {1:>8.2f} s   schedule {2:>8.2f} s   {3:>10.0f} checks/s'.format(
+            name, build_time, sched_time, checks / sched_time
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/local/bin/python3
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import os
+import sys
+import json
+import time
+import array
+import socket
+import argparse
+import subprocess
+import statistics
+
+
+SRCDIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src')
+TASKWORKER_MAIN = os.path.join(SRCDIR, 'taskworker', 'main.py')
+DEFAULT_PLUGIN = os.path.join(SRCDIR, '..', 'plugins', 'SystemInfoPlugin.py')
+
+
+def worker_command(*args):
+    return [sys.executable, '-u', TASKWORKER_MAIN] + list(args)
+
+
+def worker_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = SRCDIR
+    return env
+
+
+def spawn_probe(plugin):
+    # Current path: a fresh interpreter per executor
+    proc = subprocess.Popen(worker_command('--probe', plugin), env=worker_env())
+    return proc.wait()
+
+
+def fork_probe(path, plugin):
+    rfd, wfd = os.pipe()
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(path)
+    conn.sendmsg(
+        [json.dumps({'argv': ['--probe', plugin]}).encode('utf-8')],
+        [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [wfd]))]
+    )
+    os.close(wfd)
+    f = conn.makefile('rb')
+    json.loads(f.readline().decode('utf-8'))
+    result = json.loads(f.readline().decode('utf-8'))
+    conn.close()
+    os.close(rfd)
+    return result['returncode']
+
+
+def wait_for_socket(path, timeout=60):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() > deadline:
+            raise TimeoutError('Zygote did not start within {0} seconds'.format(timeout))
+
+        time.sleep(0.1)
+
+
+def measure(name, count, fn):
+    samples = []
+    for _ in range(count):
+        start = time.time()
+        code = fn()
+        samples.append(time.time() - start)
+        if code != 0:
+            print('{0}: worker exited with code {1}'.format(name, code), file=sys.stderr)
+            sys.exit(1)
+
+    print('{0:<8} mean {1:>8.1f} ms   median {2:>8.1f} ms   max {3:>8.1f} ms'.format(
+        name,
+        statistics.mean(samples) * 1000,
+        statistics.median(samples) * 1000,
+        max(samples) * 1000
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare taskworker time-to-first-task: spawn vs zygote fork')
+    parser.add_argument('-n', metavar='COUNT', type=int, default=20, help='Number of workers to start')
+    parser.add_argument('-p', metavar='PLUGIN', default=DEFAULT_PLUGIN, help='Plugin file holding the task')
+    parser.add_argument('-s', metavar='SOCKET', default='/tmp/bench_zygote.sock', help='Zygote socket path')
+    args = parser.parse_args()
+
+    plugin = os.path.realpath(args.p)
+    measure('spawn', args.n, lambda: spawn_probe(plugin))
+
+    if os.path.exists(args.s):
+        os.unlink(args.s)
+
+    zygote = subprocess.Popen(
+        worker_command('--zygote', args.s, os.path.dirname(plugin)),
+        env=worker_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    try:
+        wait_for_socket(args.s)
+        measure('zygote', args.n, lambda: fork_probe(args.s, plugin))
+    finally:
+        zygote.terminate()
+        zygote.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -36,10 +36,17 @@ class LocalDatabasePlugin(DirectoryServicePlugin):
             for i in ev['ids']:
                 context.users_cache.flush(i)
 
+            # A new or renamed user may have been looked up before it existed
+            if ev.get('operation') != 'delete':
+                context.users_cache.clear_negative()
+
         def flush_groups(ev):
             for i in ev['ids']:
                 context.groups_cache.flush(i)
 
+            if ev.get('operation') != 'delete':
+                context.groups_cache.clear_negative()
+
         self.context = context
         self.client = context.client
         self.datastore = context.datastore
@@ -41,6 +41,7 @@ import socket
 import netif
 from bsd import setproctitle
 from threading import RLock, Thread
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from datastore.config import ConfigStore
 from freenas.dispatcher.client import Client, ClientError
@@ -56,6 +57,9 @@ from plugin import DirectoryState
 NOGROUP_GID = 65533
 DEFAULT_CONFIGFILE = '/usr/local/etc/middleware.conf'
 DEFAULT_SOCKET_ADDRESS = 'unix:///var/run/dscached.sock'
+DEFAULT_CACHE_MAX_ENTRIES = 65536
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_NEGATIVE_CACHE_TTL = 60
 AF_MAP = {
     socket.AF_INET: ipaddress.IPv4Address,
     socket.AF_INET6: ipaddress.IPv6Address
@@ -136,6 +140,15 @@ def annotate(user, directory, name_field, cache=None):
     })
 
 
+def estimate_size(value):
+    # Approximate footprint of a cached entry; exactness is not required,
+    # only a stable measure to keep the cache within its byte budget
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
 class CacheItem(object):
     def __init__(self, id, uuid, names, value, directory, ttl):
         self.id = id
@@ -147,6 +160,7 @@ class CacheItem(object):
         self.created_at = datetime.utcnow()
         self.lock = RLock()
         self.destroyed = False
+        self.size = estimate_size(value)
 
     @property
     def expired(self):
@@ -166,76 +180,198 @@ class CacheItem(object):
 
 
 class TTLCacheStore(object):
-    def __init__(self):
+    def __init__(self, max_entries=None, max_bytes=None, negative_ttl=DEFAULT_NEGATIVE_CACHE_TTL):
+        self.lock = RLock()
         self.id_store = {}
         self.name_store = {}
-        self.uuid_store = {}
+        self.uuid_store = OrderedDict()
+        self.negative_store = {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.bytes = 0
         self.hits = 0
         self.misses = 0
+        self.evictions = 0
+        self.negative_hits = 0
+        self.directory_stats = {}
 
     def __len__(self):
-        return len(self.id_store)
+        return len(self.uuid_store)
 
     def __getstate__(self):
-        return {
-            'size': len(self),
-            'hits': self.hits,
-            'misses': self.misses
-        }
+        with self.lock:
+            return {
+                'size': len(self),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'negative_size': len(self.negative_store),
+                'negative_hits': self.negative_hits,
+                'directories': copy.deepcopy(self.directory_stats)
+            }
+
+    def configure(self, max_entries=None, max_bytes=None, negative_ttl=None):
+        with self.lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            if negative_ttl is not None:
+                self.negative_ttl = negative_ttl
+
+            self.evict()
 
     def get(self, id=None, uuid=None, name=None):
-        if id is not None:
-            item = self.id_store.get(id)
-        elif uuid is not None:
-            item = self.uuid_store.get(uuid.lower())
-        elif name is not None:
-            item = self.name_store.get(name)
-        else:
-            raise AssertionError('Either id=, uuid= or name= parameter must be filled')
+        with self.lock:
+            if id is not None:
+                item = self.id_store.get(id)
+            elif uuid is not None:
+                item = self.uuid_store.get(uuid.lower())
+            elif name is not None:
+                item = self.name_store.get(name)
+            else:
+                raise AssertionError('Either id=, uuid= or name= parameter must be filled')
+
+            if item:
+                if item.expired:
+                    self.flush(item.uuid)
+                    self.misses += 1
+                    return
 
-        if item:
-            if item.expired:
-                self.flush(item.uuid)
-                self.misses += 1
-                return
+                self.uuid_store.move_to_end(item.uuid)
+                self.hits += 1
+                self.account(item.directory, 'hits')
+                return item
 
-            self.hits += 1
-            return item
+            self.misses += 1
+            return
 
-        self.misses += 1
-        return
+    def get_negative(self, id=None, uuid=None, name=None):
+        key = self.negative_key(id, uuid, name)
+        with self.lock:
+            expires_at = self.negative_store.get(key)
+            if expires_at is None:
+                return False
+
+            if expires_at < time.monotonic():
+                del self.negative_store[key]
+                return False
+
+            self.negative_hits += 1
+            return True
+
+    def set_negative(self, id=None, uuid=None, name=None):
+        if not self.negative_ttl:
+            return
+
+        key = self.negative_key(id, uuid, name)
+        with self.lock:
+            self.negative_store[key] = time.monotonic() + self.negative_ttl
 
     def flush(self, uuid):
-        item = self.uuid_store.get(uuid)
-        if item:
-            with item.lock:
-                if item.destroyed:
-                    return
+        with self.lock:
+            item = self.uuid_store.get(uuid)
+            if item:
+                with item.lock:
+                    if item.destroyed:
+                        return
 
-                for i in item.names:
-                    del self.name_store[i]
-                del self.uuid_store[item.uuid]
-                del self.id_store[item.id]
+                    for i in item.names:
+                        if self.name_store.get(i) is item:
+                            del self.name_store[i]
+
+                    if self.id_store.get(item.id) is item:
+                        del self.id_store[item.id]
+
+                    del self.uuid_store[item.uuid]
+                    self.bytes -= item.size
+                    item.destroyed = True
 
     def query(self, filter=None, params=None):
         return query(self.id_store, *(filter or []), **(params or {}))
 
     def set(self, item):
-        with item.lock:
-            self.id_store[item.id] = item
-            self.uuid_store[item.uuid] = item
+        with self.lock:
+            # Replace the previous copy of the same object, if any
+            self.flush(item.uuid)
+            with item.lock:
+                self.id_store[item.id] = item
+                self.uuid_store[item.uuid] = item
+                for i in item.names:
+                    self.name_store[i] = item
+
+                self.bytes += item.size
+
+            self.negative_store.pop(('id', item.id), None)
+            self.negative_store.pop(('uuid', item.uuid), None)
             for i in item.names:
-                self.name_store[i] = item
+                self.negative_store.pop(('name', i), None)
 
-    def expire(self):
-        for uuid, item in self.uuid_store.items():
-            if item.expired:
+            self.account(item.directory, 'misses')
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            while self.uuid_store and self.over_limit:
+                uuid, item = next(iter(self.uuid_store.items()))
                 self.flush(uuid)
+                self.evictions += 1
+                self.account(item.directory, 'evictions')
+
+    def expire(self):
+        with self.lock:
+            for uuid, item in list(self.uuid_store.items()):
+                if item.expired:
+                    self.flush(uuid)
+
+            now = time.monotonic()
+            for key, expires_at in list(self.negative_store.items()):
+                if expires_at < now:
+                    del self.negative_store[key]
 
     def clear(self):
-        self.name_store.clear()
-        self.uuid_store.clear()
-        self.id_store.clear()
+        with self.lock:
+            for item in self.uuid_store.values():
+                item.destroyed = True
+
+            self.name_store.clear()
+            self.uuid_store.clear()
+            self.id_store.clear()
+            self.negative_store.clear()
+            self.bytes = 0
+
+    def clear_negative(self):
+        with self.lock:
+            self.negative_store.clear()
+
+    @property
+    def over_limit(self):
+        if self.max_entries and len(self.uuid_store) > self.max_entries:
+            return True
+
+        if self.max_bytes and self.bytes > self.max_bytes:
+            return True
+
+        return False
+
+    def account(self, directory, counter):
+        stats = self.directory_stats.setdefault(directory.name, {'hits': 0, 'misses': 0, 'evictions': 0})
+        stats[counter] += 1
+
+    @staticmethod
+    def negative_key(id, uuid, name):
+        if id is not None:
+            return 'id', id
+
+        if uuid is not None:
+            return 'uuid', uuid.lower()
+
+        if name is not None:
+            return 'name', name
+
+        raise AssertionError('Either id=, uuid= or name= parameter must be filled')
 
 
 class Directory(object):
@@ -355,6 +491,10 @@ class ManagementService(RpcService):
         for i in self.context.users_cache, self.context.groups_cache, self.context.hosts_cache:
             i.clear()
 
+    def flush_negative_cache(self):
+        for i in self.context.users_cache, self.context.groups_cache, self.context.hosts_cache:
+            i.clear_negative()
+
     def populate_caches(self):
         self.context.populate_caches()
 
@@ -397,6 +537,7 @@ class ManagementService(RpcService):
         directory.enabled = ds_d['enabled']
         directory.parameters = ds_d['parameters']
         directory.configure()
+        self.flush_negative_cache()
 
     def get_status(self, id):
         directory = first_or_default(lambda d: d.id == id, self.context.directories)
@@ -463,6 +604,10 @@ class AccountService(RpcService):
 
             return fix_passwords(item.annotated)
 
+        if self.context.users_cache.get_negative(id=uid):
+            raise RpcException(errno.ENOENT, 'UID {0} not found'.format(uid))
+
+        incomplete = False
         dirs = self.context.get_active_directories()
 
         for d in dirs:
@@ -472,6 +617,7 @@ class AccountService(RpcService):
             try:
                 user = d.instance.getpwuid(uid)
             except:
+                incomplete = True
                 continue
 
             if user:
@@ -481,6 +627,9 @@ class AccountService(RpcService):
                 self.context.users_cache.set(item)
                 return fix_passwords(item.annotated)
 
+        if not skip_ad and not incomplete:
+            self.context.users_cache.set_negative(id=uid)
+
         raise RpcException(errno.ENOENT, 'UID {0} not found'.format(uid))
 
     @accepts(str, bool)
@@ -493,6 +642,11 @@ class AccountService(RpcService):
 
             return fix_passwords(item.annotated)
 
+        if self.context.users_cache.get_negative(name=user_name):
+            raise RpcException(errno.ENOENT, 'User {0} not found'.format(user_name))
+
+        incomplete = False
+        lookup_name = user_name
         if '@' in user_name:
             # Fully qualified user name
             user_name, domain_name = user_name.split('@', 1)
@@ -507,6 +661,7 @@ class AccountService(RpcService):
             try:
                 user = d.instance.getpwnam(user_name)
             except:
+                incomplete = True
                 continue
 
             if user:
@@ -516,6 +671,9 @@ class AccountService(RpcService):
                 self.context.users_cache.set(item)
                 return fix_passwords(item.annotated)
 
+        if not skip_ad and not incomplete:
+            self.context.users_cache.set_negative(name=lookup_name)
+
         raise RpcException(errno.ENOENT, 'User {0} not found'.format(user_name))
 
     @accepts(str, bool)
@@ -528,6 +686,10 @@ class AccountService(RpcService):
 
             return fix_passwords(item.annotated)
 
+        if self.context.users_cache.get_negative(uuid=uuid):
+            raise RpcException(errno.ENOENT, 'UUID {0} not found'.format(uuid))
+
+        incomplete = False
         for d in self.context.get_active_directories():
             if skip_ad and d.plugin_type == 'winbind':
                 continue
@@ -535,6 +697,7 @@ class AccountService(RpcService):
             try:
                 user = d.instance.getpwuuid(uuid)
             except:
+                incomplete = True
                 continue
 
             if user:
@@ -544,6 +707,9 @@ class AccountService(RpcService):
                 self.context.users_cache.set(item)
                 return fix_passwords(item.annotated)
 
+        if not skip_ad and not incomplete:
+            self.context.users_cache.set_negative(uuid=uuid)
+
         raise RpcException(errno.ENOENT, 'UUID {0} not found'.format(uuid))
 
     @accepts(str, bool)
@@ -647,6 +813,11 @@ class GroupService(RpcService):
 
             return item.annotated
 
+        if self.context.groups_cache.get_negative(name=name):
+            raise RpcException(errno.ENOENT, 'Group {0} not found'.format(name))
+
+        incomplete = False
+        lookup_name = name
         if '@' in name:
             # Fully qualified group name
             name, domain_name = name.split('@', 1)
@@ -661,6 +832,7 @@ class GroupService(RpcService):
             try:
                 group = d.instance.getgrnam(name)
             except:
+                incomplete = True
                 continue
 
             if group:
@@ -669,6 +841,9 @@ class GroupService(RpcService):
                 self.context.groups_cache.set(item)
                 return item.annotated
 
+        if not skip_ad and not incomplete:
+            self.context.groups_cache.set_negative(name=lookup_name)
+
         raise RpcException(errno.ENOENT, 'Group {0} not found'.format(name))
 
     @accepts(int, bool)
@@ -681,6 +856,10 @@ class GroupService(RpcService):
 
             return item.annotated
 
+        if self.context.groups_cache.get_negative(id=gid):
+            raise RpcException(errno.ENOENT, 'GID {0} not found'.format(gid))
+
+        incomplete = False
         dirs = self.context.get_active_directories()
 
         for d in dirs:
@@ -690,6 +869,7 @@ class GroupService(RpcService):
             try:
                 group = d.instance.getgrgid(gid)
             except:
+                incomplete = True
                 continue
 
             if group:
@@ -698,6 +878,9 @@ class GroupService(RpcService):
                 self.context.groups_cache.set(item)
                 return item.annotated
 
+        if not skip_ad and not incomplete:
+            self.context.groups_cache.set_negative(id=gid)
+
         raise RpcException(errno.ENOENT, 'GID {0} not found'.format(gid))
 
     @accepts(str, bool)
@@ -710,6 +893,10 @@ class GroupService(RpcService):
 
             return item.annotated
 
+        if self.context.groups_cache.get_negative(uuid=uuid):
+            raise RpcException(errno.ENOENT, 'UUID {0} not found'.format(uuid))
+
+        incomplete = False
         for d in self.context.get_active_directories():
             if skip_ad and d.plugin_type == 'winbind':
                 continue
@@ -717,6 +904,7 @@ class GroupService(RpcService):
             try:
                 group = d.instance.getgruuid(uuid)
             except:
+                incomplete = True
                 continue
 
             if group:
@@ -725,6 +913,9 @@ class GroupService(RpcService):
                 self.context.groups_cache.set(item)
                 return item.annotated
 
+        if not skip_ad and not incomplete:
+            self.context.groups_cache.set_negative(uuid=uuid)
+
         raise RpcException(errno.ENOENT, 'UUID {0} not found'.format(uuid))
 
 
@@ -795,13 +986,16 @@ class Main(object):
         self.plugin_dirs = []
         self.plugins = {}
         self.directories = []
-        self.users_cache = TTLCacheStore()
-        self.groups_cache = TTLCacheStore()
-        self.hosts_cache = TTLCacheStore()
+        self.users_cache = TTLCacheStore(DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_MAX_BYTES)
+        self.groups_cache = TTLCacheStore(DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_MAX_BYTES)
+        self.hosts_cache = TTLCacheStore(DEFAULT_CACHE_MAX_ENTRIES, DEFAULT_CACHE_MAX_BYTES)
         self.cache_ttl = 7200
         self.search_order = []
         self.cache_enumerations = True
         self.cache_lookups = True
+        self.cache_max_entries = DEFAULT_CACHE_MAX_ENTRIES
+        self.cache_max_bytes = DEFAULT_CACHE_MAX_BYTES
+        self.negative_cache_ttl = DEFAULT_NEGATIVE_CACHE_TTL
         self.account_service = AccountService(self)
         self.group_service = GroupService(self)
         self.rpc.register_service_instance('dscached.account', self.account_service)
@@ -955,6 +1149,11 @@ class Main(object):
         self.cache_ttl = self.configstore.get('directory.cache_ttl')
         self.cache_enumerations = self.configstore.get('directory.cache_enumerations')
         self.cache_lookups = self.configstore.get('directory.cache_lookups')
+        self.cache_max_entries = self.configstore.get('directory.cache_max_entries', DEFAULT_CACHE_MAX_ENTRIES)
+        self.cache_max_bytes = self.configstore.get('directory.cache_max_bytes', DEFAULT_CACHE_MAX_BYTES)
+        self.negative_cache_ttl = self.configstore.get('directory.negative_cache_ttl', DEFAULT_NEGATIVE_CACHE_TTL)
+        for i in self.users_cache, self.groups_cache, self.hosts_cache:
+            i.configure(self.cache_max_entries, self.cache_max_bytes, self.negative_cache_ttl)
 
     def checkin(self):
         checkin()
@@ -0,0 +1,119 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import re
+import numpy as np
+
+
+class UnitTable(object):
+    """
+    Local copy of the unit normalization rules of the stat plugin
+    (stat.get_units), so that values can be normalized without asking
+    the dispatcher. Lookups are cached per data source name.
+    """
+    def __init__(self):
+        self.units = []
+        self.cache = {}
+        self.loaded = False
+
+    def load(self, units):
+        self.units = [
+            (name, re.compile(u['pattern']), u.get('divisor', 1), u.get('offset', 0), u.get('invalid', []))
+            for name, u in units.items()
+        ]
+        self.cache.clear()
+        self.loaded = True
+
+    def lookup(self, name):
+        ret = self.cache.get(name)
+        if ret is None:
+            ret = next((u for u in self.units if u[1].match(name)), ('', None, 1, 0, []))
+            self.cache[name] = ret
+
+        return ret
+
+    def normalize(self, name, value):
+        unit, _, divisor, offset, invalid = self.lookup(name)
+        if value is None or value in invalid:
+            return unit, None if invalid else value
+
+        if divisor == 1 and offset == 0:
+            return unit, value
+
+        return unit, (value + offset) / divisor
+
+
+class ThresholdEvaluator(object):
+    """
+    Evaluates alert thresholds of a data source. An alert fires when a
+    value leaves the permitted range while the value before it was still
+    inside of it, so nothing is reported while a value stays out of range.
+    """
+    def __init__(self, alerts):
+        self.alerts = alerts
+
+    def in_range(self, values):
+        result = np.ones(len(values), dtype=bool)
+        if self.alerts['alert_low_enabled']:
+            result &= ~(values < self.alerts['alert_low'])
+
+        if self.alerts['alert_high_enabled']:
+            result &= ~(values > self.alerts['alert_high'])
+
+        return result
+
+    def crossings(self, last, values):
+        """
+        Returns the first value crossing the high and the low threshold
+        (or None) within values, last being the value preceding them.
+        """
+        previous = np.concatenate(([np.nan if last is None else last], values[:-1]))
+        armed = self.in_range(previous)
+        high = low = None
+
+        if self.alerts['alert_high_enabled']:
+            crossed = np.flatnonzero(armed & (values > self.alerts['alert_high']))
+            if len(crossed):
+                high = float(values[crossed[0]])
+
+        if self.alerts['alert_low_enabled']:
+            crossed = np.flatnonzero(armed & (values < self.alerts['alert_low']))
+            if len(crossed):
+                low = float(values[crossed[0]])
+
+        return high, low
+
+    def current(self, value):
+        """
+        Returns which threshold a single value currently violates.
+        """
+        if value is None:
+            return None, None
+
+        high = value if self.alerts['alert_high_enabled'] and value > self.alerts['alert_high'] else None
+        low = value if self.alerts['alert_low_enabled'] and value < self.alerts['alert_low'] else None
+        return high, low
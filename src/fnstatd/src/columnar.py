@@ -0,0 +1,75 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import base64
+import numpy as np
+
+
+DEFAULT_CHUNK_SIZE = 65536
+WIRE_DTYPE = '<f8'
+
+
+def pack(array):
+    return base64.b64encode(np.ascontiguousarray(array, dtype=WIRE_DTYPE).tobytes()).decode('ascii')
+
+
+def unpack(data):
+    return np.frombuffer(base64.b64decode(data), dtype=WIRE_DTYPE)
+
+
+def series_arrays(series):
+    # Returns (nanoseconds since the epoch, values) of a query result
+    index = np.asarray(series.index, dtype='datetime64[ns]').view(np.int64)
+    return index, np.asarray(series.values, dtype=np.float64).ravel()
+
+
+def columnar_chunks(names, results, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Aligns query results of several data sources on a common time axis and
+    yields them in chunks of at most chunk_size rows. Timestamps (seconds
+    since the epoch) and the values of every column are packed as base64
+    encoded little-endian doubles, missing values are NaN.
+    """
+    arrays = [series_arrays(s) for s in results]
+    index = np.unique(np.concatenate([i for i, _ in arrays])) if arrays else np.empty(0, dtype=np.int64)
+    columns = []
+
+    for idx, values in arrays:
+        column = np.full(len(index), np.nan)
+        column[np.searchsorted(index, idx)] = values
+        columns.append(column)
+
+    timestamps = index / 1e9
+    for offset in range(0, max(len(index), 1), chunk_size):
+        end = offset + chunk_size
+        yield {
+            'columns': names,
+            'offset': offset,
+            'count': len(timestamps[offset:end]),
+            'timestamps': pack(timestamps[offset:end]),
+            'values': [pack(c[offset:end]) for c in columns]
+        }
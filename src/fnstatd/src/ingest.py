@@ -0,0 +1,108 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import logging
+import numpy as np
+
+
+CHUNK_SIZE = 256 * 1024
+logger = logging.getLogger('ingest')
+
+
+def parse_lines(lines):
+    # Slow path, used only when a buffer contains malformed lines
+    names = []
+    points = []
+    for line in lines:
+        try:
+            name, value, timestamp = line.split()
+            points.append((float(timestamp), float(value)))
+            names.append(name)
+        except ValueError:
+            if line.strip():
+                logger.warning('Malformed line: {0!r}'.format(line))
+
+    if not points:
+        return [], np.empty(0), np.empty(0)
+
+    timestamps, values = zip(*points)
+    return names, np.array(timestamps), np.array(values)
+
+
+def parse_buffer(data):
+    """
+    Parses complete lines of Graphite plaintext protocol found in data.
+
+    Returns a (names, timestamps, values, remainder) tuple, where names
+    is a list of data source names (bytes), timestamps and values are
+    float arrays and remainder is the trailing incomplete line.
+    """
+    end = data.rfind(b'\n')
+    if end == -1:
+        return [], np.empty(0), np.empty(0), data
+
+    remainder = data[end + 1:]
+    data = data[:end + 1]
+    lines = data.count(b'\n')
+
+    # Mark line ends so that every well-formed line yields exactly four tokens
+    tokens = data.replace(b'\n', b' \0 ').split()
+    if len(tokens) == 4 * lines and tokens[3::4].count(b'\0') == lines:
+        try:
+            return (
+                tokens[0::4],
+                np.array(tokens[2::4]).astype(np.float64),
+                np.array(tokens[1::4]).astype(np.float64),
+                remainder
+            )
+        except ValueError:
+            pass
+
+    names, timestamps, values = parse_lines(data.splitlines())
+    return names, timestamps, values, remainder
+
+
+def group_points(names, timestamps, values):
+    """
+    Groups points by data source name. Yields (name, timestamps, values)
+    for every distinct name, keeping the arrival order of points within
+    each group.
+    """
+    if not names:
+        return
+
+    keys, inverse = np.unique(np.array(names), return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(keys)))
+    timestamps = timestamps[order]
+    values = values[order]
+
+    start = 0
+    for key, end in zip(keys, bounds):
+        yield key.decode('utf-8', 'replace'), timestamps[start:end], values[start:end]
+        start = end
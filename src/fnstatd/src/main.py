@@ -37,7 +37,6 @@ import argparse
 import logging
 import dateutil.parser
 import dateutil.tz
-import tables
 import signal
 import time
 import numpy as np
@@ -51,7 +50,12 @@ from gevent.server import StreamServer
 from freenas.dispatcher.client import Client, ClientError
 from freenas.dispatcher.rpc import RpcService, RpcException, accepts, returns, generator
 from datastore import DatastoreException, get_datastore
-from ringbuffer import MemoryRingBuffer, PersistentRingBuffer
+from ringbuffer import MemoryRingBuffer
+from storage import BACKENDS
+from ingest import CHUNK_SIZE, parse_buffer, group_points
+from rollup import AGGREGATES, RollupEngine
+from columnar import DEFAULT_CHUNK_SIZE, columnar_chunks
+from alerts import UnitTable, ThresholdEvaluator
 from freenas.utils.debug import DebugService
 from freenas.utils import configure_logging, to_timedelta, materialized_paths_to_tree
 from freenas.serviced import checkin
@@ -59,11 +63,21 @@ from freenas.serviced import checkin
 
 DEFAULT_CONFIGFILE = '/usr/local/etc/middleware.conf'
 DEFAULT_DBFILE = 'stats.hdf'
+DEFAULT_RINGDIR = 'rings'
+DEFAULT_STORAGE = 'hdf5'
+DEFAULT_FLUSH_INTERVAL = 60
+DEFAULT_FLUSH_BATCH = 32
+RESAMPLERS = {
+    'avg': 'mean',
+    'min': 'min',
+    'max': 'max',
+    'last': 'last'
+}
 threadpool = gevent.threadpool.ThreadPool(5)
 
 
-def round_timestamp(timestamp, frequency):
-    return int(frequency * round(float(timestamp) / frequency))
+def to_epoch(t):
+    return int((t - datetime(1970, 1, 1)).total_seconds())
 
 
 def parse_datetime(s):
@@ -102,10 +116,15 @@ class DataSourceConfig(object):
         self.ds_schema = datastore.get_by_id('statd.schemas', self.ds_obj['schema'])
         self.buckets = [DataSourceBucket(idx, i) for idx, i in enumerate(self.ds_schema['buckets'])]
         self.primary_bucket = self.buckets[0]
-        self.logger.debug('Created {0} using schema {1}, {2} buckets'.format(
+        self.rollups = [
+            (to_timedelta(i['interval']).total_seconds(), to_timedelta(i['retention']).total_seconds())
+            for i in self.ds_schema.get('rollups', [])
+        ]
+        self.logger.debug('Created {0} using schema {1}, {2} buckets, {3} rollup tiers'.format(
             name,
             self.ds_obj['schema'],
-            len(self.buckets))
+            len(self.buckets),
+            len(self.rollups))
         )
 
     @property
@@ -132,73 +151,122 @@ class DataSource(object):
         self.bucket_buffers = self.create_buckets()
         self.primary_buffer = self.bucket_buffers[0]
         self.primary_interval = self.config.buckets[0].interval
+        self.rollups = RollupEngine(self.config.rollups)
+        self.evaluator = ThresholdEvaluator(alert_config)
+        self.accumulators = {b.index: [0.0, 0] for b in self.config.buckets[1:]}
         self.last_value = 0
         self.events_enabled = False
-        self.alerts = alert_config
+
+    @property
+    def alerts(self):
+        return self.evaluator.alerts
+
+    @alerts.setter
+    def alerts(self, value):
+        self.evaluator.alerts = value
 
     def create_buckets(self):
         # Primary bucket should be hold in memory
         buckets = [MemoryRingBuffer(self.config.buckets[0].intervals_count)]
 
-        # And others saved to HDF5 file
+        # And others saved by the storage backend
         for idx, b in enumerate(self.config.buckets[1:]):
-            table = self.context.request_table('{0}#b{1}'.format(self.name, idx))
-            buckets.append(PersistentRingBuffer(table, b.intervals_count))
+            buckets.append(self.context.storage.open_buffer(
+                '{0}#b{1}'.format(self.name, idx),
+                b.intervals_count,
+                self.context.flush_batch
+            ))
 
         self.logger.debug('Created {0} buckets'.format(len(buckets)))
         return buckets
 
     def submit(self, timestamp, value):
-        timestamp = round_timestamp(timestamp, self.config.primary_interval.total_seconds())
-        change = None
-        self.primary_buffer.push(timestamp, value)
+        self.submit_many(np.array([timestamp], dtype=np.float64), np.array([value], dtype=np.float64))
 
+    def submit_many(self, timestamps, values):
+        interval = self.config.primary_interval.total_seconds()
+        timestamps = (np.round(timestamps / interval) * interval).astype(np.int64)
+
+        # Secondary buckets consolidate the points received since their previous
+        # interval boundary, so push and accumulate up to each boundary
+        persists = []
         for b in self.config.buckets[1:]:
-            if timestamp % b.interval.total_seconds() == 0:
-                self.persist(timestamp, self.bucket_buffers[b.index], b)
+            for idx in np.flatnonzero(timestamps % int(b.interval.total_seconds()) == 0):
+                persists.append((idx, b))
+
+        start = 0
+        for idx, b in sorted(persists, key=lambda p: p[0]):
+            if idx >= start:
+                self.push(timestamps[start:idx + 1], values[start:idx + 1])
+                start = idx + 1
+
+            self.persist(int(timestamps[idx]), b)
 
+        if start < len(timestamps):
+            self.push(timestamps[start:], values[start:])
+
+        self.rollups.update(timestamps, values)
+
+        previous = self.last_value if len(values) == 1 else float(values[-2])
+        value = float(values[-1])
         if math.isnan(value):
             value = None
 
-        if value is not None and self.last_value is not None:
-            change = value - self.last_value
+        if previous is not None and math.isnan(previous):
+            previous = None
 
         if value is not None and self.events_enabled:
             self.context.client.emit_event('statd.{0}.pulse'.format(self.name), {
                 'value': value,
-                'change': change,
+                'change': value - previous if previous is not None else None,
                 'nolog': True
             })
 
-        last_in_range = True
-        if self.last_value is not None:
-            if (self.alerts['alert_low_enabled']) and (self.last_value < self.alerts['alert_low']):
-                last_in_range = False
-            elif (self.alerts['alert_high_enabled']) and (self.last_value > self.alerts['alert_high']):
-                last_in_range = False
-
+        high, low = self.evaluator.crossings(self.last_value, values)
         self.last_value = value
 
-        if value is not None:
-            if last_in_range:
-                if self.alerts['alert_high_enabled']:
-                    if value > self.alerts['alert_high']:
-                        self.emit_alert_high()
-                if self.alerts['alert_low_enabled']:
-                    if value < self.alerts['alert_low']:
-                        self.emit_alert_low()
+        if high is not None:
+            self.emit_alert('high', high)
 
-    def persist(self, timestamp, buffer, bucket):
-        def doit():
-            count = bucket.interval.total_seconds() / self.config.buckets[0].interval.total_seconds()
-            data = self.bucket_buffers[0].data
-            mean = np.mean(list(zip(*data[-count:]))[1])
-            buffer.push(timestamp, mean)
+        if low is not None:
+            self.emit_alert('low', low)
 
-        threadpool.apply(doit)
+    def push(self, timestamps, values):
+        self.primary_buffer.push_many(timestamps, values)
+        total = float(values.sum())
+        for acc in self.accumulators.values():
+            acc[0] += total
+            acc[1] += len(values)
 
-    def query(self, start, end, frequency):
-        self.logger.debug('Query: start={0}, end={1}, frequency={2}'.format(start, end, frequency))
+    @property
+    def pending_count(self):
+        return sum(b.pending_count for b in self.bucket_buffers[1:])
+
+    def flush(self, sync=True):
+        return sum(b.flush(sync) for b in self.bucket_buffers[1:])
+
+    def persist(self, timestamp, bucket):
+        acc = self.accumulators[bucket.index]
+        mean = acc[0] / acc[1] if acc[1] else float('nan')
+        acc[0], acc[1] = 0.0, 0
+        threadpool.apply(self.bucket_buffers[bucket.index].push, (timestamp, mean))
+
+    def query(self, start, end, frequency, aggregate='avg'):
+        self.logger.debug('Query: start={0}, end={1}, frequency={2}, aggregate={3}'.format(
+            start, end, frequency, aggregate
+        ))
+
+        resampler = RESAMPLERS[aggregate]
+        tier = self.rollups.plan(to_epoch(start), pd.to_timedelta(frequency).total_seconds())
+        if tier:
+            def doit():
+                timestamps, values = tier.query(to_epoch(start), to_epoch(end), aggregate)
+                series = pd.Series(values, index=pd.to_datetime(timestamps, unit='s'))
+                return getattr(series.resample(frequency), resampler)().interpolate()
+
+            return threadpool.apply(doit)
+
+        # No rollup tier reaches back far enough, go through the raw buckets
         buckets = list(self.config.get_covered_buckets(start, end))
 
         def doit():
@@ -211,52 +279,41 @@ class DataSource(object):
 
             df = df.reset_index().drop_duplicates(subset='index').set_index('index')
             if len(buckets):
-                df = df.sort()[0]
+                df = df.sort_index()[0]
                 df = df[start:end]
-                df = df.resample(frequency, how='mean').interpolate()
+                df = getattr(df.resample(frequency), resampler)().interpolate()
             return df
 
         return threadpool.apply(doit)
 
     def check_alerts(self):
-        if self.last_value is not None:
-            if self.alerts['alert_high_enabled']:
-                if self.last_value > self.alerts['alert_high']:
-                    self.emit_alert_high()
-
-            if self.alerts['alert_low_enabled']:
-                if self.last_value < self.alerts['alert_low']:
-                    self.emit_alert_low()
-
-    def emit_alert_high(self):
-        unit, last_value = self.context.client.call_sync('stat.normalize', self.name, self.last_value)
-        unit, alert_high = self.context.client.call_sync('stat.normalize', self.name, self.alerts['alert_high'])
-
-        if last_value:
-            self.context.client.call_sync('alert.emit', {
-                'name': 'stat.{0}.too_high'.format(self.name),
-                'description': 'Value of {0} has exceeded maximum permissible value {1}. Current {2}'.format(
-                    self.name,
-                    str(alert_high) + unit,
-                    str(last_value) + unit
-                ),
-                'severity': 'WARNING'
-            })
+        high, low = self.evaluator.current(self.last_value)
+        if high is not None:
+            self.emit_alert('high', high)
+
+        if low is not None:
+            self.emit_alert('low', low)
+
+    def emit_alert(self, kind, value):
+        units = self.context.get_units()
+        unit, value = units.normalize(self.name, value)
+        unit, threshold = units.normalize(self.name, self.alerts['alert_{0}'.format(kind)])
+        if not value:
+            return
 
-    def emit_alert_low(self):
-        unit, last_value = self.context.client.call_sync('stat.normalize', self.name, self.last_value)
-        unit, alert_low = self.context.client.call_sync('stat.normalize', self.name, self.alerts['alert_low'])
+        if kind == 'high':
+            description = 'Value of {0} has exceeded maximum permissible value {1}. Current {2}'
+        else:
+            description = 'Value of {0} has gone under minimum permissible value {1}. Current {2}'
 
-        if last_value:
+        try:
             self.context.client.call_sync('alert.emit', {
-                'name': 'stat.{0}.too_high'.format(self.name),
-                'description': 'Value of {0} has gone under minimum permissible value {1}. Current {2}'.format(
-                    self.name,
-                    str(alert_low) + unit,
-                    str(last_value) + unit
-                ),
+                'name': 'stat.{0}.too_{1}'.format(self.name, kind),
+                'description': description.format(self.name, str(threshold) + unit, str(value) + unit),
                 'severity': 'WARNING'
             })
+        except RpcException as err:
+            self.logger.warning('Cannot emit {0} alert: {1}'.format(kind, str(err)))
 
 
 class InputServer(object):
@@ -273,15 +330,22 @@ class InputServer(object):
         gevent.kill(self.thread)
 
     def handle(self, socket, address):
-        fd = socket.makefile()
+        remainder = b''
         while True:
-            line = fd.readline()
-            if not line:
+            data = socket.recv(CHUNK_SIZE)
+            if not data:
                 break
 
-            name, value, timestamp = line.split()
-            ds = self.context.get_data_source(name)
-            ds.submit(int(timestamp), float(value))
+            names, timestamps, values, remainder = parse_buffer(remainder + data)
+            self.context.submit_points(names, timestamps, values)
+
+            if len(remainder) > CHUNK_SIZE:
+                self.context.logger.warning('Discarding {0} bytes of unterminated input'.format(len(remainder)))
+                remainder = b''
+
+        if remainder.strip():
+            names, timestamps, values, _ = parse_buffer(remainder + b'\n')
+            self.context.submit_points(names, timestamps, values)
 
         socket.shutdown(gevent.socket.SHUT_RDWR)
         socket.close()
@@ -346,6 +410,9 @@ class OutputService(RpcService):
         end = params.pop('end', datetime.utcnow())
         timespan = params.pop('timespan', None)
         frequency = params.pop('frequency', '10S')
+        aggregate = params.pop('consolidation', 'avg')
+        fmt = params.pop('format', 'text')
+        chunk_size = params.pop('chunk_size', DEFAULT_CHUNK_SIZE)
 
         if start is None and timespan is None:
             raise RpcException(errno.EINVAL, 'Either "start" or "timespan" is required')
@@ -362,12 +429,22 @@ class OutputService(RpcService):
         if end.tzinfo:
             end = local_to_utc(end)
 
+        if fmt == 'columnar':
+            names = [data_source] if type(data_source) is str else data_source
+            for ds_name in names:
+                if ds_name not in self.context.data_sources:
+                    raise RpcException(errno.ENOENT, 'Data source {0} not found'.format(ds_name))
+
+            results = [self.context.data_sources[n].query(start, end, frequency, aggregate) for n in names]
+            yield from columnar_chunks(names, results, chunk_size)
+            return
+
         if type(data_source) is str:
             if data_source not in self.context.data_sources:
                 raise RpcException(errno.ENOENT, 'Data source {0} not found'.format(data_source))
 
             ds = self.context.data_sources[data_source]
-            df = ds.query(start, end, frequency)
+            df = ds.query(start, end, frequency, aggregate)
             for i in range(len(df)):
                 yield str(df[i])
 
@@ -380,7 +457,7 @@ class OutputService(RpcService):
                     raise RpcException(errno.ENOENT, 'Data source {0} not found'.format(ds_name))
 
                 ds = self.context.data_sources[ds_name]
-                final[ds_name] = ds.query(start, end, frequency)
+                final[ds_name] = ds.query(start, end, frequency, aggregate)
 
             for i in range(len(final)):
                 yield [str(final[col][i]) for col in data_source]
@@ -416,21 +493,21 @@ class AlertService(RpcService):
         ds.check_alerts()
 
 
-class DataPoint(tables.IsDescription):
-    timestamp = tables.Time32Col()
-    value = tables.FloatCol()
-
-
 class Main(object):
     def __init__(self):
         self.client = None
         self.server = None
         self.datastore = None
-        self.hdf = None
-        self.hdf_group = None
+        self.storage = None
+        self.storage_type = DEFAULT_STORAGE
         self.config = None
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.flush_batch = DEFAULT_FLUSH_BATCH
+        self.flush_thread = None
         self.logger = logging.getLogger('statd')
         self.data_sources = {}
+        self.ingested = 0
+        self.units = UnitTable()
 
     def init_datastore(self):
         try:
@@ -449,28 +526,27 @@ class Main(object):
             directory = '/var/tmp/statd'
             if not os.path.exists(directory):
                 os.makedirs(directory)
-        self.hdf = tables.open_file(os.path.join(directory, DEFAULT_DBFILE), mode='a')
-        if not hasattr(self.hdf.root, 'stats'):
-            self.hdf.create_group('/', 'stats')
-
-        self.hdf_group = self.hdf.root.stats
 
-    def request_table(self, name):
-        try:
-            if hasattr(self.hdf_group, name):
-                return getattr(self.hdf_group, name)
-
-            return self.hdf.create_table(self.hdf_group, name, DataPoint, name)
-        except Exception as e:
-            self.logger.error(str(e))
+        path = os.path.join(directory, DEFAULT_RINGDIR if self.storage_type == 'mmap' else DEFAULT_DBFILE)
+        self.storage = BACKENDS[self.storage_type](path)
+        self.logger.info('Using {0} storage at {1}'.format(self.storage_type, path))
 
     def init_alert_config(self, name):
         config_name = name if self.datastore.exists('statd.alerts', ('id', '=', name)) else 'default'
         alert_config = self.datastore.get_by_id('statd.alerts', config_name)
         return alert_config
 
+    def get_units(self):
+        if not self.units.loaded:
+            try:
+                self.units.load(self.client.call_sync('stat.get_units'))
+            except RpcException as err:
+                self.logger.warning('Cannot load stat units: {0}'.format(str(err)))
+
+        return self.units
+
     def get_data_source(self, name):
-        if name not in list(self.data_sources.keys()):
+        if name not in self.data_sources:
             config = DataSourceConfig(self.datastore, name)
             alert_config = self.init_alert_config(name)
             ds = DataSource(self, name, config, alert_config)
@@ -479,6 +555,41 @@ class Main(object):
 
         return self.data_sources[name]
 
+    def submit_points(self, names, timestamps, values):
+        for name, ts, vals in group_points(names, timestamps, values):
+            self.get_data_source(name).submit_many(ts, vals)
+
+        self.ingested += len(values)
+
+    def flush(self):
+        def doit():
+            start = time.time()
+            depth = 0
+            for ds in list(self.data_sources.values()):
+                depth += ds.pending_count
+                ds.flush(sync=False)
+
+            self.storage.flush()
+            return depth, time.time() - start
+
+        depth, latency = threadpool.apply(doit)
+        return depth, latency
+
+    def flush_worker(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            try:
+                depth, latency = self.flush()
+            except Exception as err:
+                self.logger.error('Cannot flush data sources: {0}'.format(str(err)))
+                continue
+
+            now = int(time.time())
+            ingested, self.ingested = self.ingested, 0
+            self.get_data_source('fnstatd.flush.queue_depth').submit(now, depth)
+            self.get_data_source('fnstatd.flush.latency').submit(now, latency)
+            self.get_data_source('fnstatd.ingest.rate').submit(now, ingested / self.flush_interval)
+
     def register_schemas(self):
         self.client.register_schema('GetStatsParams', {
             'type': 'object',
@@ -487,7 +598,10 @@ class Main(object):
                 'start': {'type': 'datetime'},
                 'end': {'type': 'datetime'},
                 'timespan': {'type': 'integer'},
-                'frequency': {'type': 'string'}
+                'frequency': {'type': 'string'},
+                'consolidation': {'type': 'string', 'enum': list(AGGREGATES)},
+                'format': {'type': 'string', 'enum': ['text', 'columnar']},
+                'chunk_size': {'type': 'integer', 'minimum': 1}
             }
         })
 
@@ -535,6 +649,16 @@ class Main(object):
     def die(self):
         self.logger.warning('Exiting')
         self.server.stop()
+        if self.flush_thread:
+            gevent.kill(self.flush_thread)
+
+        if self.storage:
+            self.logger.info('Flushing {0} pending data points'.format(
+                sum(ds.pending_count for ds in self.data_sources.values())
+            ))
+            self.flush()
+            self.storage.close()
+
         self.client.disconnect()
         sys.exit(0)
 
@@ -547,6 +671,12 @@ class Main(object):
     def main(self):
         parser = argparse.ArgumentParser()
         parser.add_argument('-c', metavar='CONFIG', default=DEFAULT_CONFIGFILE, help='Middleware config file')
+        parser.add_argument('--flush-interval', type=int, default=DEFAULT_FLUSH_INTERVAL,
+                            help='Seconds between flushes of buffered data points')
+        parser.add_argument('--flush-batch', type=int, default=DEFAULT_FLUSH_BATCH,
+                            help='Data points buffered per data source before a flush (1 disables buffering)')
+        parser.add_argument('--storage', choices=sorted(BACKENDS), default=DEFAULT_STORAGE,
+                            help='Storage backend for the persistent buckets')
         args = parser.parse_args()
         configure_logging('/var/log/fnstatd.log', 'DEBUG')
         setproctitle('fnstatd')
@@ -558,10 +688,14 @@ class Main(object):
 
         self.server = InputServer(self)
         self.config = args.c
+        self.flush_interval = args.flush_interval
+        self.flush_batch = max(args.flush_batch, 1)
+        self.storage_type = args.storage
         self.init_datastore()
         self.init_dispatcher()
         self.init_database()
         self.server.start()
+        self.flush_thread = gevent.spawn(self.flush_worker)
         self.logger.info('Started')
         self.checkin()
         self.client.wait_forever()
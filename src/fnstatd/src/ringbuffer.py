@@ -26,11 +26,48 @@
 #####################################################################
 
 
+import os
 import time
+import logging
+import threading
 import numpy as np
 import pandas as pd
 
 
+RING_MAGIC = b'FNSTATRB'
+RING_VERSION = 1
+RING_HEADER_SIZE = 4096
+RING_HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('reserved', '<u4'),
+    ('size', '<i8'),
+    ('head', '<i8'),
+    ('tail', '<i8')
+])
+RING_ROW = np.dtype([('timestamp', '<i8'), ('value', '<f8')])
+
+
+def advance(head, tail, size, count):
+    # Same head/tail movement as pushing count items one by one
+    used = (tail - head) % size
+    tail = (tail + count) % size
+    head = (tail - min(used + count, size - 1)) % size
+    return head, tail
+
+
+def write_wrapped(store, tail, size, rows):
+    # Writes rows as if they were pushed one by one starting at tail, only the
+    # last size rows survive anyway
+    count = len(rows)
+    rows = rows[-size:]
+    pos = (tail + count - len(rows)) % size
+    first = min(len(rows), size - pos)
+    store[pos:pos + first] = rows[:first]
+    if len(rows) > first:
+        store[:len(rows) - first] = rows[first:]
+
+
 class MemoryRingBuffer(object):
     def __init__(self, size):
         self.store = np.zeros(size, dtype='M8[s],f8')
@@ -78,54 +115,78 @@ class MemoryRingBuffer(object):
         if self.head == self.tail:
             self.head = (self.head + 1) % self.size
 
+    def push_many(self, timestamps, values):
+        rows = np.empty(len(timestamps), dtype=self.store.dtype)
+        rows['timestamp'] = timestamps
+        rows['value'] = values
+        write_wrapped(self.store, self.tail, self.size, rows)
+        self.head, self.tail = advance(self.head, self.tail, self.size, len(rows))
+
     def pop(self):
         pass
 
 
 class PersistentRingBuffer(object):
-    def __init__(self, table, size):
+    def __init__(self, table, size, batch_size=1):
         self.table = table
         self.size = size
+        self.batch_size = batch_size
+        self.pending = []
+        # push() runs on the fnstatd threadpool while flushes and queries come
+        # from other threads, the lock keeps pending and head/tail consistent
+        self.lock = threading.RLock()
 
         if not hasattr(self.table.attrs, 'tail'):
             self.table.attrs.tail = 0
             self.table.attrs.head = 0
             self.fill_initial()
 
+        self.head = self.table.attrs.head
+        self.tail = self.table.attrs.tail
+
     @property
     def empty(self):
-        return self.table.attrs.head == self.table.attrs.tail
+        return self.head == self.tail and not self.pending
+
+    @property
+    def pending_count(self):
+        return len(self.pending)
 
     @property
     def used_count(self):
-        if self.empty:
-            return 0
+        with self.lock:
+            self.flush()
+            if self.empty:
+                return 0
 
-        if self.table.attrs.tail > self.table.attrs.head:
-            return self.table.attrs.tail - self.table.attrs.head - 1
+            if self.tail > self.head:
+                return self.tail - self.head - 1
 
-        if self.table.attrs.head > self.table.attrs.tail:
-            return (self.size - self.table.attrs.head) + self.table.attrs.tail - 1
+            if self.head > self.tail:
+                return (self.size - self.head) + self.tail - 1
 
     @property
     def data(self):
-        if self.empty:
-            return None
+        with self.lock:
+            self.flush()
+            if self.empty:
+                return None
 
-        if self.table.attrs.tail > self.table.attrs.head:
-            return self.table[self.table.attrs.head:self.table.attrs.tail]
+            if self.tail > self.head:
+                return self.table[self.head:self.tail]
 
-        if self.table.attrs.head > self.table.attrs.tail:
-            return np.concatenate((self.table[self.table.attrs.head:], self.table[:self.table.attrs.tail]))
+            if self.head > self.tail:
+                return np.concatenate((self.table[self.head:], self.table[:self.tail]))
 
     @property
     def df(self):
         if self.empty:
             return None
 
+        data = self.data
         return pd.DataFrame(
-            index=pd.to_datetime(self.data['timestamp'], unit='s', utc=True),
-            data=self.data['value']
+            index=pd.to_datetime(data['timestamp'], unit='s', utc=True),
+            data=data['value']
         )
 
     def fill_initial(self):
@@ -133,12 +194,142 @@ class PersistentRingBuffer(object):
         self.table.flush()
 
     def push(self, timestamp, value):
-        self.table[self.table.attrs.tail] = (timestamp, value)
-        self.table.attrs.tail = (self.table.attrs.tail + 1) % self.size
-        if self.table.attrs.head == self.table.attrs.tail:
-            self.table.attrs.head = (self.table.attrs.head + 1) % self.size
+        with self.lock:
+            self.pending.append((timestamp, value))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
 
-        self.table.flush()
+    def flush(self, sync=True):
+        with self.lock:
+            if not self.pending:
+                return 0
+
+            pending, self.pending = self.pending, []
+            count = len(pending)
+            rows = np.array(pending[-self.size:], dtype=self.table.dtype)
+            write_wrapped(self.table, (self.tail + count - len(rows)) % self.size, self.size, rows)
+            self.head, self.tail = advance(self.head, self.tail, self.size, count)
+
+            self.table.attrs.tail = self.tail
+            self.table.attrs.head = self.head
+            if sync:
+                self.table.flush()
+
+            return count
 
     def pop(self):
         pass
+
+
+class MmapRingBuffer(MemoryRingBuffer):
+    """
+    Fixed-size ring file: a header page holding head/tail followed by the
+    rows, both mapped with numpy.memmap. Pushing is a plain memory store into
+    the mapping and data returns slices of it, so nothing is copied unless the
+    ring wraps around. The kernel writes dirty pages back on its own, sync()
+    forces it.
+    """
+    def __init__(self, path, size, batch_size=1):
+        self.logger = logging.getLogger('MmapRingBuffer:{0}'.format(os.path.basename(path)))
+        self.path = path
+        self.size = size
+        self.batch_size = batch_size
+        self.dirty = 0
+        self.lock = threading.RLock()
+
+        if not self.valid():
+            self.create()
+
+        # Plain ndarray views of the mapping skip the np.memmap overhead on
+        # every item access
+        self.mapping = np.memmap(path, dtype=np.uint8, mode='r+')
+        mapping = self.mapping.view(np.ndarray)
+        self.header = mapping[:RING_HEADER.itemsize].view(RING_HEADER)
+        self.store = mapping[RING_HEADER_SIZE:].view(RING_ROW)
+        self.heads = self.header['head']
+        self.tails = self.header['tail']
+
+    @property
+    def head(self):
+        return int(self.heads[0])
+
+    @head.setter
+    def head(self, value):
+        self.heads[0] = value
+
+    @property
+    def tail(self):
+        return int(self.tails[0])
+
+    @tail.setter
+    def tail(self, value):
+        self.tails[0] = value
+
+    @property
+    def pending_count(self):
+        return self.dirty
+
+    @property
+    def df(self):
+        if self.empty:
+            return None
+
+        data = self.data
+        return pd.DataFrame(
+            index=pd.to_datetime(data['timestamp'], unit='s', utc=True),
+            data=data['value']
+        )
+
+    def valid(self):
+        if not os.path.exists(self.path):
+            return False
+
+        if os.path.getsize(self.path) != RING_HEADER_SIZE + self.size * RING_ROW.itemsize:
+            self.logger.warning('Ring file size changed, recreating')
+            return False
+
+        header = np.fromfile(self.path, dtype=RING_HEADER, count=1)
+        if len(header) != 1 or header['magic'][0] != RING_MAGIC or header['version'][0] != RING_VERSION:
+            self.logger.warning('Invalid ring file header, recreating')
+            return False
+
+        return int(header['size'][0]) == self.size
+
+    def create(self):
+        header = np.zeros(1, dtype=RING_HEADER)
+        header['magic'] = RING_MAGIC
+        header['version'] = RING_VERSION
+        header['size'] = self.size
+        with open(self.path, 'wb') as f:
+            f.write(header.tobytes())
+            f.truncate(RING_HEADER_SIZE + self.size * RING_ROW.itemsize)
+
+    def push(self, timestamp, value):
+        with self.lock:
+            super(MmapRingBuffer, self).push(timestamp, value)
+            self.dirty += 1
+
+    def push_many(self, timestamps, values):
+        with self.lock:
+            super(MmapRingBuffer, self).push_many(timestamps, values)
+            self.dirty += len(timestamps)
+
+    def flush(self, sync=True):
+        with self.lock:
+            count, self.dirty = self.dirty, 0
+
+        if sync:
+            self.sync()
+
+        return count
+
+    def sync(self):
+        self.mapping.flush()
+
+    def close(self):
+        if self.mapping is None:
+            return
+
+        self.sync()
+        self.mapping = self.header = self.store = None
+        self.heads = self.tails = None
@@ -0,0 +1,142 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import time
+import numpy as np
+
+
+AGGREGATES = ('avg', 'min', 'max', 'last')
+
+
+class RollupTier(object):
+    """
+    Fixed size ring of per-interval aggregates. Slot i holds the period
+    starting at a multiple of interval that maps onto it, a slot is reset
+    as soon as a newer period claims it.
+    """
+    dtype = [
+        ('timestamp', 'i8'),
+        ('min', 'f8'),
+        ('max', 'f8'),
+        ('sum', 'f8'),
+        ('count', 'i8'),
+        ('last', 'f8')
+    ]
+
+    def __init__(self, interval, retention):
+        self.interval = int(interval)
+        self.retention = int(retention)
+        self.size = max(self.retention // self.interval, 1)
+        self.store = np.zeros(self.size, dtype=self.dtype)
+        self.store['timestamp'] = -1
+        self.filled_since = None
+
+    def covers(self, start):
+        if self.filled_since is None:
+            return False
+
+        return start >= max(self.filled_since, time.time() - self.retention)
+
+    def update(self, timestamps, values):
+        valid = ~np.isnan(values)
+        if not valid.all():
+            timestamps = timestamps[valid]
+            values = values[valid]
+
+        if not len(values):
+            return
+
+        periods = timestamps - timestamps % self.interval
+        keys, inverse = np.unique(periods, return_inverse=True)
+        inverse = inverse.ravel()
+        positions = (keys // self.interval) % self.size
+        current = self.store['timestamp'][positions]
+
+        # Drop points older than whatever the slot already holds
+        keep = current <= keys
+        stale = keep & (current != keys)
+        self.store[positions[stale]] = [(k, np.inf, -np.inf, 0, 0, np.nan) for k in keys[stale]]
+
+        mins = np.full(len(keys), np.inf)
+        maxs = np.full(len(keys), -np.inf)
+        last = np.zeros(len(keys), dtype=np.int64)
+        np.minimum.at(mins, inverse, values)
+        np.maximum.at(maxs, inverse, values)
+        np.maximum.at(last, inverse, np.arange(len(values)))
+        sums = np.bincount(inverse, weights=values, minlength=len(keys))
+        counts = np.bincount(inverse, minlength=len(keys))
+
+        positions = positions[keep]
+        slots = self.store[positions]
+        slots['min'] = np.minimum(slots['min'], mins[keep])
+        slots['max'] = np.maximum(slots['max'], maxs[keep])
+        slots['sum'] += sums[keep]
+        slots['count'] += counts[keep]
+        slots['last'] = values[last[keep]]
+        self.store[positions] = slots
+
+        if self.filled_since is None:
+            self.filled_since = int(keys[0])
+
+    def query(self, start, end, aggregate='avg'):
+        """
+        Returns (timestamps, values) of the periods between start and end
+        (both in seconds since the epoch) in chronological order.
+        """
+        ts = self.store['timestamp']
+        rows = self.store[(ts >= start - start % self.interval) & (ts <= end) & (self.store['count'] > 0)]
+        rows = rows[np.argsort(rows['timestamp'])]
+
+        if aggregate == 'avg':
+            values = rows['sum'] / rows['count']
+        else:
+            values = rows[aggregate]
+
+        return rows['timestamp'], values
+
+
+class RollupEngine(object):
+    def __init__(self, tiers):
+        self.tiers = sorted(
+            (RollupTier(interval, retention) for interval, retention in tiers),
+            key=lambda t: t.interval
+        )
+
+    def update(self, timestamps, values):
+        for t in self.tiers:
+            t.update(timestamps, values)
+
+    def plan(self, start, step):
+        """
+        Picks the coarsest tier that is still at least as fine as step and
+        holds data back to start. Returns None if no tier qualifies.
+        """
+        for t in reversed(self.tiers):
+            if t.interval <= step and t.covers(start):
+                return t
+
+        return None
@@ -0,0 +1,147 @@
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+import os
+import logging
+import tables
+from urllib.parse import quote, unquote
+from ringbuffer import PersistentRingBuffer, MmapRingBuffer
+
+
+RING_SUFFIX = '.ring'
+
+
+class DataPoint(tables.IsDescription):
+    timestamp = tables.Time32Col()
+    value = tables.FloatCol()
+
+
+class StorageBackend(object):
+    """
+    Persistent storage of the secondary buckets. open_buffer() returns a ring
+    buffer for the given name, reusing the stored one when it exists.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def open_buffer(self, name, size, batch_size):
+        raise NotImplementedError()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class HDF5Backend(StorageBackend):
+    def __init__(self, path):
+        super(HDF5Backend, self).__init__(path)
+        self.hdf = tables.open_file(path, mode='a')
+        if not hasattr(self.hdf.root, 'stats'):
+            self.hdf.create_group('/', 'stats')
+
+        self.hdf_group = self.hdf.root.stats
+
+    def request_table(self, name):
+        try:
+            if hasattr(self.hdf_group, name):
+                return getattr(self.hdf_group, name)
+
+            return self.hdf.create_table(self.hdf_group, name, DataPoint, name)
+        except Exception as e:
+            self.logger.error(str(e))
+
+    def open_buffer(self, name, size, batch_size):
+        return PersistentRingBuffer(self.request_table(name), size, batch_size)
+
+    def flush(self):
+        self.hdf.flush()
+
+    def close(self):
+        self.hdf.close()
+
+
+class MmapBackend(StorageBackend):
+    def __init__(self, path):
+        super(MmapBackend, self).__init__(path)
+        self.buffers = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def get_filename(self, name):
+        return os.path.join(self.path, quote(name, safe='') + RING_SUFFIX)
+
+    def open_buffer(self, name, size, batch_size):
+        buffer = MmapRingBuffer(self.get_filename(name), size, batch_size)
+        self.buffers[name] = buffer
+        return buffer
+
+    def names(self):
+        for i in sorted(os.listdir(self.path)):
+            if i.endswith(RING_SUFFIX):
+                yield unquote(i[:-len(RING_SUFFIX)])
+
+    def flush(self):
+        # Stores into a shared mapping are in the page cache already, which is
+        # as far as HDF5Backend.flush() gets too, so leave writeback to the
+        # kernel and only msync() on close
+        pass
+
+    def close(self):
+        for buffer in self.buffers.values():
+            buffer.close()
+
+        self.buffers.clear()
+
+
+BACKENDS = {
+    'hdf5': HDF5Backend,
+    'mmap': MmapBackend
+}
+
+
+def convert_hdf5(source, backend):
+    # HDF5 tables are fixed-size rings too, so head, tail and row positions
+    # carry over as they are
+    with tables.open_file(source, mode='r') as hdf:
+        if not hasattr(hdf.root, 'stats'):
+            return
+
+        for table in hdf.root.stats:
+            rows = table.read()
+            if not len(rows):
+                continue
+
+            buffer = backend.open_buffer(table.name, len(rows), 1)
+            buffer.store['timestamp'] = rows['timestamp']
+            buffer.store['value'] = rows['value']
+            buffer.head = getattr(table.attrs, 'head', 0)
+            buffer.tail = getattr(table.attrs, 'tail', 0)
+            yield table.name, buffer.used_count
@@ -0,0 +1,131 @@
+#!/usr/local/bin/python3
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import sys
+import time
+import socket
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from ingest import CHUNK_SIZE, parse_buffer, group_points
+from ringbuffer import MemoryRingBuffer
+
+
+# Metric names as emitted by the collectd write_graphite plugin
+SAMPLE_METRICS = [
+    'localhost.cpu-{0}.cpu-user',
+    'localhost.cpu-{0}.cpu-system',
+    'localhost.cpu-{0}.cpu-idle',
+    'localhost.interface-igb{0}.if_octets.rx',
+    'localhost.interface-igb{0}.if_octets.tx',
+    'localhost.disk-ada{0}.disk_octets.read',
+    'localhost.disk-ada{0}.disk_octets.write',
+    'localhost.zfs_arc.cache_ratio-arc{0}',
+]
+
+
+def generate(sources, count, interval=10):
+    # One line per data source for every collection interval, like collectd does
+    names = [m.format(i) for i in range(max(sources // len(SAMPLE_METRICS), 1)) for m in SAMPLE_METRICS]
+    start = int(time.time()) - (count // len(names)) * interval
+    lines = []
+    for n in range(count):
+        name = names[n % len(names)]
+        timestamp = start + (n // len(names)) * interval
+        lines.append('{0} {1:.6f} {2}\n'.format(name, (n * 7919 % 1000) / 10.0, timestamp))
+
+    return ''.join(lines).encode('ascii'), len(names)
+
+
+def ingest_lines(data, size):
+    # Former InputServer.handle() behavior: parse and store one line at a time
+    buffers = {}
+    for line in data.decode('ascii').splitlines():
+        name, value, timestamp = line.split()
+        if name not in list(buffers.keys()):
+            buffers[name] = MemoryRingBuffer(size)
+
+        buffers[name].push(int(float(timestamp)), float(value))
+
+
+def ingest_chunks(data, size):
+    buffers = {}
+    remainder = b''
+    for offset in range(0, len(data), CHUNK_SIZE):
+        names, timestamps, values, remainder = parse_buffer(remainder + data[offset:offset + CHUNK_SIZE])
+        for name, ts, vals in group_points(names, timestamps, values):
+            if name not in buffers:
+                buffers[name] = MemoryRingBuffer(size)
+
+            buffers[name].push_many(ts.astype(np.int64), vals)
+
+
+def measure(name, count, fn, *args):
+    start = time.time()
+    fn(*args)
+    elapsed = time.time() - start
+    print('{0:<12} {1:>10.2f} s {2:>12.0f} points/s'.format(name, elapsed, count / elapsed))
+
+
+def replay(host, port, data, count):
+    sock = socket.create_connection((host, port))
+    start = time.time()
+    sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+    sock.recv(1)
+    elapsed = time.time() - start
+    sock.close()
+    print('{0:<12} {1:>10.2f} s {2:>12.0f} points/s'.format('replay', elapsed, count / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate collectd-style Graphite traffic for fnstatd')
+    parser.add_argument('-n', metavar='COUNT', type=int, default=1000000, help='Number of data points')
+    parser.add_argument('-s', metavar='SOURCES', type=int, default=512, help='Number of data sources')
+    parser.add_argument('--size', type=int, default=8640, help='Primary ring buffer size per data source')
+    parser.add_argument('--lines', action='store_true', help='Also benchmark the line-at-a-time ingest')
+    parser.add_argument('--host', help='Send the traffic to a running fnstatd instead')
+    parser.add_argument('--port', type=int, default=2003, help='fnstatd Graphite port')
+    args = parser.parse_args()
+
+    data, sources = generate(args.s, args.n)
+    print('{0} points, {1} data sources, {2} bytes'.format(args.n, sources, len(data)))
+
+    if args.host:
+        # fnstatd closes the connection once everything was ingested
+        replay(args.host, args.port, data, args.n)
+        return
+
+    measure('chunked', args.n, ingest_chunks, data, args.size)
+    if args.lines:
+        measure('lines', args.n, ingest_lines, data, args.size)
+
+
+if __name__ == '__main__':
+    main()
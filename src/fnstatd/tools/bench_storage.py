@@ -0,0 +1,114 @@
+#!/usr/local/bin/python3
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import warnings
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from storage import BACKENDS
+
+
+def measure(name, count, fn, *args):
+    start = time.time()
+    result = fn(*args)
+    elapsed = time.time() - start
+    print('{0:<8} {1:<8} {2:>10.3f} s {3:>12.0f} points/s'.format(name, fn.__name__, elapsed, count / elapsed))
+    return result
+
+
+def open_buffers(backend, sources, size, batch_size):
+    return [backend.open_buffer('localhost.disk-ada{0}.disk_octets.read#b0'.format(i), size, batch_size)
+            for i in range(sources)]
+
+
+def write(backend, buffers, rounds, interval):
+    # Every data source gets one consolidated point per round, with a flush
+    # like flush_worker() would do every few rounds
+    start = int(time.time()) - rounds * interval
+    for n in range(rounds):
+        for idx, buf in enumerate(buffers):
+            buf.push(start + n * interval, float((idx * 7919 + n) % 1000))
+
+        if n % 8 == 7:
+            for buf in buffers:
+                buf.flush(sync=False)
+
+            backend.flush()
+
+    for buf in buffers:
+        buf.flush(sync=False)
+
+    backend.flush()
+
+
+def read(backend, buffers):
+    return sum(len(buf.data) for buf in buffers)
+
+
+def run(name, path, args):
+    backend = BACKENDS[name](path)
+    buffers = measure(name, args.s * args.size, open_buffers, backend, args.s, args.size, args.batch)
+    measure(name, args.s * args.n, write, backend, buffers, args.n, 600)
+    measure(name, args.s * min(args.n, args.size), read, backend, buffers)
+    backend.close()
+
+    # Reopen to include loading the existing data
+    backend = BACKENDS[name](path)
+    buffers = measure(name, args.s * args.size, open_buffers, backend, args.s, args.size, args.batch)
+    measure(name, args.s * min(args.n, args.size), read, backend, buffers)
+    backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fnstatd storage backends')
+    parser.add_argument('-n', metavar='ROUNDS', type=int, default=2048, help='Points pushed per data source')
+    parser.add_argument('-s', metavar='SOURCES', type=int, default=256, help='Number of data sources')
+    parser.add_argument('--size', type=int, default=1008, help='Ring buffer size per data source')
+    parser.add_argument('--batch', type=int, default=32, help='Flush batch size of the HDF5 backend')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), action='append', help='Backends to benchmark')
+    parser.add_argument('--dir', help='Directory for the storage files (defaults to a temporary one)')
+    args = parser.parse_args()
+
+    # PyTables complains about data source names not being Python identifiers
+    warnings.filterwarnings('ignore', module='tables')
+    directory = args.dir or tempfile.mkdtemp(prefix='bench_storage.')
+    try:
+        for name in args.backend or sorted(BACKENDS):
+            run(name, os.path.join(directory, 'bench.{0}'.format(name)), args)
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
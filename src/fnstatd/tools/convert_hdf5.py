@@ -0,0 +1,60 @@
+#!/usr/local/bin/python3
+#+
+# Copyright 2017 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+from storage import MmapBackend, convert_hdf5
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert fnstatd HDF5 storage to memory-mapped ring files')
+    parser.add_argument('source', help='HDF5 file (stats.hdf)')
+    parser.add_argument('destination', help='Ring file directory (rings next to stats.hdf)')
+    parser.add_argument('-v', action='store_true', help='Print every converted data source')
+    args = parser.parse_args()
+
+    backend = MmapBackend(args.destination)
+    sources = 0
+    points = 0
+    try:
+        for name, count in convert_hdf5(args.source, backend):
+            sources += 1
+            points += count
+            if args.v:
+                print('{0}: {1} points'.format(name, count))
+    finally:
+        backend.close()
+
+    print('Converted {0} data sources, {1} points'.format(sources, points))
+    print('Start fnstatd with --storage mmap to use them')
+
+
+if __name__ == '__main__':
+    main()
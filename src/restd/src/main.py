@@ -4,6 +4,8 @@ import errno
 import falcon
 import gevent
 import glob
+import hashlib
+import hmac
 import importlib.machinery
 import json
 import logging
@@ -23,6 +25,10 @@ from serializers import JsonEncoder
 from swagger import SwaggerResource
 
 
+SESSION_TTL = 60
+SESSION_POOL_SIZE = 4
+
+
 class RESTWSGIHandler(WSGIHandler):
 
     def get_environ(self):
@@ -65,8 +71,90 @@ class JSONTranslator(object):
             resp.body = JsonEncoder(indent=True).encode(req.context['result'])
 
 
+class Session(object):
+    """
+    Credentials verified once by the dispatcher together with a pool of
+    dispatcher connections already logged in as that user.
+    """
+    def __init__(self, username, ttl, pool_size):
+        self.username = username
+        self.expires_at = time.monotonic() + ttl
+        self.pool_size = pool_size
+        self.idle = []
+
+    @property
+    def expired(self):
+        return self.expires_at < time.monotonic()
+
+    def acquire(self):
+        while self.idle:
+            client = self.idle.pop()
+            if client.connected:
+                return client
+
+        # Password was already verified for this session, so local socket
+        # login is sufficient here
+        client = Client()
+        client.connect('unix:')
+        client.login_user(self.username, '')
+        return client
+
+    def release(self, client):
+        if not self.expired and client.connected and len(self.idle) < self.pool_size:
+            self.idle.append(client)
+            return
+
+        client.disconnect()
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().disconnect()
+
+
+class SessionCache(object):
+    def __init__(self, ttl=SESSION_TTL, pool_size=SESSION_POOL_SIZE):
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self.salt = os.urandom(32)
+        self.sessions = {}
+
+    def key(self, auth):
+        # Never keep the Authorization header itself around
+        return hmac.new(self.salt, auth.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def get(self, auth):
+        key = self.key(auth)
+        session = self.sessions.get(key)
+        if session and session.expired:
+            del self.sessions[key]
+            session.close()
+            return
+
+        return session
+
+    def put(self, auth, username):
+        session = Session(username, self.ttl, self.pool_size)
+        self.sessions[self.key(auth)] = session
+        return session
+
+    def purge(self):
+        for key, session in list(self.sessions.items()):
+            if session.expired:
+                del self.sessions[key]
+                session.close()
+
+    def clear(self):
+        for session in self.sessions.values():
+            session.close()
+
+        self.sessions.clear()
+
+
 class AuthMiddleware(object):
 
+    def __init__(self, sessions):
+        self.sessions = sessions
+
     def process_request(self, req, resp):
         # Do not require auth to access index
         if req.relative_uri == '/':
@@ -79,9 +167,20 @@ class AuthMiddleware(object):
                 'Provide a Basic Authentication header',
                 ['Basic realm="FreeNAS"'],
             )
+
+        session = self.sessions.get(auth)
+        if session:
+            try:
+                req.context['client'] = session.acquire()
+                req.context['session'] = session
+                return
+            except (OSError, RpcException):
+                # Fall back to full authentication below
+                pass
+
         try:
             username, password = base64.b64decode(auth[6:]).decode('utf8').split(':', 1)
-        except binascii.Error:
+        except (binascii.Error, UnicodeDecodeError, ValueError):
             raise falcon.HTTPUnauthorized(
                 'Invalid Authorization token',
                 'Provide a valid Basic Authentication header',
@@ -93,6 +192,7 @@ class AuthMiddleware(object):
             client.connect('unix:')
             client.login_user(username, password, check_password=True)
             req.context['client'] = client
+            req.context['session'] = self.sessions.put(auth, username)
         except RpcException as e:
             if e.code == errno.EACCES:
                 raise falcon.HTTPUnauthorized(
@@ -104,7 +204,7 @@ class AuthMiddleware(object):
 
     def process_response(self, req, resp, resource):
         if 'client' in req.context:
-            req.context['client'].disconnect()
+            req.context['session'].release(req.context['client'])
 
 
 class RESTApi(object):
@@ -118,8 +218,9 @@ class RESTApi(object):
         self._used_schemas = set()
         self._services = {}
         self._tasks = {}
+        self.sessions = SessionCache()
         self.api = falcon.API(middleware=[
-            AuthMiddleware(),
+            AuthMiddleware(self.sessions),
             JSONTranslator(),
         ])
         self.api.add_route('/', SwaggerResource(self))
@@ -186,12 +287,21 @@ class RESTApi(object):
         self.load_plugins()
 
         server4 = WSGIServer(('0.0.0.0', 8889), self, handler_class=RESTWSGIHandler)
-        self._threads = [gevent.spawn(server4.serve_forever)]
+        self._threads = [
+            gevent.spawn(server4.serve_forever),
+            gevent.spawn(self.purge_sessions)
+        ]
         checkin()
         gevent.joinall(self._threads)
 
+    def purge_sessions(self):
+        while True:
+            gevent.sleep(self.sessions.ttl)
+            self.sessions.purge()
+
     def die(self, *args):
         gevent.killall(self._threads)
+        self.sessions.clear()
         sys.exit(0)
 
 